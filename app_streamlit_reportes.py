@@ -1,13 +1,82 @@
-import os
-from io import BytesIO
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from datetime import date, timedelta
+from pathlib import Path
 
 import pandas as pd
 import psycopg2
+import psycopg2.extensions
 import streamlit as st
-import plotly.express as px
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import base64
 
+from reportes_cache import DerivedCache, ResultCache, cache_key, create_result_cache, normalize_query
+from reportes_compare import COMPARISON_DIMENSIONS, COMPARISON_PERIODS, fetch_comparison, top_movers
+from reportes_db import PG_PASSWORD, PG_POOL_MAX, ConnectionPool, PoolTimeout, ReplicaRouter, create_pool, get_env
+from reportes_jobs import JobRunner, QueryJob, create_job_runner
+from reportes_prewarm import PREWARM_QUERIES, Prewarmer, create_prewarmer
+from reportes_profiling import (
+    PROFILE_LOG,
+    add_stage,
+    begin_profile,
+    current_profile,
+    end_profile,
+    recent_profiles,
+    stage,
+)
+from reportes_queries import (
+    active_insights_source,
+    active_sales_source,
+    active_search_backend,
+    detect_insights_rollup,
+    detect_sales_source,
+    detect_search_backend,
+    INSIGHT_FETCHERS,
+    fetch_insights,
+    fetch_search,
+    fetch_search_page,
+    fetch_search_summary,
+    summarize_search,
+)
+from reportes_search import parse_search
+from reportes_shared_cache import SharedCache, create_shared_cache
+from reportes_suggest import SuggestIndex, create_suggest_index, suggestion_query
+
+# Paged results (keyset pagination) instead of loading the whole result at once
+PAGINATED_RESULTS = get_env("PAGINATED_RESULTS", "0") == "1"
+SEARCH_PAGE_SIZE = int(get_env("SEARCH_PAGE_SIZE", "500"))
+
+# Widest year window offered by the filters
+MAX_YEARS = 15
+
+# Rows of the full result sent to the browser at a time
+GRID_WINDOW_ROWS = int(get_env("GRID_WINDOW_ROWS", "1000"))
+# Plotly figures kept for reuse across reruns
+FIGURE_CACHE_ENTRIES = 64
+
+AUDIT_TAB = "📋 Auditoría de Ventas"
+CHARTS_TAB = "📈 Insights & Análisis"
+
+SEARCH_SYNTAX_HELP = """
+**Sintaxis de búsqueda**
+- Varias palabras: todas deben aparecer; `"toner 85a"` busca la frase.
+- `cliente:` `producto:` `almacen:` buscan solo en ese campo.
+- `doc:F001-00012345` número exacto · `doc:F001-*` prefijo.
+- `desde:2024-01` `hasta:2024-06` (año, mes o día) dentro de la ventana de años.
+"""
+
+# Wait after a new search term before querying, so quick resubmissions coalesce
+SEARCH_DEBOUNCE_MS = int(get_env("SEARCH_DEBOUNCE_MS", "200"))
+# How often a waiting script checks whether a newer rerun superseded it
+QUERY_POLL_INTERVAL = 0.05
+# How often a page with background queries still running checks for their results
+JOB_POLL_INTERVAL = 0.5
+
+# Users who see the profiling panel (comma-separated)
+ADMIN_USERS = {u.strip() for u in get_env("ADMIN_USERS", "user").split(",") if u.strip()}
+
 # -----------------------------
 # Config & UI Aesthetics
 # -----------------------------
@@ -18,457 +87,444 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Custom CSS for an Ultra-Premium Look
-st.markdown("""
-    <style>
-    @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700;800&display=swap');
-    
-    :root {
-        --primary: #3b82f6;
-        --secondary: #6366f1;
-        --accent: #8b5cf6;
-        --bg-light: #f8fafc;
-        --text-main: #0f172a;
-        --text-sub: #64748b;
-        --card-bg: #ffffff;
-    }
-
-    /* Global Styles & Light Mode Enforcement */
-    .stApp {
-        background: radial-gradient(circle at top right, #f1f5f9, #ffffff) !important;
-        color: #1e293b !important;
-    }
-    
-    html, body, [data-testid="stSidebar"], [data-testid="stAppViewContainer"] {
-        font-family: 'Inter', sans-serif;
-        background-color: white !important;
-    }
+# Logo and stylesheet live in static/ and are served by Streamlit's static
+# file server (enableStaticServing in .streamlit/config.toml), so reruns only
+# send a link to them; without static serving they are inlined as before.
+APP_DIR = Path(__file__).parent
+STATIC_DIR = APP_DIR / "static"
+STATIC_URL = "app/static"
+LOGO_FILE = "expera_logo.webp"
+STYLES_FILE = "expera.css"
 
-    /* Force visibility of all text labels and headers */
-    label, p, span, h1, h2, h3, h4, .stMarkdown {
-        color: #1e293b !important;
-    }
+def static_serving() -> bool:
+    return bool(st.get_option("server.enableStaticServing"))
 
-    /* Clean Logo Container */
-    .main-header {
-        background-color: transparent;
-        padding: 10px 20px 20px 20px;
-        text-align: center;
-        margin-bottom: 10px;
-    }
+@st.cache_resource(show_spinner=False)
+def get_styles_html() -> str:
+    """Custom CSS for an Ultra-Premium Look: an @import of the static file, or its contents inlined."""
+    if static_serving():
+        return f"<style>@import url('{STATIC_URL}/{STYLES_FILE}');</style>"
+    return f"<style>\n{(STATIC_DIR / STYLES_FILE).read_text(encoding='utf-8')}</style>"
 
-    /* Move app content higher */
-    .block-container {
-        padding-top: 1rem !important;
-    }
+st.markdown(get_styles_html(), unsafe_allow_html=True)
 
-    /* Aggressive Hide Streamlit Branding & Footer */
-    #MainMenu {visibility: hidden;}
-    footer {visibility: hidden;}
-    header {visibility: hidden;}
-    [data-testid="stStatusWidget"] {visibility: hidden;}
-    .stAppDeployButton {display: none !important;}
-    [data-testid="stDecoration"] {display: none !important;}
-    
-    /* Target the specific Streamlit Cloud viewer badge containers */
-    div[class^="viewerBadge"] {display: none !important;}
-    div[class*="viewerBadge"] {display: none !important;}
-    .viewerBadge_container__1QS9H {display: none !important;}
-    
-    /* Move app content higher to compensate for hidden header */
-    .stAppViewContainer {
-        padding-bottom: 0px !important;
-    }
-    
-    /* Metrics Dashboard Positioning */
-    div[data-testid="stMetric"] {
-        background: rgba(255, 255, 255, 0.8) !important;
-        backdrop-filter: blur(10px) !important;
-        padding: 24px !important;
-        border-radius: 20px !important;
-        border: 1px solid rgba(226, 232, 240, 0.5) !important;
-        box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.05) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-    }
-    
-    div[data-testid="stMetric"]:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 20px 25px -5px rgba(59, 130, 246, 0.1) !important;
-        border-color: var(--primary) !important;
-    }
-
-    [data-testid="stMetricValue"] {
-        font-weight: 800;
-        font-size: 2.2rem !important;
-        color: var(--text-main) !important;
-        letter-spacing: -0.02em;
-    }
-    
-    [data-testid="stMetricLabel"] {
-        font-weight: 600;
-        text-transform: uppercase;
-        letter-spacing: 0.1em;
-        font-size: 0.7rem !important;
-        color: var(--text-sub) !important;
-    }
-    
-    /* Unified Search Bar & Filter Button Style */
-    div[data-testid="stTextInput"] > div[data-baseweb="input"],
-    div[data-testid="stPopover"] > button,
-    .stTextInput input {
-        border-radius: 20px !important;
-        border: 1px solid rgba(226, 232, 240, 0.8) !important;
-        background-color: white !important;
-        color: #1e293b !important;
-        box-shadow: 0 10px 30px -10px rgba(0,0,0,0.05) !important;
-        transition: all 0.4s cubic-bezier(0.4, 0, 0.2, 1) !important;
-    }
-    
-    div[data-testid="stTextInput"] input {
-        padding: 0 30px !important;
-        font-size: 1.1rem !important;
-        height: 60px !important;
-        background-color: white !important;
-        color: #1e293b !important;
-    }
-
-    div[data-testid="stPopover"] > button {
-        width: 100% !important;
-        color: var(--text-sub) !important;
-        font-weight: 500 !important;
-        font-size: 1rem !important;
-        padding: 0 25px !important;
-    }
-    
-    /* Interactive States (Unified) */
-    div[data-testid="stTextInput"] > div[data-baseweb="input"]:focus-within,
-    div[data-testid="stPopover"] > button:hover {
-        border-color: var(--primary) !important;
-        box-shadow: 0 0 0 4px rgba(59, 130, 246, 0.1) !important;
-        transform: translateY(-2px);
-        color: var(--primary) !important;
-    }
-
-    /* Feature Cards (Landing Page) */
-    .feature-card {
-        background: rgba(255, 255, 255, 0.7) !important;
-        backdrop-filter: blur(12px) !important;
-        padding: 48px 32px;
-        border-radius: 32px;
-        border: 1px solid rgba(255, 255, 255, 0.4);
-        text-align: center;
-        height: 340px;
-        box-shadow: 0 10px 25px -5px rgba(0, 0, 0, 0.05);
-        transition: all 0.5s cubic-bezier(0.4, 0, 0.2, 1);
-        display: flex;
-        flex-direction: column;
-        justify-content: center;
-        align-items: center;
-    }
-
-    .feature-card:hover {
-        transform: translateY(-12px) scale(1.02);
-        background: white !important;
-        box-shadow: 0 30px 50px -12px rgba(59, 130, 246, 0.15);
-        border-color: var(--primary);
-    }
+# -----------------------------
+# Database Engine
+# -----------------------------
+@st.cache_resource(show_spinner=False)
+def get_pool() -> ConnectionPool | ReplicaRouter:
+    """Process-wide connection pool (or replica router) shared by every session."""
+    return create_pool()
 
-    .feature-card-icon {
-        font-size: 54px;
-        margin-bottom: 24px;
-        filter: drop-shadow(0 10px 10px rgba(0,0,0,0.1));
-    }
+@st.cache_resource(ttl=600, show_spinner=False)
+def init_query_backends() -> tuple[str, str, str]:
+    """
+    Picks the sales source (fact table or live ERP tables), the search
+    predicate (trigram indexes or ILIKE) and the Insights source (monthly
+    rollup or detail); re-checked every 10 minutes.
+    """
+    try:
+        with get_pool().connection() as conn:
+            detect_sales_source(conn)
+            detect_search_backend(conn)
+            detect_insights_rollup(conn)
+    except Exception:
+        # Unreachable database or missing catalog access: keep the live/ILIKE/detail fallback
+        pass
+    return active_sales_source(), active_search_backend(), active_insights_source()
 
-    .feature-card h3 {
-        color: var(--text-main);
-        margin-bottom: 12px;
-        font-weight: 800;
-        font-size: 1.5rem;
-    }
+@st.cache_resource(show_spinner=False)
+def get_query_executor() -> ThreadPoolExecutor:
+    """Threads that run queries while the script thread stays interruptible."""
+    return ThreadPoolExecutor(max_workers=PG_POOL_MAX, thread_name_prefix="expera-query")
 
-    .feature-card p {
-        color: var(--text-sub);
-        line-height: 1.7;
-        font-size: 0.95rem;
-    }
+def yield_to_rerun() -> None:
+    """
+    Streamlit interrupt point: reading session state raises RerunException
+    here when a newer run (e.g. a new search term) has been requested.
+    """
+    st.session_state.get("global_search_premium")
 
-    /* Login Box */
-    .login-container {
-        max-width: 450px;
-        margin: 100px auto;
-        padding: 40px;
-        background: white;
-        border-radius: 32px;
-        box-shadow: 0 25px 50px -12px rgba(0, 0, 0, 0.1);
-        text-align: center;
-        border: 1px solid #e2e8f0;
-    }
+def wait_unless_superseded(seconds: float) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        yield_to_rerun()
+        time.sleep(QUERY_POLL_INTERVAL)
 
-    .stForm {
-        background-color: white !important;
-        border-radius: 24px !important;
-        border: 1px solid #f1f5f9 !important;
-    }
+def run_cancellable(fetch, *args):
+    """
+    Runs ``fetch(conn, *args)`` on a worker thread. If this script run is
+    superseded while waiting, the statement is cancelled on the server
+    instead of running on for a result nobody will see.
+    """
+    lock = threading.Lock()
+    state = {"conn": None, "cancelled": False}
 
-    /* Interactive Popover Style */
-    div[data-testid="stPopover"] > button {
-        height: 60px !important;
-        min-height: 60px !important;
-        width: 100% !important;
-        color: #64748b !important;
-        font-weight: 500 !important;
-        font-size: 1rem !important;
-        padding: 0 25px !important;
-        background-color: white !important;
-        border: 2px solid #f1f5f9 !important;
-    }
+    def work():
+        start = time.perf_counter()
+        with get_pool().connection() as conn:
+            add_stage("checkout", time.perf_counter() - start)
+            with lock:
+                if state["cancelled"]:
+                    return None
+                state["conn"] = conn
+            try:
+                return fetch(conn, *args)
+            finally:
+                # Never cancel a connection that is back in the pool
+                with lock:
+                    state["conn"] = None
 
-    /* Interactive Buttons */
-    .stButton button {
-        border-radius: 16px !important;
-        height: 55px !important;
-        font-weight: 700 !important;
-        background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%) !important;
-        color: white !important;
-        border: none !important;
-        padding: 0 30px !important;
-        transition: all 0.3s cubic-bezier(0.4, 0, 0.2, 1) !important;
-        text-transform: uppercase;
-        letter-spacing: 1px;
-    }
-    
-    .stButton button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 10px 20px rgba(59, 130, 246, 0.3) !important;
-        filter: brightness(1.1);
-    }
+    # The copied context carries the active profile into the worker
+    future = get_query_executor().submit(contextvars.copy_context().run, work)
+    try:
+        while True:
+            try:
+                return future.result(timeout=QUERY_POLL_INTERVAL)
+            except FutureTimeout:
+                yield_to_rerun()
+    except BaseException:
+        with lock:
+            state["cancelled"] = True
+            if state["conn"] is not None:
+                state["conn"].cancel()
+        raise
 
-    /* Modern Tabs */
-    .stTabs [data-baseweb="tab-list"] {
-        background-color: #f1f5f9;
-        border-radius: 16px;
-        padding: 6px;
-        gap: 10px;
-    }
+def report_query_error(error: Exception) -> None:
+    """Shows a failed query in the UI (timeouts and connection problems; other errors stay silent)."""
+    if isinstance(error, psycopg2.extensions.QueryCanceledError):
+        st.error("⏱️ La consulta superó el tiempo máximo permitido. Acota la búsqueda o el histórico.")
+    elif isinstance(error, (PoolTimeout, psycopg2.OperationalError)):
+        st.error(f"🔌 Error de conexión: {str(error)}")
 
-    .stTabs [data-baseweb="tab"] {
-        height: 45px;
-        background-color: transparent;
-        border-radius: 12px;
-        font-weight: 700;
-        color: var(--text-sub);
-        border: none !important;
-        padding: 0 20px !important;
-    }
+def run_query(fetch, *args, default=None):
+    """Runs ``fetch(conn, *args)`` on a pooled connection, reporting connection errors in the UI."""
+    if not PG_PASSWORD:
+        st.error("🔑 Error: PG_PASSWORD no está configurada.")
+        return default
+    try:
+        if get_script_run_ctx() is not None:
+            return run_cancellable(fetch, *args)
+        # Outside a script run (deferred downloads) there is nothing to supersede
+        start = time.perf_counter()
+        with get_pool().connection() as conn:
+            add_stage("checkout", time.perf_counter() - start)
+            return fetch(conn, *args)
+    except Exception as e:
+        report_query_error(e)
+        return default
 
-    .stTabs [aria-selected="true"] {
-        background-color: white !important;
-        color: var(--primary) !important;
-        box-shadow: 0 4px 12px rgba(0, 0, 0, 0.05) !important;
-    }
+@st.cache_resource(show_spinner=False)
+def get_job_runner() -> JobRunner:
+    """Process-wide background query jobs, at most QUERY_MAX_CONCURRENT running at once."""
+    return create_job_runner(get_pool())
 
-    /* Custom Table Style */
-    .stDataFrame {
-        border: 1px solid #e2e8f0;
-        border-radius: 20px;
-        overflow: hidden;
-    }
+@st.cache_resource(show_spinner=False)
+def get_prewarmer() -> Prewarmer | None:
+    """Process-wide prewarmer of PREWARM_QUERIES, started by the first signed-in run."""
+    if not PREWARM_QUERIES:
+        return None
+    prewarmer = create_prewarmer(get_job_runner(), get_result_cache(), get_shared_cache())
+    prewarmer.start()
+    return prewarmer
 
-    /* Card Containers */
-    .info-card {
-        background: white;
-        padding: 25px;
-        border-radius: 20px;
-        border: 1px solid #ecf0f1;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.02);
-        margin-bottom: 20px;
-    }
+@st.cache_resource(show_spinner=False)
+def get_suggest_index() -> SuggestIndex:
+    """Process-wide autocomplete index, built and refreshed in the background."""
+    index = create_suggest_index(get_pool())
+    index.start()
+    return index
 
-    .info-card h3 {
-        color: var(--text-main);
-        margin-top: 0;
-        font-size: 1.25rem;
-    }
-    
-    /* Animation for results */
-    @keyframes fadeIn {
-        from { opacity: 0; transform: translateY(10px); }
-        to { opacity: 1; transform: translateY(0); }
-    }
-    .fade-in {
-        animation: fadeIn 0.5s ease-out forwards;
-    }
-    </style>
-""", unsafe_allow_html=True)
+SUGGESTION_ICONS = {"producto": "🏷️", "cliente": "👤", "doc": "🧾"}
 
-def get_env(name: str, default: str | None = None) -> str | None:
-    v = os.getenv(name, default)
-    if v is None or str(v).strip() == "":
-        return default
-    return str(v)
+def pick_suggestion():
+    """Replaces the search box with the picked suggestion's targeted search."""
+    choice = st.session_state.get("search_suggestion")
+    if choice:
+        st.session_state["global_search_premium"] = choice
+    st.session_state["search_suggestion"] = None
 
-# DB Credentials
-PG_HOST = get_env("PG_HOST", "localhost")
-PG_PORT = int(get_env("PG_PORT", "5432"))
-PG_DB = get_env("PG_DB", "upgradedb")
-PG_USER = get_env("PG_USER", "postgres")
-PG_PASSWORD = get_env("PG_PASSWORD", "")
+def render_suggestions(search_query: str):
+    """Exact products, clients and document numbers starting with the free words typed."""
+    search = parse_search(search_query)
+    if not search.terms or search.fields or search.docs or search.since or search.until:
+        return
+    suggestions = get_suggest_index().suggest(" ".join(search.terms))
+    if not suggestions:
+        return
+    labels = {suggestion_query(kind, value): f"{SUGGESTION_ICONS[kind]} {value}" for kind, value in suggestions}
+    st.pills(
+        "Sugerencias",
+        list(labels),
+        format_func=labels.get,
+        key="search_suggestion",
+        on_change=pick_suggestion,
+        label_visibility="collapsed",
+    )
 
-# -----------------------------
-# Database Engine
-# -----------------------------
-def get_conn():
+def background_query(kind: str, fetch, search_query: str, *args, default=None, watch: bool = True):
+    """
+    Result of ``fetch(conn, search_query, *args)`` from this session's
+    background job, or None while the job is queued or running (the script
+    moves on and, if ``watch``, watch_query_jobs() reruns it when the job is
+    done). The result is also put in the shared cache. Finished jobs are
+    dropped from the session, so results are only kept by the byte-capped
+    cache. Errors are shown once and the query is retried on the next rerun.
+    """
     if not PG_PASSWORD:
         st.error("🔑 Error: PG_PASSWORD no está configurada.")
+        return default
+    search_query = normalize_query(search_query)
+    key = cache_key(kind, search_query, *args)
+    jobs = st.session_state.setdefault("query_jobs", {})
+    job = jobs.get(kind)
+    if job is None or job.key != key:
+        if job is not None:
+            get_job_runner().release(job, get_script_run_ctx().session_id)
+        profile = current_profile()
+        job = get_job_runner().submit(
+            key, get_script_run_ctx().session_id, kind, shared_fetch(kind, fetch), search_query, *args,
+            on_result=lambda value: get_result_cache().put(key, value),
+            profile={"search": search_query, "explain": profile.explain} if profile is not None else None,
+        )
+        jobs[kind] = job
+    if not job.done():
+        if watch:
+            st.session_state.setdefault("pending_jobs", []).append(job)
         return None
+    del jobs[kind]
     try:
-        return psycopg2.connect(
-            host=PG_HOST,
-            port=PG_PORT,
-            database=PG_DB,
-            user=PG_USER,
-            password=PG_PASSWORD,
-            connect_timeout=5,
-        )
+        return job.result()
     except Exception as e:
-        st.error(f"🔌 Error de conexión: {str(e)}")
-        return None
+        report_query_error(e)
+        return default
 
-@st.cache_data(ttl=600, show_spinner=False)
-def perform_search(search_query: str, years: int = 5) -> pd.DataFrame:
+def forget_query_job(kind: str) -> None:
+    """Drops this session's finished job for ``kind`` once the result cache answers instead."""
+    jobs = st.session_state.get("query_jobs", {})
+    job = jobs.get(kind)
+    if job is not None and job.done():
+        del jobs[kind]
+
+def release_query_jobs(search_query: str | None = None, years: int | None = None) -> None:
+    """Lets go of this session's background jobs for any other search (all of them by default)."""
+    jobs = st.session_state.get("query_jobs", {})
+    keep = (normalize_query(search_query), years) if search_query is not None else None
+    for kind, job in list(jobs.items()):
+        if job.key[1:3] != keep:
+            get_job_runner().release(job, get_script_run_ctx().session_id)
+            del jobs[kind]
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_query_jobs(pending: list[QueryJob]):
+    """Reruns the page as soon as one of the background queries it is waiting for is done."""
+    if any(job.done() for job in pending):
+        st.rerun()
+
+def render_pending(message: str):
+    st.markdown(
+        f"<div style='text-align: center; padding: 60px; color: #64748b;'>⏳ {message}</div>",
+        unsafe_allow_html=True,
+    )
+
+# Sentinel returned by run_query() on failure so errors are never cached
+_QUERY_FAILED = object()
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache() -> ResultCache:
+    """Process-wide result cache shared by every session."""
+    return create_result_cache()
+
+@st.cache_resource(show_spinner=False)
+def get_shared_cache() -> SharedCache | None:
+    """Cache shared with the other app processes (SHARED_CACHE_DIR / SHARED_CACHE_REDIS), if configured."""
+    return create_shared_cache()
+
+def shared_fetch(kind: str, fetch):
+    """``fetch`` going through the cross-process cache when there is one."""
+    shared = get_shared_cache()
+    return fetch if shared is None else shared.wrap(kind, fetch)
+
+def cached_query(kind: str, fetch, search_query: str, *args, default=None):
+    """Serves ``fetch`` results from the shared cache, querying the database on a miss."""
+    cache = get_result_cache()
+    search_query = normalize_query(search_query)
+    key = cache_key(kind, search_query, *args)
+    with stage(f"query:{kind}") as s:
+        value = cache.get(key)
+        s["cache"] = "hit" if value is not None else "miss"
+        if value is None:
+            value = run_query(shared_fetch(kind, fetch), search_query, *args, default=_QUERY_FAILED)
+            if value is _QUERY_FAILED:
+                return default
+            cache.put(key, value)
+    return value
+
+def cached_search(search_query: str, years: int) -> pd.DataFrame | None:
     """
-    Optimized SQL query focused on performance and relevance.
-    Fetches all matching records without limits.
+    Detail result served from the cache only: exact entry, a wider year window,
+    or a shorter term refined down ("sams" -> "samsung"). None on a miss.
     """
-    conn = get_conn()
-    if not conn:
-        return pd.DataFrame()
-
-    sql = """
-    SELECT
-      cab.creado::date          AS "Fecha",
-      prod.nombre               AS "Producto",
-      cli.nombre                AS "Cliente",
-      det.cantidad              AS "Cant.",
-      det.precio_unitario_venta AS "Precio Unit.",
-      (det.cantidad * det.precio_unitario_venta) AS "Importe Total",
-      cab.numero                AS "Nº Documento",
-      alm.nombre                AS "Almacén",
-      vc.enlace_pdf             AS "Enlace PDF"
-    FROM cmrlz.notas_pedido_cab cab
-    JOIN cmrlz.notas_pedido_det det ON det.nota_pedido_id = cab.id
-    JOIN extcs.productos prod       ON prod.id = det.producto_id
-    LEFT JOIN tcros.direcciones dir ON dir.id = cab.direccion_cliente_id
-    LEFT JOIN tcros.personas cli    ON cli.id = dir.persona_id
-    LEFT JOIN extcs.almacenes alm   ON alm.id = cab.almacen_id
-    LEFT JOIN cmrlz.ventas_cab vc   ON vc.id = cab.venta_id
-    WHERE
-      cab.anulada IS FALSE
-      AND cab.venta_id IS NOT NULL
-      AND prod.servicio = FALSE
-      AND cab.creado >= %(min_date)s
+    with stage("cache:search") as s:
+        df = get_result_cache().get_window("search", search_query, years, MAX_YEARS)
+        s["cache"] = "hit" if df is not None else "miss"
+    return df
+
+def search_results(search_query: str, years: int, watch: bool = True) -> pd.DataFrame | None:
+    """Detail result from the cache or from a background job; None while the job runs."""
+    df = cached_search(search_query, years)
+    if df is None:
+        with stage("query:search", cache="miss", background=True):
+            df = background_query(
+                "search", fetch_search, search_query, years, default=pd.DataFrame(), watch=watch
+            )
+    else:
+        forget_query_job("search")
+    return df
+
+def search_page(search_query: str, years: int, page_size: int, after: tuple | None = None):
+    """One keyset page of results plus the cursor of the following page."""
+    return cached_query(
+        "page", fetch_search_page, search_query, years, page_size, after,
+        default=(pd.DataFrame(), None),
+    )
+
+def search_summary(search_query: str, years: int) -> dict | None:
+    """KPI totals computed in Postgres, independent of how many rows are loaded."""
+    return cached_query("summary", fetch_search_summary, search_query, years)
+
+def cached_background(kind: str, fetch, search_query: str, *args, default=None, watch: bool = True):
+    """Serves ``fetch`` results from the shared cache, or from a background job on a miss (None while it runs)."""
+    with stage(f"query:{kind}") as s:
+        value = get_result_cache().get(cache_key(kind, search_query, *args))
+        s["cache"] = "hit" if value is not None else "miss"
+        if value is None:
+            s["background"] = True
+            value = background_query(kind, fetch, search_query, *args, default=default, watch=watch)
+        else:
+            forget_query_job(kind)
+    return value
+
+# Columns of each Insights chart, for the empty frame drawn when its query fails
+INSIGHT_COLUMNS = {
+    "top_products": ["Producto", "Importe Total"],
+    "monthly": ["Fecha", "Importe Total"],
+    "top_clients": ["Cliente", "Importe Total"],
+}
+
+def search_insights(search_query: str, years: int, watch: bool = True) -> dict:
     """
-    
-    params = {
-        "min_date": date.today() - timedelta(days=365 * years)
-    }
+    Chart aggregates (top products, monthly revenue, top clients) computed in
+    Postgres by background jobs, one per chart so they run in parallel on
+    their own connections (a single job when the monthly rollup answers all
+    three in one query). Charts still being computed are missing from the dict.
+    """
+    empty = {name: pd.DataFrame(columns=columns) for name, columns in INSIGHT_COLUMNS.items()}
+    if active_insights_source(search_query) == "rollup":
+        return cached_background("insights", fetch_insights, search_query, years, default=empty, watch=watch) or {}
+    insights = {}
+    for name, fetch in INSIGHT_FETCHERS.items():
+        value = cached_background(name, fetch, search_query, years, default=empty[name], watch=watch)
+        if value is not None:
+            insights[name] = value
+    return insights
 
-    if search_query.strip():
-        sql += " AND (prod.nombre ILIKE %(q)s OR cli.nombre ILIKE %(q)s OR cab.numero::text ILIKE %(q)s)"
-        params["q"] = f"%{search_query.strip()}%"
-    
-    sql += " ORDER BY cab.creado DESC"
+@st.cache_resource(show_spinner=False)
+def get_export_queue():
+    """Process-wide background export jobs, written to EXPORT_SPOOL_DIR."""
+    from reportes_export_jobs import create_export_queue
+
+    queue = create_export_queue(get_pool())
+    queue.start()
+    return queue
+
+# format -> (label to prepare it, label to download it)
+EXPORT_BUTTONS = {
+    "xlsx": ("📥 PREPARAR AUDITORÍA (XLSX)", "📥 DESCARGAR AUDITORÍA (XLSX)"),
+    "csv": ("Preparar CSV", "Descargar CSV"),
+    "csv.gz": ("Preparar CSV comprimido (gzip)", "Descargar CSV comprimido (gzip)"),
+    "parquet": ("Preparar Parquet", "Descargar Parquet"),
+}
+
+def queue_export(fmt: str, search_query: str, years: int, total: int):
+    """Queues the export (or joins an identical one) for this session."""
+    from reportes_export_jobs import ExportQueueFull
 
     try:
-        df = pd.read_sql_query(sql, conn, params=params)
-        return df
-    except Exception:
-        return pd.DataFrame()
-    finally:
-        conn.close()
+        job = get_export_queue().submit(search_query, years, fmt, total=total)
+    except ExportQueueFull as e:
+        st.session_state["export_error"] = str(e)
+        return
+    st.session_state.setdefault("export_jobs", {})[fmt] = job
 
-def to_excel_bytes(df: pd.DataFrame) -> bytes:
+def export_control(fmt: str, search_query: str, years: int, total: int):
     """
-    Generates a professional Excel file with formatting, auto-column widths,
-    and a summary total row.
+    Button queueing the export, a disabled one while it is written, and the
+    download (from the spool file or the API) once it is done.
     """
-    output = BytesIO()
-    
-    # Create the Excel writer
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Reporte Detallado")
-        
-        workbook = writer.book
-        worksheet = writer.sheets["Reporte Detallado"]
-        
-        # Styles
-        from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-        
-        header_fill = PatternFill(start_color="1E293B", end_color="1E293B", fill_type="solid")
-        header_font = Font(color="FFFFFF", bold=True, size=12)
-        total_fill = PatternFill(start_color="F1F5F9", end_color="F1F5F9", fill_type="solid")
-        total_font = Font(bold=True, size=12)
-        currency_format = '"S/" #,##0.00'
-        
-        # Format Headers
-        for cell in worksheet[1]:
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center", vertical="center")
-
-        # Auto-adjust column widths and apply formats
-        for i, col in enumerate(df.columns):
-            column_letter = chr(65 + i) if i < 26 else f"{chr(64 + i // 26)}{chr(65 + i % 26)}"
-            
-            # Find max length in column
-            max_length = max(
-                df[col].astype(str).map(len).max(),
-                len(str(col))
-            ) + 4
-            worksheet.column_dimensions[column_letter].width = min(max_length, 50)
-            
-            # Apply format to 'Fecha'
-            if "Fecha" in col:
-                # Ensure data is datetime for Excel to format it correctly
-                # (Streamlit/Pandas might pass it as objects)
-                for row in range(2, len(df) + 2):
-                    cell = worksheet.cell(row=row, column=i+1)
-                    # Use standard Excel date format string
-                    cell.number_format = 'dd/mm/yyyy'
-            
-            # Apply currency format to 'Precio Unit.' and 'Importe Total'
-            if "Precio" in col or "Importe" in col:
-                for row in range(2, len(df) + 2):
-                    worksheet.cell(row=row, column=i+1).number_format = currency_format
+    from reportes_export_jobs import download_url
 
-        # Add Summary Row
-        last_row = len(df) + 2
-        
-        # Calculate and place the sum in the 'Importe Total' column first
-        try:
-            importe_col_idx = list(df.columns).index("Importe Total") + 1
-            total_sum = df["Importe Total"].sum()
-            
-            # Merge label from col 1 to the cell before the total
-            if importe_col_idx > 1:
-                worksheet.merge_cells(start_row=last_row, start_column=1, end_row=last_row, end_column=importe_col_idx-1)
-            
-            # Label
-            label_cell = worksheet.cell(row=last_row, column=1, value="RESUMEN TOTAL")
-            label_cell.font = total_font
-            label_cell.alignment = Alignment(horizontal="right")
-            
-            # Value
-            total_cell = worksheet.cell(row=last_row, column=importe_col_idx, value=total_sum)
-            total_cell.font = total_font
-            total_cell.fill = total_fill
-            total_cell.number_format = currency_format
-            total_cell.alignment = Alignment(horizontal="right")
-        except (ValueError, KeyError):
-            # Fallback if column not found
-            worksheet.cell(row=last_row, column=1, value="RESUMEN TOTAL (Columna no encontrada)").font = total_font
-
-    return output.getvalue()
+    prepare_label, label = EXPORT_BUTTONS[fmt]
+    jobs = st.session_state.setdefault("export_jobs", {})
+    job = jobs.get(fmt)
+    if job is not None and (job.search_query, job.years) != (normalize_query(search_query), years):
+        job = None
+    status = job.status if job is not None else None
+    if status == "done":
+        url = download_url(job)
+        if url:
+            st.link_button(label, url, width="stretch")
+        else:
+            st.download_button(
+                label=label,
+                data=job.read,
+                file_name=job.file_name,
+                mime=job.mime,
+                on_click="ignore",
+                width="stretch",
+                key=f"export_download_{fmt}",
+            )
+        return
+    if status in ("queued", "running"):
+        st.button(f"⏳ {label}", disabled=True, width="stretch", key=f"export_pending_{fmt}")
+        return
+    if status == "failed":
+        st.caption("⚠️ No se pudo generar el archivo, vuelve a intentarlo.")
+        report_query_error(job.error)
+    st.button(
+        prepare_label, width="stretch", key=f"export_start_{fmt}",
+        on_click=queue_export, args=(fmt, search_query, years, total),
+    )
+
+@st.fragment
+def render_exports(search_query: str, years: int, total: int):
+    """Export footer; its clicks rerun only this fragment."""
+    if "export_error" in st.session_state:
+        st.warning(st.session_state.pop("export_error"))
+    f_col1, f_col2, f_col3 = st.columns([1,1,1])
+    with f_col2:
+        export_control("xlsx", search_query, years, total)
+    with f_col3:
+        with st.popover("📦 OTROS FORMATOS", width="stretch"):
+            for fmt in ("csv", "csv.gz", "parquet"):
+                export_control(fmt, search_query, years, total)
+    pending = [job for job in st.session_state.get("export_jobs", {}).values() if not job.done()]
+    if pending:
+        watch_exports(pending)
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def watch_exports(pending: list):
+    """Progress of the exports being written; reruns the page as soon as one is done."""
+    if any(job.done() for job in pending):
+        st.rerun()
+    for job in pending:
+        name = job.file_name.split(".", 1)[1].upper()
+        if job.status == "queued":
+            st.progress(0.0, text=f"{name}: en cola...")
+        elif job.progress is None:
+            st.progress(0.0, text=f"{name}: {job.rows:,} filas escritas")
+        else:
+            st.progress(job.progress, text=f"{name}: {job.rows:,} de {job.total:,} filas")
 
 # -----------------------------
 # Authentication System
@@ -482,6 +538,7 @@ def check_password():
             and st.session_state["password"] == "Expera$$26%==UP"
         ):
             st.session_state["password_correct"] = True
+            st.session_state["user"] = st.session_state["username"]
             del st.session_state["password"]  # don't store password
             del st.session_state["username"]
         else:
@@ -524,6 +581,243 @@ def check_password():
 # Premium UI Layout & Logic
 # -----------------------------
 
+def render_results_table(df: pd.DataFrame):
+    """Styled audit grid."""
+    with stage("render:table", rows=len(df)):
+        st.dataframe(
+            df, 
+            use_container_width=True, 
+            height=550,
+            column_config={
+                "Fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
+                "Importe Total": st.column_config.NumberColumn("Importe", format="S/ %.2f"),
+                "Precio Unit.": st.column_config.NumberColumn("Precio", format="S/ %.2f"),
+                "Enlace PDF": st.column_config.LinkColumn("Factura PDF", display_text="Ver Factura"),
+            }
+        )
+
+@st.fragment
+def render_results_grid(df: pd.DataFrame, result_key: tuple):
+    """
+    Full result shown GRID_WINDOW_ROWS rows at a time, so the browser only
+    receives one window. Moving between windows reruns just this fragment.
+    """
+    if len(df) <= GRID_WINDOW_ROWS:
+        render_results_table(df)
+        return
+    state = st.session_state.get("results_window")
+    if state is None or state["key"] != result_key:
+        state = {"key": result_key, "window": 0}
+        st.session_state["results_window"] = state
+
+    def move(step: int):
+        state["window"] += step
+
+    last_window = (len(df) - 1) // GRID_WINDOW_ROWS
+    state["window"] = min(max(state["window"], 0), last_window)
+    first_row = state["window"] * GRID_WINDOW_ROWS
+    window = df.iloc[first_row:first_row + GRID_WINDOW_ROWS]
+    render_results_table(window)
+
+    w_prev, w_info, w_next = st.columns([1, 2, 1])
+    with w_prev:
+        st.button("◀ Anteriores", disabled=state["window"] == 0, on_click=move, args=(-1,), width="stretch")
+    with w_info:
+        st.markdown(
+            f"<div style='text-align: center; padding-top: 14px;'>Filas {first_row + 1:,}–"
+            f"{first_row + len(window):,} de {len(df):,}</div>",
+            unsafe_allow_html=True,
+        )
+    with w_next:
+        st.button("Siguientes ▶", disabled=state["window"] == last_window, on_click=move, args=(1,), width="stretch")
+
+@st.cache_resource(show_spinner=False)
+def get_figure_cache() -> DerivedCache:
+    """Process-wide Plotly figures, reused while their chart data is the same cached result."""
+    return DerivedCache(FIGURE_CACHE_ENTRIES)
+
+def top_products_figure(top_p: pd.DataFrame):
+    fig_bar = px.bar(
+        top_p, x="Importe Total", y="Producto", orientation='h',
+        color="Importe Total", color_continuous_scale="Viridis",
+        template="plotly_white"
+    )
+    fig_bar.update_layout(showlegend=False, height=450, margin=dict(l=0, r=0, t=10, b=0))
+    return fig_bar
+
+def monthly_figure(time_series: pd.DataFrame):
+    fig_line = px.line(
+        time_series, x="Fecha", y="Importe Total",
+        template="plotly_white", line_shape="spline"
+    )
+    fig_line.update_traces(line_color='#3b82f6', line_width=4, fill='tozeroy', fillcolor='rgba(59, 130, 246, 0.1)')
+    fig_line.update_layout(height=450, margin=dict(l=0, r=0, t=10, b=0))
+    return fig_line
+
+def top_clients_figure(top_c: pd.DataFrame):
+    return px.treemap(top_c, path=['Cliente'], values='Importe Total', color='Importe Total', color_continuous_scale='RdBu')
+
+def movers_figure(movers: pd.DataFrame):
+    """Revenue change of the top movers, gains in green and drops in red."""
+    movers = movers.sort_values("Variación")
+    fig = px.bar(movers, x="Variación", y=movers.columns[0], orientation="h", template="plotly_white")
+    fig.update_traces(marker_color=["#16a34a" if v > 0 else "#dc2626" for v in movers["Variación"]])
+    fig.update_layout(showlegend=False, height=450, margin=dict(l=0, r=0, t=10, b=0))
+    return fig
+
+def period_label(period: list[str]) -> str:
+    """"01/10/2026 – 18/10/2026" for an ISO (from, to excluded) pair."""
+    first = date.fromisoformat(period[0])
+    last = date.fromisoformat(period[1]) - timedelta(days=1)
+    return f"{first:%d/%m/%Y} – {last:%d/%m/%Y}"
+
+def comparison_metric(column, label: str, totals: dict, measure: str, money: bool = False):
+    """KPI of the current period with its change against the prior one."""
+    current, prior = totals[f"{measure}_actual"], totals[f"{measure}_anterior"]
+    fmt = (lambda v: f"S/ {v:,.2f}") if money else (lambda v: f"{v:,.0f}")
+    delta = f"{(current - prior) / prior:+.1%}" if prior else None
+    column.metric(label, fmt(current), delta, help=f"Periodo anterior: {fmt(prior)}")
+
+@st.fragment
+def render_comparison(search_query: str):
+    """
+    Current vs. prior period of the search from one grouped query; picking
+    another period or breakdown reruns only this fragment.
+    """
+    period = st.segmented_control(
+        "Periodo", list(COMPARISON_PERIODS), format_func=COMPARISON_PERIODS.get,
+        key="comparison_period", label_visibility="collapsed",
+    )
+    if period is None:
+        st.caption("Elige un periodo para comparar la búsqueda con el periodo anterior.")
+        return
+    comparison = cached_query("comparison", fetch_comparison, search_query, period)
+    if comparison is None:
+        return
+    periods = comparison["periods"]
+    st.caption(f"{period_label(periods['current'])} frente a {period_label(periods['prior'])}")
+    totals = comparison["totals"]
+    c1, c2, c3 = st.columns(3)
+    comparison_metric(c1, "Importe", totals, "importe", money=True)
+    comparison_metric(c2, "Unidades", totals, "cantidad")
+    comparison_metric(c3, "Pedidos", totals, "pedidos")
+
+    dimension = st.segmented_control(
+        "Desglose", list(COMPARISON_DIMENSIONS), format_func=lambda d: COMPARISON_DIMENSIONS[d][1],
+        default="producto", key="comparison_dimension",
+    ) or "producto"
+    breakdown = comparison[dimension]
+    gains, drops = top_movers(breakdown)
+    if gains.empty and drops.empty:
+        st.caption("Sin variaciones entre los dos periodos.")
+        return
+    key = ("movers", normalize_query(search_query), period, dimension)
+    with stage("chart:movers", rows=len(breakdown)) as s:
+        fig = get_figure_cache().get(key, breakdown)
+        s["cache"] = "hit" if fig is not None else "miss"
+        if fig is None:
+            fig = movers_figure(pd.concat([gains, drops]))
+            get_figure_cache().put(key, breakdown, fig)
+        st.plotly_chart(fig, use_container_width=True)
+
+    title = COMPARISON_DIMENSIONS[dimension][1]
+    column_config = {
+        "Importe actual": st.column_config.NumberColumn("Actual", format="S/ %.2f"),
+        "Importe anterior": st.column_config.NumberColumn("Anterior", format="S/ %.2f"),
+        "Variación": st.column_config.NumberColumn("Variación", format="S/ %.2f"),
+        "Variación %": st.column_config.NumberColumn("Var. %", format="percent"),
+    }
+    shown = [title, "Importe actual", "Importe anterior", "Variación", "Variación %"]
+    g_col, d_col = st.columns(2)
+    with g_col:
+        st.markdown("##### ▲ Mayores subidas")
+        st.dataframe(gains[shown], hide_index=True, column_config=column_config, width="stretch")
+    with d_col:
+        st.markdown("##### ▼ Mayores caídas")
+        st.dataframe(drops[shown], hide_index=True, column_config=column_config, width="stretch")
+
+def render_chart(name: str, build, data: pd.DataFrame | None, search_query: str, years: int, pending: str):
+    """Draws a chart, reusing the figure already built for the same result; ``pending`` while it is computed."""
+    if data is None:
+        render_pending(pending)
+        return
+    key = (name, normalize_query(search_query), years)
+    with stage(f"chart:{name}", rows=len(data)) as s:
+        fig = get_figure_cache().get(key, data)
+        s["cache"] = "hit" if fig is not None else "miss"
+        if fig is None:
+            fig = build(data)
+            get_figure_cache().put(key, data, fig)
+        st.plotly_chart(fig, use_container_width=True)
+
+def is_admin() -> bool:
+    return st.session_state.get("user") in ADMIN_USERS
+
+def render_profiling_panel():
+    """Admin-only sidebar panel with the stage timings of the last search and recent runs."""
+    with st.expander("⏱️ Perfilado"):
+        st.toggle(
+            "Capturar EXPLAIN (ANALYZE, BUFFERS)",
+            key="profile_explain",
+            help="Ejecuta cada consulta dos veces; úsalo solo para diagnosticar.",
+        )
+        last = st.session_state.get("last_profile")
+        if last:
+            st.caption(f"Última búsqueda: «{last['search']}» · {last['total_ms']:,.0f} ms")
+            stages = pd.DataFrame(last["stages"])
+            st.dataframe(stages.drop(columns=["plan"], errors="ignore"), hide_index=True)
+            for plan_stage in last["stages"]:
+                if "plan" in plan_stage:
+                    st.caption(f"Plan de {plan_stage.get('parent', 'consulta')}")
+                    st.code(plan_stage["plan"], language=None)
+        runs = recent_profiles()
+        if runs:
+            st.caption("Últimas ejecuciones (todas las sesiones)")
+            st.dataframe(
+                pd.DataFrame(
+                    [{"Hora": r["ts"], "Tipo": r["run"], "Búsqueda": r.get("search", ""), "ms": r["total_ms"]}
+                     for r in reversed(runs)]
+                ),
+                hide_index=True,
+            )
+        if PROFILE_LOG:
+            st.caption(f"Registro JSON: `{PROFILE_LOG}`")
+
+def render_paged_results(search_query: str, years: int, total_rows: int):
+    """Audit grid loaded one keyset page at a time, with previous/next navigation."""
+    key = (normalize_query(search_query), years)
+    state = st.session_state.get("results_pages")
+    if state is None or state["key"] != key:
+        # cursors[i] is the keyset cursor that starts page i
+        state = {"key": key, "cursors": [None], "page": 0}
+        st.session_state["results_pages"] = state
+
+    page = state["page"]
+    with st.spinner("Cargando página..."):
+        page_df, next_cursor = search_page(search_query, years, SEARCH_PAGE_SIZE, state["cursors"][page])
+    if next_cursor is not None and len(state["cursors"]) == page + 1:
+        state["cursors"].append(next_cursor)
+
+    render_results_table(page_df)
+
+    total_pages = max(1, -(-total_rows // SEARCH_PAGE_SIZE))
+    first_row = page * SEARCH_PAGE_SIZE + 1
+    p_prev, p_info, p_next = st.columns([1, 2, 1])
+    with p_prev:
+        if st.button("◀ Anterior", disabled=page == 0, width="stretch"):
+            state["page"] -= 1
+            st.rerun()
+    with p_info:
+        st.markdown(
+            f"<div style='text-align: center; padding-top: 14px;'>Página {page + 1} de {total_pages:,} · "
+            f"registros {first_row:,}–{first_row + len(page_df) - 1:,} de {total_rows:,}</div>",
+            unsafe_allow_html=True,
+        )
+    with p_next:
+        if st.button("Siguiente ▶", disabled=next_cursor is None, width="stretch"):
+            state["page"] += 1
+            st.rerun()
+
 # Helper for Logo (must be defined before check_password uses it)
 def get_base64_logo(path):
     try:
@@ -533,11 +827,32 @@ def get_base64_logo(path):
     except:
         return None
 
-logo_base64 = get_base64_logo("EXPERA2.png")
-logo_html = f'<img src="data:image/png;base64,{logo_base64}" style="max-height: 150px; width: auto; display: block; margin: 0 auto;">' if logo_base64 else "<h1>EXPERA</h1>"
+@st.cache_resource(show_spinner=False)
+def get_logo_html() -> str:
+    """
+    Logo <img>, built once per process: the downscaled WebP from the static
+    server, or the same file inlined as base64 when static serving is off.
+    """
+    style = "max-height: 150px; width: auto; display: block; margin: 0 auto;"
+    if static_serving() and (STATIC_DIR / LOGO_FILE).exists():
+        return f'<img src="{STATIC_URL}/{LOGO_FILE}" alt="EXPERA" style="{style}">'
+    logo_base64 = get_base64_logo(STATIC_DIR / LOGO_FILE) or get_base64_logo(APP_DIR / "EXPERA2.png")
+    if logo_base64 is None:
+        return "<h1>EXPERA</h1>"
+    mime = "image/webp" if (STATIC_DIR / LOGO_FILE).exists() else "image/png"
+    return f'<img src="data:{mime};base64,{logo_base64}" alt="EXPERA" style="{style}">'
+
+logo_html = get_logo_html()
 
 if check_password():
+    # Heavy modules load only once the user is in, so the login page comes up fast
+    import plotly.express as px
+
     # If authenticated, show the dashboard
+    if PG_PASSWORD:
+        init_query_backends()
+        get_prewarmer()
+        get_suggest_index()
     
     # Optional: Logout button in sidebar or top
     with st.sidebar:
@@ -545,6 +860,94 @@ if check_password():
         st.markdown("---")
         st.markdown("### 👤 Sesión Activa")
         st.info("Conectado como Administrador")
+        with st.expander("📡 Pool de conexiones"):
+            pool_stats = get_pool().stats()
+            st.caption(
+                f"Abiertas: {pool_stats['size']} · En uso: {pool_stats['in_use']} · Libres: {pool_stats['idle']}"
+            )
+            st.caption(
+                f"Checkouts: {pool_stats['checkouts']} · Esperas: {pool_stats['waits']} · "
+                f"Timeouts: {pool_stats['timeouts']} · Reconexiones: {pool_stats['reconnects']}"
+            )
+            st.caption(
+                f"Espera media: {pool_stats['wait_time_avg'] * 1000:,.1f} ms · "
+                f"máx: {pool_stats['wait_time_max'] * 1000:,.1f} ms"
+            )
+            if "targets" in pool_stats:
+                routed = pool_stats["routed"]
+                st.caption(f"Consultas a réplicas: {routed['replica']} · al primario: {routed['primary']}")
+                for target in pool_stats["targets"]:
+                    state = "✅" if target["healthy"] else f"⚠️ {target['error']}"
+                    role = "réplica" if target["role"] == "replica" else "primario"
+                    st.caption(
+                        f"{target['name']} ({role}): {state} · retraso {target['lag']:,.0f} s · "
+                        f"en uso {target['in_use']}"
+                    )
+            st.caption(
+                f"Origen: {active_sales_source()} · Búsqueda: {active_search_backend()} · "
+                f"Insights: {active_insights_source()}"
+            )
+            job_stats = get_job_runner().stats()
+            st.caption(
+                f"Consultas en segundo plano: {job_stats['running']} en curso · "
+                f"{job_stats['queued']} en cola (máx. {job_stats['max_concurrent']} simultáneas)"
+            )
+            if PG_PASSWORD:
+                export_stats = get_export_queue().stats()
+                st.caption(
+                    f"Exportaciones: {export_stats['running']} en curso · {export_stats['queued']} en cola · "
+                    f"{export_stats['files']} archivos ({export_stats['bytes'] / 1024**2:,.1f} MB) · "
+                    f"Reutilizadas: {export_stats['shared']} · Fallidas: {export_stats['failed']}"
+                )
+        with st.expander("🗄️ Caché de resultados"):
+            cache_stats = get_result_cache().stats()
+            st.caption(
+                f"Entradas: {cache_stats['entries']} · "
+                f"{cache_stats['bytes'] / 1024**2:,.1f} de {cache_stats['max_bytes'] / 1024**2:,.0f} MB"
+            )
+            st.caption(
+                f"Aciertos: {cache_stats['hits']} · Por ventana de años: {cache_stats['window_hits']} · "
+                f"Refinados: {cache_stats['refine_hits']} · "
+                f"Fallos: {cache_stats['misses']} ({cache_stats['hit_ratio']:.0%} de acierto)"
+            )
+            st.caption(
+                f"Desalojos: {cache_stats['evictions']} · Expirados: {cache_stats['expirations']} · "
+                f"Rechazados por tamaño: {cache_stats['rejected']}"
+            )
+            prewarmer = get_prewarmer() if PG_PASSWORD else None
+            if prewarmer is not None:
+                prewarm_stats = prewarmer.stats()
+                st.caption(
+                    f"Precalentadas: {prewarm_stats['terms']} búsquedas × {len(prewarm_stats['years'])} "
+                    f"ventanas · Aciertos: {cache_stats['prewarm_hits']} "
+                    f"({cache_stats['prewarm_ratio']:.0%} de las consultas)"
+                )
+                if prewarm_stats["last_round"]:
+                    st.caption(
+                        f"Última ronda: {prewarm_stats['last_round'][11:]} "
+                        f"({prewarm_stats['last_duration']:,.1f} s) · Errores: {prewarm_stats['errors']}"
+                    )
+            shared = get_shared_cache()
+            if shared is not None:
+                shared_stats = shared.stats()
+                st.caption(
+                    f"Compartida ({shared_stats['backend']}): {shared_stats['hits']} aciertos · "
+                    f"{shared_stats['misses']} fallos · {shared_stats['waits']} esperas a otro proceso · "
+                    f"{shared_stats['bytes'] / 1024**2:,.1f} MB · Invalidaciones: {shared_stats['invalidations']}"
+                )
+            if PG_PASSWORD:
+                suggest_stats = get_suggest_index().stats()
+                st.caption(
+                    f"Autocompletado: {suggest_stats['entities']:,} entradas · "
+                    f"búsqueda máx. {suggest_stats['lookup_time_max'] * 1000:,.1f} ms"
+                )
+                if suggest_stats["last_build"]:
+                    st.caption(
+                        f"Índice actualizado: {suggest_stats['last_build'][11:]} "
+                        f"({suggest_stats['last_duration']:,.1f} s) · Errores: {suggest_stats['errors']}"
+                    )
+        if is_admin():
+            render_profiling_panel()
         if st.button("Cerrar Sesión"):
             st.session_state["password_correct"] = False
             st.rerun()
@@ -564,28 +967,75 @@ if check_password():
         with c_search:
             search_input = st.text_input(
                 label="Buscador Inteligente", 
-                placeholder="🔍 ¿Qué buscas hoy? (Marca, Producto, Cliente o Nº)...",
+                placeholder="🔍 ¿Qué buscas hoy? (Marca, Producto, Cliente o Nº) · cliente:acme doc:F001-*...",
                 key="global_search_premium",
                 label_visibility="collapsed"
             )
         with c_filter:
             with st.popover("⚡ Filtros"):
                 st.markdown("### Configuración de Análisis")
-                years_filter = st.slider("Histórico de Años", 1, 15, 5)
-                st.info("Estamos procesando toda la base de datos sin límites de registros.")
+                years_filter = st.slider("Histórico de Años", 1, MAX_YEARS, 5)
+                paginated = st.toggle(
+                    "Paginación en servidor",
+                    value=PAGINATED_RESULTS,
+                    help="Carga la auditoría por páginas y calcula los KPIs en la base de datos.",
+                )
+                if paginated:
+                    st.info(f"Los resultados se cargan bajo demanda en páginas de {SEARCH_PAGE_SIZE:,} registros.")
+                else:
+                    st.info("Estamos procesando toda la base de datos sin límites de registros.")
+                st.markdown(SEARCH_SYNTAX_HELP)
+        if search_input and PG_PASSWORD:
+            render_suggestions(search_input)
     
     # Main Dashboard Logic
+    st.session_state["pending_jobs"] = []
     if search_input:
+        profile = None
+        if PROFILE_LOG or is_admin():
+            profile = begin_profile(
+                "search",
+                explain=st.session_state.get("profile_explain", False),
+                search=normalize_query(search_input),
+                years=years_filter,
+                paginated=paginated,
+            )
+
+        if normalize_query(search_input) != st.session_state.get("last_search_term"):
+            with stage("debounce"):
+                wait_unless_superseded(SEARCH_DEBOUNCE_MS / 1000)
+            st.session_state["last_search_term"] = normalize_query(search_input)
+        # Background jobs of the previous term or window are no longer needed
+        release_query_jobs(search_input, years_filter)
+
+        ignored_filters = parse_search(search_input).ignored
+        if ignored_filters:
+            st.warning(f"Filtros ignorados (valor vacío o fecha no válida): {', '.join(ignored_filters)}")
+
+        # Fan-out: the detail and chart queries start on their own connections before
+        # the KPIs are computed; the table and the charts follow as their jobs finish
         with st.spinner("✨ Procesando inteligencia de datos completa..."):
-            df = perform_search(search_input, years_filter)
+            # Every job starts anyway, but only the open tab's jobs rerun the page when they finish
+            charts_open = st.session_state.get("results_tab") == CHARTS_TAB
+            df = None if paginated else search_results(search_input, years_filter, watch=not charts_open)
+            insights = search_insights(search_input, years_filter, watch=charts_open)
+            if df is not None:
+                # Answered from the cache or an already finished job: no round trip
+                summary = summarize_search(df)
+            else:
+                summary = search_summary(search_input, years_filter)
+            has_results = bool(summary and summary["rows"])
+        if not has_results:
+            # Nothing to show from the jobs still running: no need to rerun for them
+            st.session_state["pending_jobs"].clear()
         
-        if not df.empty:
+        if has_results:
             # Results metrics - New layout
             m1, m2, m3, m4 = st.columns(4)
             
-            total_imp = df["Importe Total"].sum()
-            total_qty = df["Cant."].sum()
-            unique_orders = df["Nº Documento"].nunique()
+            total_imp = summary["total_imp"]
+            total_qty = summary["total_qty"]
+            unique_orders = summary["unique_orders"]
             avg_price = total_imp / total_qty if total_qty > 0 else 0
     
             m1.metric("Revenue Total", f"S/ {total_imp:,.2f}")
@@ -596,68 +1046,53 @@ if check_password():
             st.markdown("<br>", unsafe_allow_html=True)
     
             # Tabs with Premium Style
-            tab_list, tab_charts = st.tabs(["📋 Auditoría de Ventas", "📈 Insights & Análisis"])
+            # Only the open tab is built and sent to the browser; switching tabs reruns the page
+            tab_list, tab_charts = st.tabs([AUDIT_TAB, CHARTS_TAB], key="results_tab", on_change="rerun")
             
             with tab_list:
-                # Styled Dataframe
-                st.dataframe(
-                    df, 
-                    use_container_width=True, 
-                    height=550,
-                    column_config={
-                        "Fecha": st.column_config.DateColumn("Fecha", format="DD/MM/YYYY"),
-                        "Importe Total": st.column_config.NumberColumn("Importe", format="S/ %.2f"),
-                        "Precio Unit.": st.column_config.NumberColumn("Precio", format="S/ %.2f"),
-                        "Enlace PDF": st.column_config.LinkColumn("Factura PDF", display_text="Ver Factura"),
-                    }
-                )
+                if tab_list.open:
+                    if paginated:
+                        render_paged_results(search_input, years_filter, summary["rows"])
+                    elif df is None:
+                        render_pending(f"Cargando {summary['rows']:,} registros...")
+                    else:
+                        render_results_grid(df, (normalize_query(search_input), years_filter))
                 
-                # Action Footer
-                st.markdown("<br>", unsafe_allow_html=True)
-                f_col1, f_col2, f_col3 = st.columns([1,1,1])
-                with f_col2:
-                    excel_bytes = to_excel_bytes(df)
-                    st.download_button(
-                        label="📥 DESCARGAR AUDITORÍA (XLSX)",
-                        data=excel_bytes,
-                        file_name=f"expera_report_{date.today()}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        width="stretch",
-                    )
+                    # Action Footer
+                    # Files are written by background export jobs and downloaded once ready
+                    st.markdown("<br>", unsafe_allow_html=True)
+                    render_exports(search_input, years_filter, summary["rows"])
     
             with tab_charts:
-                chart_col1, chart_col2 = st.columns(2)
-                
-                with chart_col1:
-                    st.markdown("#### Distribución de Top Productos")
-                    top_p = df.groupby("Producto")["Importe Total"].sum().sort_values(ascending=False).head(10).reset_index()
-                    fig_bar = px.bar(
-                        top_p, x="Importe Total", y="Producto", orientation='h',
-                        color="Importe Total", color_continuous_scale="Viridis",
-                        template="plotly_white"
-                    )
-                    fig_bar.update_layout(showlegend=False, height=450, margin=dict(l=0, r=0, t=10, b=0))
-                    st.plotly_chart(fig_bar, use_container_width=True)
-                
-                with chart_col2:
-                    st.markdown("#### Tendencia Temporal (Importe)")
-                    # Temporal view
-                    df["Fecha"] = pd.to_datetime(df["Fecha"])
-                    time_series = df.set_index("Fecha").resample("ME")["Importe Total"].sum().reset_index()
-                    fig_line = px.line(
-                        time_series, x="Fecha", y="Importe Total",
-                        template="plotly_white", line_shape="spline"
-                    )
-                    fig_line.update_traces(line_color='#3b82f6', line_width=4, fill='tozeroy', fillcolor='rgba(59, 130, 246, 0.1)')
-                    fig_line.update_layout(height=450, margin=dict(l=0, r=0, t=10, b=0))
-                    st.plotly_chart(fig_line, use_container_width=True)
+                if tab_charts.open:
+                    # Each chart is drawn as soon as its own query is done
+                    chart_col1, chart_col2 = st.columns(2)
                     
-                # Extra Chart: Top Clients
-                st.markdown("---")
-                st.markdown("#### Concentración por Clientes")
-                top_c = df.groupby("Cliente")["Importe Total"].sum().sort_values(ascending=False).head(15).reset_index()
-                fig_pie = px.treemap(top_c, path=['Cliente'], values='Importe Total', color='Importe Total', color_continuous_scale='RdBu')
-                st.plotly_chart(fig_pie, use_container_width=True)
+                    with chart_col1:
+                        st.markdown("#### Distribución de Top Productos")
+                        render_chart(
+                            "top_products", top_products_figure, insights.get("top_products"),
+                            search_input, years_filter, "Calculando top de productos...",
+                        )
+                    
+                    with chart_col2:
+                        st.markdown("#### Tendencia Temporal (Importe)")
+                        render_chart(
+                            "monthly", monthly_figure, insights.get("monthly"),
+                            search_input, years_filter, "Calculando tendencia mensual...",
+                        )
+                        
+                    # Extra Chart: Top Clients
+                    st.markdown("---")
+                    st.markdown("#### Concentración por Clientes")
+                    render_chart(
+                        "top_clients", top_clients_figure, insights.get("top_clients"),
+                        search_input, years_filter, "Calculando concentración por clientes...",
+                    )
+
+                    st.markdown("---")
+                    st.markdown("#### Comparación de Periodos")
+                    render_comparison(search_input)
                     
         else:
             st.markdown(f"""
@@ -666,6 +1101,14 @@ if check_password():
                 <p style='color: #94a3b8;'>Intenta con otros términos o ajusta el rango de años en filtros.</p>
             </div>
             """, unsafe_allow_html=True)
+
+        if profile is not None:
+            st.session_state["last_profile"] = end_profile(profile)
+    else:
+        release_query_jobs()
+
+    if st.session_state["pending_jobs"]:
+        watch_query_jobs(st.session_state["pending_jobs"])
 else:
     st.markdown("<div></div>", unsafe_allow_html=True)
 # Implementation complete. Hiding technical logs and SQL as requested.
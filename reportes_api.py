@@ -0,0 +1,497 @@
+"""
+Headless HTTP/JSON API over the same search, KPI and Insights queries as the
+Streamlit app, for internal tools that need the sales data without a browser
+session (and without the script rerun, CSS, logo and charts of every page).
+
+    python reportes_api.py --port 8601
+
+Every request needs ``Authorization: Bearer <token>`` with one of API_TOKENS,
+except /download: its random file name is the credential (the app links
+browsers to it) and stops working when the export is cleaned up.
+Endpoints (all GET; ``q`` follows the search box syntax, ``years`` defaults to 5):
+
+    /health                                   sources in use
+    /summary?q=&years=                        KPI totals
+    /search?q=&years=&page_size=&after=&format=json|ndjson|arrow
+                                              one keyset page plus the KPIs;
+                                              ``next`` is the ``after`` of the following page
+    /export?q=&years=&format=ndjson|arrow|csv the whole result, streamed
+    /insights?q=&years=                       chart aggregates
+    /compare?q=&period=mes|mes_anual|anio|12m current vs. prior period
+    /suggest?q=                               autocomplete suggestions
+    /download/<file>                          a finished background export of the
+                                              app (byte ranges supported)
+
+Queries share the connection pool code, the result cache and, when
+configured, the cross-process cache with the app. Large results are streamed
+in chunks from a server-side cursor (COPY for CSV) instead of being built in
+memory.
+"""
+import argparse
+import base64
+import hmac
+import json
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pyarrow as pa
+
+from reportes_cache import ResultCache, cache_key, create_result_cache, normalize_query
+from reportes_compare import COMPARISON_DIMENSIONS, COMPARISON_PERIODS, fetch_comparison
+from reportes_db import ConnectionPool, PoolTimeout, ReplicaRouter, create_pool, get_env
+from reportes_export import copy_search_csv, search_record_batches
+from reportes_export_jobs import EXPORT_FORMATS, find_export, set_export_timeout
+from reportes_queries import (
+    active_insights_source,
+    active_sales_source,
+    active_search_backend,
+    detect_insights_rollup,
+    detect_sales_source,
+    detect_search_backend,
+    fetch_insights,
+    fetch_search_page,
+    fetch_search_summary,
+)
+from reportes_shared_cache import SharedCache, create_shared_cache
+from reportes_suggest import SuggestIndex, create_suggest_index, suggestion_query
+
+API_HOST = get_env("API_HOST", "127.0.0.1")
+API_PORT = int(get_env("API_PORT", "8601"))
+# Bearer tokens accepted, comma-separated (the API refuses to start without one)
+API_TOKENS = [t.strip() for t in get_env("API_TOKENS", "").split(",") if t.strip()]
+API_PAGE_SIZE = int(get_env("API_PAGE_SIZE", "500"))
+API_MAX_PAGE_SIZE = int(get_env("API_MAX_PAGE_SIZE", "5000"))
+
+# Same limits as the app's years slider
+MAX_YEARS = 15
+# Sales source and search backend are re-detected this often, like the app
+BACKENDS_REFRESH = 600
+
+NDJSON_MIME = "application/x-ndjson"
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+CSV_MIME = "text/csv"
+
+# Bytes sent per write of a download
+DOWNLOAD_CHUNK = 1024 * 1024
+
+
+class ApiError(Exception):
+    """Request error answered with ``status`` and a JSON message."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+# -----------------------------
+# Encoding
+# -----------------------------
+def encode_cursor(cursor: tuple | None) -> str | None:
+    if cursor is None:
+        return None
+    creado, cab_id, det_id = cursor
+    raw = json.dumps([creado.isoformat(), cab_id, det_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(value: str | None) -> tuple | None:
+    if not value:
+        return None
+    try:
+        creado, cab_id, det_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return datetime.fromisoformat(creado), int(cab_id), int(det_id)
+    except (ValueError, TypeError):
+        raise ApiError(400, "Parámetro after no válido.") from None
+
+
+def error_message(error: Exception) -> str:
+    """First line of a database error, without the server's context lines."""
+    return (str(error).strip().splitlines() or [type(error).__name__])[0]
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    (first, last) byte of a single ``Range: bytes=`` request; None when there
+    is none or it cannot be parsed (the whole file is sent). A range starting
+    past the end comes back as is, for the caller to answer 416.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if not sep or not (first or last):
+            return None
+        if not first:
+            # Suffix range: the last N bytes ("bytes=-0" is unsatisfiable)
+            suffix = int(last)
+            return (max(size - suffix, 0) if suffix else size), size - 1
+        first, last = int(first), int(last) if last else None
+    except ValueError:
+        return None
+    if last is not None and last < first:
+        return None
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+def frame_records(df: pd.DataFrame) -> list[dict]:
+    """Rows as JSON-ready dicts, dates as YYYY-MM-DD."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]) or str(df[col].dtype).startswith("date32"):
+            df[col] = pd.to_datetime(df[col]).dt.strftime("%Y-%m-%d")
+    return json.loads(df.to_json(orient="records", force_ascii=False))
+
+
+class ChunkedWriter:
+    """File-like object sending what is written as HTTP/1.1 chunks."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+        self._written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._written
+
+    def write(self, data) -> int:
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode() + bytes(data) + b"\r\n")
+            self._written += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.wfile.flush()
+
+    def close(self) -> None:
+        """Sends the last chunk; the connection itself stays open."""
+        if not self.closed:
+            self.closed = True
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+
+# -----------------------------
+# Service
+# -----------------------------
+class SalesApi:
+    """Pool, caches and query backends behind the HTTP handler."""
+
+    def __init__(self, pool: ConnectionPool | ReplicaRouter, cache: ResultCache,
+                 shared: SharedCache | None, suggest: SuggestIndex, tokens: list[str]):
+        self.pool = pool
+        self.cache = cache
+        self.shared = shared
+        self.suggest = suggest
+        self.tokens = tokens
+        self._lock = threading.Lock()
+        self._backends_checked = 0.0
+
+    def authorized(self, header: str | None) -> bool:
+        token = (header or "").removeprefix("Bearer ").strip()
+        return bool(token) and any(hmac.compare_digest(token, t) for t in self.tokens)
+
+    def refresh_backends(self) -> None:
+        """Re-detects the sales source, search backend and Insights source every BACKENDS_REFRESH seconds."""
+        with self._lock:
+            if time.monotonic() - self._backends_checked < BACKENDS_REFRESH:
+                return
+            self._backends_checked = time.monotonic()
+        try:
+            with self.pool.connection() as conn:
+                detect_sales_source(conn)
+                detect_search_backend(conn)
+                detect_insights_rollup(conn)
+        except Exception:
+            # Keep the live/ILIKE/detail fallback, as the app does
+            pass
+
+    def cached(self, kind: str, fetch, search_query: str, *args):
+        """``fetch`` result from the result cache, the shared cache or the database."""
+        key = cache_key(kind, search_query, *args)
+        value = self.cache.get(key)
+        if value is None:
+            if self.shared is not None:
+                fetch = self.shared.wrap(kind, fetch)
+            with self.pool.connection() as conn:
+                value = fetch(conn, search_query, *args)
+            self.cache.put(key, value)
+        return value
+
+    def summary(self, search_query: str, years: int) -> dict:
+        return self.cached("summary", fetch_search_summary, search_query, years)
+
+    def page(self, search_query: str, years: int, page_size: int, after: tuple | None):
+        return self.cached("page", fetch_search_page, search_query, years, page_size, after)
+
+    def insights(self, search_query: str, years: int) -> dict:
+        return self.cached("insights", fetch_insights, search_query, years)
+
+    def comparison(self, search_query: str, period: str) -> dict:
+        return self.cached("comparison", fetch_comparison, search_query, period)
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ExperaApi/1.0"
+
+    @property
+    def api(self) -> SalesApi:
+        return self.server.api
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.streaming = False
+        if url.path.startswith("/download/"):
+            self.download(url.path.removeprefix("/download/"))
+            return
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        routes = {
+            "/health": self.health,
+            "/summary": self.summary,
+            "/search": self.search,
+            "/export": self.export,
+            "/insights": self.insights,
+            "/compare": self.compare,
+            "/suggest": self.suggest,
+        }
+        try:
+            route = routes.get(url.path.rstrip("/") or "/")
+            if route is None:
+                raise ApiError(404, "Ruta no encontrada.")
+            if not self.api.authorized(self.headers.get("Authorization")):
+                raise ApiError(401, "Token no válido.")
+            self.api.refresh_backends()
+            route(params)
+        except Exception as e:
+            if self.streaming:
+                # Headers already sent: dropping the connection is the only way to signal it
+                self.close_connection = True
+            elif isinstance(e, ApiError):
+                self.send_json({"error": str(e)}, status=e.status)
+            elif isinstance(e, PoolTimeout):
+                self.send_json({"error": "Servidor ocupado, inténtalo de nuevo."}, status=503)
+            else:
+                self.send_json({"error": error_message(e)}, status=500)
+
+    def do_HEAD(self):
+        url = urlparse(self.path)
+        self.streaming = False
+        if url.path.startswith("/download/"):
+            self.download(url.path.removeprefix("/download/"), head=True)
+        else:
+            self.send_error(405)
+
+    # -- parameters --
+    def search_params(self, params: dict) -> tuple[str, int]:
+        search_query = normalize_query(params.get("q", ""))
+        if not search_query:
+            raise ApiError(400, "Falta el parámetro q.")
+        return search_query, self.int_param(params, "years", 5, 1, MAX_YEARS)
+
+    @staticmethod
+    def int_param(params: dict, name: str, default: int, low: int, high: int) -> int:
+        try:
+            value = int(params.get(name, default))
+        except ValueError:
+            raise ApiError(400, f"Parámetro {name} no válido.") from None
+        if not low <= value <= high:
+            raise ApiError(400, f"{name} debe estar entre {low} y {high}.")
+        return value
+
+    # -- responses --
+    def send_json(self, payload, status: int = 200) -> None:
+        body = json.dumps(payload, ensure_ascii=False, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def start_stream(self, content_type: str, headers: dict | None = None) -> ChunkedWriter:
+        self.streaming = True
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        return ChunkedWriter(self.wfile)
+
+    # -- endpoints --
+    def health(self, params: dict) -> None:
+        self.send_json({
+            "status": "ok",
+            "source": active_sales_source(),
+            "search_backend": active_search_backend(),
+            "insights": active_insights_source(),
+        })
+
+    def summary(self, params: dict) -> None:
+        search_query, years = self.search_params(params)
+        self.send_json(self.api.summary(search_query, years))
+
+    def search(self, params: dict) -> None:
+        search_query, years = self.search_params(params)
+        page_size = self.int_param(params, "page_size", API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+        after = decode_cursor(params.get("after"))
+        fmt = params.get("format", "json")
+        if fmt not in ("json", "ndjson", "arrow"):
+            raise ApiError(400, "format debe ser json, ndjson o arrow.")
+        summary = self.api.summary(search_query, years)
+        df, next_cursor = self.api.page(search_query, years, page_size, after)
+        next_page = encode_cursor(next_cursor)
+        if fmt == "json":
+            self.send_json({"summary": summary, "rows": frame_records(df), "next": next_page})
+        elif fmt == "ndjson":
+            out = self.start_stream(NDJSON_MIME)
+            lines = [{"summary": summary}, *frame_records(df), {"next": next_page}]
+            out.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode())
+            out.close()
+        else:
+            # Summary and cursor in headers, the page as one Arrow IPC stream
+            out = self.start_stream(ARROW_MIME, {
+                "X-Summary": json.dumps(summary),
+                "X-Next-Cursor": next_page or "",
+            })
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            with pa.ipc.new_stream(out, table.schema) as writer:
+                writer.write_table(table)
+            out.close()
+
+    def export(self, params: dict) -> None:
+        search_query, years = self.search_params(params)
+        fmt = params.get("format", "ndjson")
+        if fmt not in ("ndjson", "arrow", "csv"):
+            raise ApiError(400, "format debe ser ndjson, arrow o csv.")
+        with self.api.pool.connection() as conn:
+            set_export_timeout(conn)
+            if fmt == "csv":
+                out = self.start_stream(f"{CSV_MIME}; charset=utf-8")
+                copy_search_csv(conn, search_query, years, out)
+                out.close()
+                return
+            batches = search_record_batches(conn, search_query, years)
+            first = next(batches)
+            out = self.start_stream(ARROW_MIME if fmt == "arrow" else NDJSON_MIME)
+            if fmt == "arrow":
+                with pa.ipc.new_stream(out, first.schema) as writer:
+                    writer.write_batch(first)
+                    for batch in batches:
+                        writer.write_batch(batch)
+            else:
+                for batch in chain([first], batches):
+                    out.write("".join(
+                        json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in batch.to_pylist()
+                    ).encode())
+            out.close()
+
+    def download(self, file: str, head: bool = False) -> None:
+        """Sends a spooled export from disk, honouring Range (and If-Range) to resume downloads."""
+        path = find_export(file)
+        if path is None:
+            self.send_json({"error": "Exportación no encontrada o caducada."}, status=404)
+            return
+        stat = path.stat()
+        size = stat.st_size
+        etag = f'"{path.stem}-{size}-{int(stat.st_mtime)}"'
+        extension = file[file.index("."):]
+        mime = next(mime for ext, mime, _ in EXPORT_FORMATS.values() if ext == extension)
+        if_range = self.headers.get("If-Range")
+        byte_range = parse_range(self.headers.get("Range"), size) if if_range in (None, etag) else None
+        if byte_range is not None and byte_range[0] >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        first, last = byte_range or (0, size - 1)
+        self.send_response(200 if byte_range is None else 206)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(last - first + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", self.date_time_string(stat.st_mtime))
+        self.send_header(
+            "Content-Disposition",
+            f'attachment; filename="expera_report_{datetime.fromtimestamp(stat.st_mtime).date()}{extension}"',
+        )
+        if byte_range is not None:
+            self.send_header("Content-Range", f"bytes {first}-{last}/{size}")
+        self.end_headers()
+        if head:
+            return
+        try:
+            with open(path, "rb") as f:
+                f.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = f.read(min(DOWNLOAD_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except ConnectionError:
+            # Client went away mid-download; it can resume with a Range request
+            self.close_connection = True
+
+    def insights(self, params: dict) -> None:
+        search_query, years = self.search_params(params)
+        insights = self.api.insights(search_query, years)
+        self.send_json({name: frame_records(df) for name, df in insights.items()})
+
+    def compare(self, params: dict) -> None:
+        search_query, _ = self.search_params(params)
+        period = params.get("period", "mes")
+        if period not in COMPARISON_PERIODS:
+            raise ApiError(400, f"period debe ser {', '.join(COMPARISON_PERIODS)}.")
+        comparison = self.api.comparison(search_query, period)
+        self.send_json({
+            **{name: comparison[name] for name in ("periods", "totals")},
+            **{name: frame_records(comparison[name]) for name in COMPARISON_DIMENSIONS},
+        })
+
+    def suggest(self, params: dict) -> None:
+        self.send_json([
+            {"kind": kind, "value": value, "q": suggestion_query(kind, value)}
+            for kind, value in self.api.suggest.suggest(params.get("q", ""))
+        ])
+
+
+def create_api() -> SalesApi:
+    pool = create_pool()
+    suggest = create_suggest_index(pool)
+    suggest.start()
+    return SalesApi(pool, create_result_cache(), create_shared_cache(), suggest, API_TOKENS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP/JSON de búsquedas de EXPERA BI.")
+    parser.add_argument("--host", default=API_HOST, help=f"interfaz de escucha (por defecto {API_HOST})")
+    parser.add_argument("--port", type=int, default=API_PORT, help=f"puerto (por defecto {API_PORT})")
+    args = parser.parse_args()
+
+    if not API_TOKENS:
+        sys.exit("Configura API_TOKENS (tokens separados por comas) antes de iniciar la API.")
+    server = ThreadingHTTPServer((args.host, args.port), ApiHandler)
+    server.daemon_threads = True
+    server.api = create_api()
+    print(f"API de EXPERA BI escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,573 @@
+"""
+Benchmarks of the reporting queries and exports against a synthetic ERP.
+
+Builds a dedicated database (BENCH_DB, never PG_DB) with the cmrlz/extcs/tcros
+tables the app reads, filled with a reproducible, skewed data set, then times
+the same functions the app calls and writes a JSON report that can be
+compared with an earlier one:
+
+    python reportes_bench.py fixture --lines 2000000 [--trgm] [--fact]
+    python reportes_bench.py run [--sessions 1,4,8] [--output informe.json]
+    python reportes_bench.py compare base.json nuevo.json
+
+The run measures search latency percentiles per operation, throughput with
+concurrent sessions sharing a pool, export time/size per format and the peak
+memory of the heaviest search and XLSX export (each in a fresh process).
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import psycopg2
+
+from reportes_db import ConnectionPool, connection_kwargs, get_env
+from reportes_export import write_search_excel
+from reportes_export_jobs import EXPORT_FORMATS
+from reportes_fact import refresh_sales_fact
+from reportes_queries import (
+    active_insights_source,
+    active_sales_source,
+    active_search_backend,
+    detect_insights_rollup,
+    detect_sales_source,
+    detect_search_backend,
+    fetch_insights,
+    fetch_search,
+    fetch_search_page,
+    fetch_search_summary,
+)
+
+# Database the fixture is built in; refused if it is the app's PG_DB
+BENCH_DB = get_env("BENCH_DB", "expera_bench")
+BENCH_REPORTS_DIR = Path(__file__).resolve().parent / "bench_reports"
+
+# Mix of frequent and rare terms covering every predicate path: brand and
+# category words (many rows), a single model code, client surnames and company
+# words, a document number prefix and a 2-character term (always ILIKE), then
+# field-scoped searches of the search syntax (reportes_search).
+BENCH_TERMS = (
+    "samsung", "toner", "epson", "x-123", "quispe", "comercial",
+    "f001-0001", "hp", "mouse logitech", "inversiones",
+    "cliente:quispe producto:toner", "almacen:arequipa desde:2024-01",
+    "doc:F005-00012345", "doc:F001-0001*",
+)
+BENCH_YEARS = 5
+BENCH_PAGE_SIZE = 500
+
+# Relative slowdown reported as a regression by `compare`
+REGRESSION_THRESHOLD = 0.10
+
+_ROOT = Path(__file__).resolve().parent
+
+# -----------------------------
+# Fixture
+# -----------------------------
+FIXTURE_SCHEMA = """
+    CREATE SCHEMA bench;
+    CREATE TABLE bench.fixture (created_at timestamptz NOT NULL, lines bigint NOT NULL, seed float8 NOT NULL);
+    CREATE SCHEMA cmrlz;
+    CREATE SCHEMA extcs;
+    CREATE SCHEMA tcros;
+    CREATE TABLE extcs.productos (id bigserial PRIMARY KEY, nombre varchar(250), servicio boolean NOT NULL DEFAULT false);
+    CREATE TABLE extcs.almacenes (id bigserial PRIMARY KEY, nombre varchar(120));
+    CREATE TABLE tcros.personas (id bigserial PRIMARY KEY, nombre varchar(250));
+    CREATE TABLE tcros.direcciones (id bigserial PRIMARY KEY, persona_id bigint REFERENCES tcros.personas);
+    CREATE TABLE cmrlz.ventas_cab (id bigserial PRIMARY KEY, enlace_pdf text);
+    CREATE TABLE cmrlz.notas_pedido_cab (
+      id bigserial PRIMARY KEY,
+      creado timestamp NOT NULL,
+      numero varchar(30),
+      anulada boolean NOT NULL DEFAULT false,
+      venta_id bigint,
+      direccion_cliente_id bigint,
+      almacen_id bigint
+    );
+    CREATE TABLE cmrlz.notas_pedido_det (
+      id bigserial PRIMARY KEY,
+      nota_pedido_id bigint NOT NULL,
+      producto_id bigint NOT NULL,
+      cantidad numeric(12, 2),
+      precio_unitario_venta numeric(14, 4)
+    );
+"""
+
+# random()^k concentrates most draws on the lowest ids, a cheap stand-in for
+# the long-tailed popularity of real products and clients.
+FIXTURE_DATA = """
+    INSERT INTO extcs.almacenes (nombre)
+    SELECT unnest(ARRAY['LIMA CENTRAL', 'LIMA NORTE', 'AREQUIPA', 'TRUJILLO', 'CHICLAYO', 'PIURA', 'CUSCO', 'IQUITOS']);
+
+    INSERT INTO extcs.productos (nombre, servicio)
+    SELECT
+      (ARRAY['TONER', 'CARTUCHO', 'MONITOR', 'MOUSE', 'TECLADO', 'IMPRESORA', 'LAPTOP', 'DISCO SSD',
+             'MEMORIA USB', 'CABLE HDMI', 'AUDÍFONOS', 'ROUTER', 'PROYECTOR', 'CÁMARA IP'])[1 + g %% 14]
+      || ' ' ||
+      (ARRAY['SAMSUNG', 'HP', 'EPSON', 'LG', 'CANON', 'LOGITECH', 'KINGSTON', 'LENOVO', 'ASUS',
+             'BROTHER', 'TP-LINK', 'XIAOMI', 'SONY', 'PHILIPS', 'D-LINK', 'GENIUS'])[1 + floor(16 * random() ^ 2)::int]
+      || ' ' || chr(65 + g %% 26) || '-' || (100 + g %% 900),
+      random() < 0.02
+    FROM generate_series(1, %(products)s) g;
+
+    INSERT INTO tcros.personas (nombre)
+    SELECT CASE WHEN g %% 3 = 0 THEN
+        (ARRAY['JUAN', 'MARÍA', 'JOSÉ', 'ROSA', 'LUIS', 'CARMEN', 'JESÚS', 'ANA', 'ÁNGEL', 'NOEMÍ'])[1 + g %% 10]
+        || ' ' || (ARRAY['QUISPE', 'MAMANI', 'GARCÍA', 'PÉREZ', 'MUÑOZ', 'ÑAHUI', 'FLORES', 'HUAMÁN', 'CHÁVEZ', 'ROJAS'])[1 + floor(10 * random() ^ 2)::int]
+        || ' ' || (ARRAY['QUISPE', 'MAMANI', 'GARCÍA', 'PÉREZ', 'MUÑOZ', 'ÑAHUI', 'FLORES', 'HUAMÁN', 'CHÁVEZ', 'ROJAS'])[1 + (g / 10) %% 10]
+      ELSE
+        (ARRAY['COMERCIAL', 'INVERSIONES', 'DISTRIBUIDORA', 'CORPORACIÓN', 'SERVICIOS', 'IMPORTACIONES'])[1 + (g / 3) %% 6]
+        || ' ' || (ARRAY['ANDINA', 'DEL SUR', 'PACÍFICO', 'SAN MARTÍN', 'LOS ÁLAMOS', 'ÑAÑA', 'TECNO', 'GRAU'])[1 + (g / 18) %% 8]
+        || ' ' || g || ' ' || (ARRAY['S.A.C.', 'E.I.R.L.', 'S.A.', 'S.R.L.'])[1 + g %% 4]
+      END
+    FROM generate_series(1, %(clients)s) g;
+
+    INSERT INTO tcros.direcciones (persona_id)
+    SELECT g FROM generate_series(1, %(clients)s) g;
+
+    INSERT INTO cmrlz.ventas_cab (enlace_pdf)
+    SELECT 'https://facturas.expera.pe/pdf/' || md5(g::text) || '.pdf'
+    FROM generate_series(1, %(orders)s) g;
+
+    INSERT INTO cmrlz.notas_pedido_cab (creado, numero, anulada, venta_id, direccion_cliente_id, almacen_id)
+    SELECT
+      now()::timestamp - (random() ^ 1.5) * interval '3650 days',
+      'F' || lpad((1 + g %% 12)::text, 3, '0') || '-' || lpad(g::text, 8, '0'),
+      random() < 0.03,
+      CASE WHEN random() < 0.08 THEN NULL ELSE g END,
+      CASE WHEN random() < 0.05 THEN NULL ELSE 1 + floor(%(clients)s * random() ^ 3)::bigint END,
+      1 + floor(8 * random() ^ 2)::bigint
+    FROM generate_series(1, %(orders)s) g;
+
+    INSERT INTO cmrlz.notas_pedido_det (nota_pedido_id, producto_id, cantidad, precio_unitario_venta)
+    SELECT
+      1 + floor(%(orders)s * random())::bigint,
+      p.id,
+      1 + floor(20 * random() ^ 3),
+      round(((5 + p.id %% 997) * (0.9 + random() * 0.2))::numeric, 4)
+    FROM (
+      SELECT g, 1 + floor(%(products)s * random() ^ 2.5)::bigint AS id
+      FROM generate_series(1, %(lines)s) g
+    ) p;
+"""
+
+FIXTURE_INDEXES = """
+    CREATE INDEX ON cmrlz.notas_pedido_cab (creado);
+    CREATE INDEX ON cmrlz.notas_pedido_det (nota_pedido_id);
+    CREATE INDEX ON cmrlz.notas_pedido_det (producto_id);
+    CREATE INDEX ON tcros.direcciones (persona_id);
+"""
+
+
+def bench_connect(database: str = BENCH_DB):
+    if BENCH_DB == connection_kwargs()["database"]:
+        sys.exit(f"BENCH_DB ({BENCH_DB}) no puede ser la base de la app (PG_DB).")
+    return psycopg2.connect(**{**connection_kwargs(), "database": database})
+
+
+def create_bench_database() -> None:
+    conn = bench_connect("postgres")
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (BENCH_DB,))
+            if cur.fetchone() is None:
+                cur.execute(f'CREATE DATABASE "{BENCH_DB}"')
+    finally:
+        conn.close()
+
+
+def run_sql_file(conn, path: Path) -> None:
+    """
+    Runs a script of the sql/ folder statement by statement (they may use
+    CONCURRENTLY). Comments are removed before splitting on ";", since they
+    may contain one; the scripts have no "--" inside string literals.
+    """
+    statements = []
+    text = re.sub(r"--[^\n]*", "", path.read_text(encoding="utf-8"))
+    for chunk in text.split(";"):
+        lines = [line for line in chunk.splitlines() if line.strip()]
+        if lines:
+            statements.append("\n".join(lines))
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+    finally:
+        conn.autocommit = autocommit
+
+
+def build_fixture(lines: int, seed: float = 0.42, trgm: bool = False, fact: bool = False) -> dict:
+    """
+    (Re)creates the synthetic ERP in BENCH_DB: ``lines`` order lines over four
+    lines per order, one client per 100 lines and one product per 200.
+    """
+    sizes = {
+        "lines": lines,
+        "orders": max(lines // 4, 1),
+        "clients": max(lines // 100, 10),
+        "products": max(lines // 200, 50),
+    }
+    create_bench_database()
+    conn = bench_connect()
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('cmrlz.notas_pedido_cab'), to_regclass('bench.fixture')")
+            erp, marker = cur.fetchone()
+            if erp is not None and marker is None:
+                sys.exit(f"{BENCH_DB} tiene tablas del ERP que no creó este script; no se tocan.")
+            cur.execute("DROP SCHEMA IF EXISTS bench, cmrlz, extcs, tcros, bi CASCADE")
+            cur.execute(FIXTURE_SCHEMA)
+            # Same seed, same data: reports stay comparable between runs
+            cur.execute("SELECT setseed(%s)", (seed,))
+            cur.execute(FIXTURE_DATA, sizes)
+            cur.execute(FIXTURE_INDEXES)
+            cur.execute("INSERT INTO bench.fixture VALUES (now(), %s, %s)", (lines, seed))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE")
+        run_sql_file(conn, _ROOT / "sql" / "004_search_fields.sql")
+        if trgm:
+            run_sql_file(conn, _ROOT / "sql" / "001_search_trgm.sql")
+        if fact:
+            run_sql_file(conn, _ROOT / "sql" / "002_sales_fact.sql")
+            run_sql_file(conn, _ROOT / "sql" / "003_sales_month_rollup.sql")
+            conn.autocommit = False
+            refresh_sales_fact(conn, full=True)
+    finally:
+        conn.close()
+    return sizes
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+def percentiles(samples: list[float]) -> dict:
+    """Latency summary in milliseconds."""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000
+    return {
+        "n": len(samples),
+        "mean": round(float(ms.mean()), 2),
+        "p50": round(float(np.percentile(ms, 50)), 2),
+        "p95": round(float(np.percentile(ms, 95)), 2),
+        "p99": round(float(np.percentile(ms, 99)), 2),
+        "max": round(float(ms.max()), 2),
+    }
+
+
+def timed(fn, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def measure_latency(conn, terms, years: int, repeat: int) -> dict:
+    """Sequential latency per operation, ``repeat`` times over every term."""
+    samples = {"search": [], "summary": [], "page": [], "insights": []}
+    rows = {}
+    for _ in range(repeat):
+        for term in terms:
+            elapsed, df = timed(fetch_search, conn, term, years)
+            samples["search"].append(elapsed)
+            rows[term] = len(df)
+            samples["summary"].append(timed(fetch_search_summary, conn, term, years)[0])
+            samples["page"].append(timed(fetch_search_page, conn, term, years, BENCH_PAGE_SIZE)[0])
+            samples["insights"].append(timed(fetch_insights, conn, term, years)[0])
+            conn.rollback()
+    return {"ops": {op: percentiles(s) for op, s in samples.items()}, "rows": rows}
+
+
+def _session_view(conn, term: str, years: int) -> None:
+    # What the paginated dashboard runs for one search
+    fetch_search_summary(conn, term, years)
+    fetch_search_page(conn, term, years, BENCH_PAGE_SIZE)
+    fetch_insights(conn, term, years)
+
+
+def measure_throughput(pool: ConnectionPool, terms, years: int, sessions: int, duration: float) -> dict:
+    """``sessions`` threads running dashboard views on a shared pool for ``duration`` seconds."""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def session(idx: int):
+        rng = random.Random(idx)
+        while time.monotonic() < deadline:
+            term = rng.choice(terms)
+            start = time.perf_counter()
+            try:
+                with pool.connection() as conn:
+                    _session_view(conn, term, years)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "sessions": sessions,
+        "views": len(latencies),
+        "views_per_s": round(len(latencies) / elapsed, 2),
+        "errors": len(errors),
+        "latency": percentiles(latencies),
+    }
+
+
+def measure_exports(conn, term: str, years: int) -> dict:
+    """Time, size and rows of every export format for ``term``, written to a file as the export jobs do."""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="expera-bench-") as tmp:
+        for name, (extension, _, write) in EXPORT_FORMATS.items():
+            path = Path(tmp) / f"export{extension}"
+            rows = []
+            with open(path, "wb") as target:
+                elapsed, _ = timed(lambda: write(conn, term, years, target, progress=rows.append))
+            conn.rollback()
+            results[name] = {"seconds": round(elapsed, 3), "bytes": path.stat().st_size, "rows": sum(rows)}
+            path.unlink()
+    return results
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process. On Linux VmHWM is used because
+    ru_maxrss carries over the parent's peak into spawned children.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _memory_probe(kind: str, term: str, years: int) -> float:
+    """Runs in a fresh process: peak RSS growth in MB of one search or XLSX export (to a file)."""
+    conn = bench_connect()
+    detect_sales_source(conn)
+    detect_search_backend(conn)
+    conn.rollback()
+    base = peak_rss_mb()
+    if kind == "xlsx":
+        with tempfile.TemporaryFile() as target:
+            write_search_excel(conn, term, years, target)
+    else:
+        fetch_search(conn, term, years)
+    peak = peak_rss_mb()
+    conn.close()
+    return round(peak - base, 1)
+
+
+def measure_memory(term: str, years: int) -> dict:
+    results = {}
+    for kind in ("search", "xlsx"):
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as ex:
+            results[kind] = ex.submit(_memory_probe, kind, term, years).result()
+    return {"term": term, "peak_rss_mb": results}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(terms, years: int, repeat: int, sessions: list[int], duration: float) -> dict:
+    conn = bench_connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT lines, seed FROM bench.fixture")
+            lines, seed = cur.fetchone()
+        conn.rollback()
+        detect_sales_source(conn)
+        detect_search_backend(conn)
+        detect_insights_rollup(conn)
+        conn.rollback()
+
+        report = {
+            "meta": {
+                "ts": datetime.now().isoformat(timespec="seconds"),
+                "git": git_revision(),
+                "host": platform.node(),
+                "python": platform.python_version(),
+                "database": BENCH_DB,
+                "fixture_lines": lines,
+                "fixture_seed": seed,
+                "sales_source": active_sales_source(),
+                "search_backend": active_search_backend(),
+                "insights_source": active_insights_source(),
+                "years": years,
+                "repeat": repeat,
+                "terms": list(terms),
+            },
+        }
+        print("· Latencia secuencial...", flush=True)
+        report["latency"] = measure_latency(conn, terms, years, repeat)
+        # The term with most rows drives the export and memory measurements
+        heaviest = max(report["latency"]["rows"], key=report["latency"]["rows"].get)
+        print(f"· Exportaciones («{heaviest}»)...", flush=True)
+        report["export"] = measure_exports(conn, heaviest, years)
+    finally:
+        conn.close()
+
+    report["throughput"] = []
+    pool = ConnectionPool(1, max(sessions), timeout=60, **{**connection_kwargs(), "database": BENCH_DB})
+    try:
+        for n in sessions:
+            print(f"· Concurrencia: {n} sesiones...", flush=True)
+            report["throughput"].append(measure_throughput(pool, terms, years, n, duration))
+    finally:
+        pool.close()
+
+    print("· Memoria...", flush=True)
+    report["memory"] = measure_memory(heaviest, years)
+    return report
+
+
+# -----------------------------
+# Reports
+# -----------------------------
+def report_metrics(report: dict) -> dict:
+    """Flat {metric: value} view of a report; every metric is lower-is-better."""
+    metrics = {}
+    for op, stats in report["latency"]["ops"].items():
+        for p in ("p50", "p95"):
+            metrics[f"latency.{op}.{p}_ms"] = stats.get(p)
+    for fmt, stats in report["export"].items():
+        metrics[f"export.{fmt}.seconds"] = stats["seconds"]
+    for run in report["throughput"]:
+        metrics[f"throughput.{run['sessions']}.p95_ms"] = run["latency"].get("p95")
+    for kind, mb in report["memory"]["peak_rss_mb"].items():
+        metrics[f"memory.{kind}.peak_mb"] = mb
+    return metrics
+
+
+def print_report(report: dict) -> None:
+    meta = report["meta"]
+    print(
+        f"\nFixture {meta['fixture_lines']:,} líneas · origen {meta['sales_source']} · "
+        f"búsqueda {meta['search_backend']} · resumen {meta.get('insights_source', '-')} · "
+        f"git {meta['git'] or '-'}"
+    )
+    print(f"{'operación':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'máx ms':>10}")
+    for op, s in report["latency"]["ops"].items():
+        print(f"{op:<12}{s['p50']:>10,.1f}{s['p95']:>10,.1f}{s['p99']:>10,.1f}{s['max']:>10,.1f}")
+    print(f"\n{'formato':<12}{'segundos':>10}{'MB':>10}")
+    for fmt, s in report["export"].items():
+        print(f"{fmt:<12}{s['seconds']:>10,.2f}{s['bytes'] / 1e6:>10,.1f}")
+    print(f"\n{'sesiones':<12}{'vistas/s':>10}{'p95 ms':>10}{'errores':>10}")
+    for run in report["throughput"]:
+        print(f"{run['sessions']:<12}{run['views_per_s']:>10,.2f}{run['latency'].get('p95', 0):>10,.1f}{run['errors']:>10}")
+    mem = report["memory"]["peak_rss_mb"]
+    print(f"\nMemoria pico («{report['memory']['term']}»): búsqueda {mem['search']} MB · XLSX {mem['xlsx']} MB")
+
+
+def compare_reports(base: dict, new: dict, threshold: float = REGRESSION_THRESHOLD) -> list[str]:
+    """Prints every shared metric side by side; returns those that regressed by more than ``threshold``."""
+    old_metrics, new_metrics = report_metrics(base), report_metrics(new)
+    regressions = []
+    print(f"{'métrica':<36}{'base':>12}{'nuevo':>12}{'cambio':>10}")
+    for name in sorted(old_metrics.keys() & new_metrics.keys()):
+        old, cur = old_metrics[name], new_metrics[name]
+        if old is None or cur is None:
+            continue
+        change = (cur - old) / old if old else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  ⚠"
+        print(f"{name:<36}{old:>12,.2f}{cur:>12,.2f}{change:>+10.0%}{flag}")
+    if base["meta"]["fixture_lines"] != new["meta"]["fixture_lines"]:
+        print("Aviso: los informes usan fixtures de distinto tamaño.")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de EXPERA BI sobre un ERP sintético.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_fixture = sub.add_parser("fixture", help=f"crea el ERP sintético en {BENCH_DB}")
+    p_fixture.add_argument("--lines", type=int, default=2_000_000, help="líneas de notas de pedido")
+    p_fixture.add_argument("--seed", type=float, default=0.42, help="semilla de random() en Postgres")
+    p_fixture.add_argument("--trgm", action="store_true", help="crea también los índices de sql/001_search_trgm.sql")
+    p_fixture.add_argument("--fact", action="store_true", help="crea y carga también bi.ventas_fact y bi.ventas_mes")
+
+    p_run = sub.add_parser("run", help="ejecuta los benchmarks y guarda el informe JSON")
+    p_run.add_argument("--terms", help="términos separados por comas (por defecto, la mezcla estándar)")
+    p_run.add_argument("--years", type=int, default=BENCH_YEARS)
+    p_run.add_argument("--repeat", type=int, default=5, help="repeticiones de cada término")
+    p_run.add_argument("--sessions", default="1,4,8", help="sesiones concurrentes a probar")
+    p_run.add_argument("--duration", type=float, default=20.0, help="segundos por nivel de concurrencia")
+    p_run.add_argument("--output", help="ruta del informe (por defecto bench_reports/<fecha>_<git>.json)")
+
+    p_compare = sub.add_parser("compare", help="compara dos informes y marca regresiones")
+    p_compare.add_argument("base")
+    p_compare.add_argument("new")
+    p_compare.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                           help="empeoramiento relativo tolerado (0.10 = 10%%)")
+
+    args = parser.parse_args()
+
+    if args.command == "fixture":
+        start = time.monotonic()
+        sizes = build_fixture(args.lines, seed=args.seed, trgm=args.trgm, fact=args.fact)
+        print(
+            f"{BENCH_DB}: {sizes['lines']:,} líneas, {sizes['orders']:,} pedidos, "
+            f"{sizes['clients']:,} clientes, {sizes['products']:,} productos "
+            f"en {time.monotonic() - start:.0f}s"
+        )
+    elif args.command == "run":
+        terms = tuple(t.strip() for t in args.terms.split(",")) if args.terms else BENCH_TERMS
+        sessions = [int(n) for n in args.sessions.split(",")]
+        report = run_benchmarks(terms, args.years, args.repeat, sessions, args.duration)
+        print_report(report)
+        if args.output:
+            output = Path(args.output)
+        else:
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output = BENCH_REPORTS_DIR / f"{stamp}_{report['meta']['git'] or 'local'}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"\nInforme: {output}")
+    else:
+        base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+        new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+        regressions = compare_reports(base, new, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regresiones por encima del {args.threshold:.0%}.")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
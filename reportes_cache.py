@@ -0,0 +1,238 @@
+"""
+Process-wide result cache shared by every Streamlit session.
+
+Replaces the per-function ``st.cache_data`` caches with a single LRU bounded
+by an approximate byte budget, keyed on normalized search terms so that
+"Samsung", "samsung " and "SAMSUNG" share one entry. Detail results for a
+wider year window also answer narrower windows by filtering on Fecha, and a
+cached single term answers any longer single term containing it ("sams" ->
+"samsung") by filtering on the matched columns.
+"""
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import pandas as pd
+
+from reportes_db import get_env
+from reportes_search import is_plain_search
+
+RESULT_CACHE_MAX_MB = int(get_env("RESULT_CACHE_MAX_MB", "512"))
+RESULT_CACHE_TTL = int(get_env("RESULT_CACHE_TTL", "600"))
+
+# Detail columns matched by the SQL search predicate (ILIKE '%term%')
+SEARCH_MATCH_COLUMNS = ("Producto", "Cliente", "Nº Documento")
+
+
+def normalize_query(search_query: str) -> str:
+    """
+    Canonical form of a search term: trimmed and lower-cased, which is exactly
+    what ILIKE ignores. Accents are kept because the SQL match is
+    accent-sensitive ("epson" does not match "ÉPSON").
+    """
+    return search_query.strip().lower()
+
+
+def cache_key(kind: str, search_query: str, *args) -> tuple:
+    return (kind, normalize_query(search_query), *args)
+
+
+def estimate_size(value) -> int:
+    """Approximate memory footprint of a cached value in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+def narrow_to_years(df: pd.DataFrame, years: int) -> pd.DataFrame:
+    """Rows of a wider-window detail result that fall inside a ``years`` window."""
+    min_date = date.today() - timedelta(days=365 * years)
+    return df[pd.to_datetime(df["Fecha"]) >= pd.Timestamp(min_date)]
+
+
+def can_refine(search_query: str) -> bool:
+    """
+    Whether a substring match in pandas gives the same rows as ILIKE. Only for
+    a single bare term (no field filters, quotes or several words), and not
+    for LIKE wildcards/escapes nor non-ASCII terms: how ILIKE folds "Ñ" or "Á"
+    depends on the database's LC_CTYPE.
+    """
+    return (
+        search_query.isascii()
+        and not any(ch in search_query for ch in "%_\\")
+        and is_plain_search(search_query)
+    )
+
+
+def narrow_to_term(df: pd.DataFrame, search_query: str) -> pd.DataFrame:
+    """Rows of a shorter term's detail result that also match ``search_query``."""
+    term = normalize_query(search_query)
+    mask = pd.Series(False, index=df.index)
+    for col in SEARCH_MATCH_COLUMNS:
+        mask |= df[col].astype("string").str.lower().str.contains(term, regex=False, na=False)
+    return df[mask]
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache with a byte budget and a time-to-live.
+
+    Values are shared between sessions and must be treated as read-only.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, stored_at, prewarmed)
+        self._bytes = 0
+        self._stats = {
+            "hits": 0,
+            "window_hits": 0,
+            "refine_hits": 0,
+            "prewarm_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "rejected": 0,
+        }
+
+    def get(self, key):
+        """Cached value for ``key``, or None on a miss."""
+        with self._lock:
+            value = self._lookup_locked(key)
+            self._stats["hits" if value is not None else "misses"] += 1
+            return value
+
+    def get_window(self, kind: str, search_query: str, years: int, max_years: int):
+        """
+        Detail result for ``years``: the exact entry if cached, otherwise the
+        narrowest cached wider window filtered down with narrow_to_years(),
+        otherwise the longest cached term contained in ``search_query``
+        filtered down with narrow_to_term().
+        """
+        q = normalize_query(search_query)
+        refined = False
+        with self._lock:
+            value = self._lookup_locked((kind, q, years))
+            if value is not None:
+                self._stats["hits"] += 1
+                return value
+            for wider in range(years + 1, max_years + 1):
+                value = self._lookup_locked((kind, q, wider))
+                if value is not None:
+                    self._stats["window_hits"] += 1
+                    break
+            else:
+                value = self._lookup_refinable_locked(kind, q, years, max_years) if can_refine(q) else None
+                if value is None:
+                    self._stats["misses"] += 1
+                    return None
+                self._stats["refine_hits"] += 1
+                refined = True
+        if refined:
+            value = narrow_to_term(value, q)
+        return narrow_to_years(value, years)
+
+    def put(self, key, value, prewarmed: bool = False) -> None:
+        """Stores ``value``; ``prewarmed`` entries count the lookups they serve as prewarm_hits."""
+        size = estimate_size(value)
+        with self._lock:
+            self._remove_locked(key)
+            if size > self.max_bytes:
+                self._stats["rejected"] += 1
+                return
+            self._entries[key] = (value, size, time.monotonic(), prewarmed)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key = next(iter(self._entries))
+                self._remove_locked(old_key)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["entries"] = len(self._entries)
+            s["bytes"] = self._bytes
+        s["max_bytes"] = self.max_bytes
+        served = s["hits"] + s["window_hits"] + s["refine_hits"]
+        lookups = served + s["misses"]
+        s["hit_ratio"] = served / lookups if lookups else 0.0
+        s["prewarm_ratio"] = s["prewarm_hits"] / lookups if lookups else 0.0
+        return s
+
+    def _lookup_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, _, stored_at, prewarmed = entry
+        if time.monotonic() - stored_at > self.ttl:
+            self._remove_locked(key)
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        if prewarmed:
+            self._stats["prewarm_hits"] += 1
+        return value
+
+    def _lookup_refinable_locked(self, kind: str, q: str, years: int, max_years: int):
+        # Longest cached term that q extends (most selective), then narrowest window
+        candidates = sorted(
+            (key for key in self._entries
+             if key[0] == kind and len(key) == 3 and key[1] != q and key[1] in q
+             and years <= key[2] <= max_years and is_plain_search(key[1])),
+            key=lambda key: (-len(key[1]), key[2]),
+        )
+        for key in candidates:
+            value = self._lookup_locked(key)
+            if value is not None:
+                return value
+        return None
+
+    def _remove_locked(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+
+class DerivedCache:
+    """
+    Small thread-safe LRU of values derived from cached results (e.g. Plotly
+    figures). An entry only answers while its source is the very same object,
+    so a re-fetched result never gets a stale derived value.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (source, value)
+
+    def get(self, key, source):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not source:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, source, value) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (source, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def create_result_cache() -> ResultCache:
+    return ResultCache(RESULT_CACHE_MAX_MB * 1024 * 1024, RESULT_CACHE_TTL)
@@ -0,0 +1,159 @@
+"""
+Period-over-period comparison for the Insights tab.
+
+Revenue, units and orders of a search in the current period against the
+prior one (month over month, the same month or year-to-date a year earlier,
+or the last 12 months against the 12 before), per product, client and
+warehouse plus the totals, with the change of each and the top movers.
+
+Everything comes from one query over the search's sales source: the two
+periods are read in the same scan and told apart with FILTER, and GROUPING
+SETS returns every breakdown at once, so no detail row leaves the database
+and nothing is queried twice. The monthly rollup (bi.ventas_mes) cannot
+answer it because distinct orders do not add up across months.
+
+Periods end on the current day, or on the last day of ``hasta:`` when the
+search has one; periods to date are compared with the same days of the prior
+period. The years window and ``desde:`` do not limit the comparison.
+"""
+import calendar
+from datetime import date, timedelta
+
+import pandas as pd
+
+from reportes_queries import build_search_filter, read_frame
+from reportes_search import parse_search
+
+# period -> label
+COMPARISON_PERIODS = {
+    "mes": "Mes en curso vs. mes anterior",
+    "mes_anual": "Mes en curso vs. mismo mes del año anterior",
+    "anio": "Año en curso vs. mismo periodo del año anterior",
+    "12m": "Últimos 12 meses vs. 12 meses anteriores",
+}
+
+# breakdown -> (GROUPING() value of its grouping set, column title)
+# GROUPING() bits: producto=4, cliente=2, almacen=1 (set when the column is aggregated away)
+COMPARISON_DIMENSIONS = {
+    "producto": (3, "Producto"),
+    "cliente": (5, "Cliente"),
+    "almacen": (6, "Almacén"),
+}
+_TOTALS_GROUPING = 7
+
+# Measures compared: SQL alias prefix -> column title
+COMPARISON_MEASURES = {
+    "importe": "Importe",
+    "cantidad": "Cant.",
+    "pedidos": "Pedidos",
+}
+
+
+def shift_months(day: date, months: int) -> date:
+    """``day`` moved ``months`` months, clamped to the end of the month (31 Mar - 1 month = 28/29 Feb)."""
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def comparison_periods(period: str, last_day: date) -> tuple[tuple[date, date], tuple[date, date]]:
+    """Current and prior periods ending on ``last_day``, each as (first day, day after the last)."""
+    if period not in COMPARISON_PERIODS:
+        raise ValueError(period)
+    current_to = last_day + timedelta(days=1)
+    if period == "12m":
+        current_from = shift_months(last_day, -12) + timedelta(days=1)
+        # The 12 months right before, so the windows meet without overlapping (e.g. around 29 Feb)
+        return (current_from, current_to), (shift_months(current_from, -12), current_from)
+    if period == "anio":
+        current_from = last_day.replace(month=1, day=1)
+    else:
+        current_from = last_day.replace(day=1)
+    months = 1 if period == "mes" else 12
+    prior_last = shift_months(last_day, -months)
+    if last_day.day == calendar.monthrange(last_day.year, last_day.month)[1]:
+        # A whole month is compared with the whole prior month (30 Jun -> 31 May)
+        prior_last = prior_last.replace(day=calendar.monthrange(prior_last.year, prior_last.month)[1])
+    prior = (shift_months(current_from, -months), prior_last + timedelta(days=1))
+    return (current_from, current_to), prior
+
+
+def build_comparison_query(search_query: str, period: str) -> tuple[str, dict, tuple]:
+    """Comparison query for a search, its parameters and the (current, prior) periods."""
+    last_day = date.today()
+    search = parse_search(search_query)
+    if search.until is not None:
+        last_day = min(last_day, search.until - timedelta(days=1))
+    current, prior = comparison_periods(period, last_day)
+
+    where_sql, params, c = build_search_filter(search_query, 1)
+    # The prior period replaces the years window (and desde:) as the lower bound
+    params.update(min_date=prior[0], cur_from=current[0], cur_to=current[1], prev_to=prior[1])
+    is_current = f"{c['creado']} >= %(cur_from)s"
+    measures = {"importe": f"SUM({c['importe']})", "cantidad": f"SUM({c['cantidad']})"}
+    columns = []
+    for name, aggregate in measures.items():
+        columns.append(f"COALESCE({aggregate} FILTER (WHERE {is_current}), 0) AS {name}_actual")
+        columns.append(f"COALESCE({aggregate} FILTER (WHERE NOT {is_current}), 0) AS {name}_anterior")
+    columns.append(f"COUNT(DISTINCT {c['numero']}) FILTER (WHERE {is_current}) AS pedidos_actual")
+    columns.append(f"COUNT(DISTINCT {c['numero']}) FILTER (WHERE NOT {is_current}) AS pedidos_anterior")
+    separator = ",\n      "
+    sql = f"""
+    SELECT
+      GROUPING({c['producto']}, {c['cliente']}, {c['almacen']}) AS grp,
+      {c['producto']} AS producto,
+      {c['cliente']}  AS cliente,
+      {c['almacen']}  AS almacen,
+      {separator.join(columns)}
+    {where_sql}
+      AND (({c['creado']} >= %(cur_from)s AND {c['creado']} < %(cur_to)s) OR {c['creado']} < %(prev_to)s)
+    GROUP BY GROUPING SETS (({c['producto']}), ({c['cliente']}), ({c['almacen']}), ())
+    """
+    return sql, params, (current, prior)
+
+
+def _with_changes(df: pd.DataFrame) -> pd.DataFrame:
+    """Adds the absolute and relative change of revenue (relative is NaN without prior revenue)."""
+    prior = df["Importe anterior"]
+    change = df["Importe actual"] - prior
+    return df.assign(**{
+        "Variación": change,
+        "Variación %": (change / prior.where(prior != 0)),
+    })
+
+
+def fetch_comparison(conn, search_query: str, period: str) -> dict:
+    """
+    Current vs. prior period of a search: "periods" ((from, to) ISO dates of
+    each, to excluded), "totals" (``<measure>_actual``/``<measure>_anterior``)
+    and one frame per COMPARISON_DIMENSIONS breakdown, by current revenue.
+    """
+    sql, params, (current, prior) = build_comparison_query(search_query, period)
+    df = read_frame(conn, sql, params)
+    value_columns = [f"{m}_{p}" for m in COMPARISON_MEASURES for p in ("actual", "anterior")]
+    df[value_columns] = df[value_columns].apply(pd.to_numeric).astype(float)
+    df[["pedidos_actual", "pedidos_anterior"]] = df[["pedidos_actual", "pedidos_anterior"]].astype("int64")
+
+    totals_row = df[df["grp"] == _TOTALS_GROUPING]
+    totals = {col: totals_row[col].iloc[0].item() if len(totals_row) else 0 for col in value_columns}
+    result = {
+        "periods": {
+            "current": [current[0].isoformat(), current[1].isoformat()],
+            "prior": [prior[0].isoformat(), prior[1].isoformat()],
+        },
+        "totals": totals,
+    }
+    titles = {
+        f"{m}_{p}": f"{title} {p}" for m, title in COMPARISON_MEASURES.items() for p in ("actual", "anterior")
+    }
+    for dimension, (grouping, title) in COMPARISON_DIMENSIONS.items():
+        part = df[(df["grp"] == grouping) & df[dimension].notna()]
+        part = part.rename(columns={dimension: title, **titles})[[title, *titles.values()]]
+        result[dimension] = _with_changes(part).sort_values("Importe actual", ascending=False).reset_index(drop=True)
+    return result
+
+
+def top_movers(df: pd.DataFrame, limit: int = 10) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Rows of a comparison breakdown with the largest revenue gains and the largest drops."""
+    gains = df[df["Variación"] > 0].nlargest(limit, "Variación").reset_index(drop=True)
+    drops = df[df["Variación"] < 0].nsmallest(limit, "Variación").reset_index(drop=True)
+    return gains, drops
@@ -0,0 +1,501 @@
+"""
+Database access for the EXPERA reporting app.
+
+Holds the connection settings (read from the environment) and a process-wide
+psycopg2 connection pool shared by every Streamlit session. With PG_REPLICAS
+set, the app's reads are routed to healthy read replicas instead of the ERP
+primary, which is kept only as a fallback.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+def get_env(name: str, default: str | None = None) -> str | None:
+    v = os.getenv(name, default)
+    if v is None or str(v).strip() == "":
+        return default
+    return str(v)
+
+# DB Credentials
+PG_HOST = get_env("PG_HOST", "localhost")
+PG_PORT = int(get_env("PG_PORT", "5432"))
+PG_DB = get_env("PG_DB", "upgradedb")
+PG_USER = get_env("PG_USER", "postgres")
+PG_PASSWORD = get_env("PG_PASSWORD", "")
+
+# Pool sizing & health
+PG_POOL_MIN = int(get_env("PG_POOL_MIN", "1"))
+PG_POOL_MAX = int(get_env("PG_POOL_MAX", "10"))
+PG_POOL_TIMEOUT = float(get_env("PG_POOL_TIMEOUT", "15"))
+PG_POOL_PING_AFTER = float(get_env("PG_POOL_PING_AFTER", "30"))
+PG_POOL_MAX_IDLE = float(get_env("PG_POOL_MAX_IDLE", "300"))
+
+# Server-side limit for statements run by the app (seconds, 0 = no limit)
+PG_STATEMENT_TIMEOUT = float(get_env("PG_STATEMENT_TIMEOUT", "120"))
+# Memory per sort/hash of the app's sessions, e.g. "64MB" (empty = server default)
+PG_WORK_MEM = get_env("PG_WORK_MEM", "")
+
+# Read replicas for the app's queries: "host[:port],host[:port]" (same database and user)
+PG_REPLICAS = get_env("PG_REPLICAS", "")
+# Replicas further behind the primary than this (seconds) are skipped
+PG_REPLICA_MAX_LAG = float(get_env("PG_REPLICA_MAX_LAG", "300"))
+# Seconds between health/lag checks of each replica
+PG_REPLICA_CHECK_INTERVAL = float(get_env("PG_REPLICA_CHECK_INTERVAL", "30"))
+# Fall back to the primary when no replica is usable (0 = fail instead)
+PG_REPLICA_FALLBACK = get_env("PG_REPLICA_FALLBACK", "1") == "1"
+# Seconds to wait for a free connection on a full replica before using the primary
+PG_REPLICA_WAIT = float(get_env("PG_REPLICA_WAIT", "0.5"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Checkout blocks up to ``timeout`` seconds when all ``maxconn`` connections
+    are busy. Connections idle for longer than ``ping_after`` seconds are
+    pinged before being handed out, and broken ones (e.g. after the SSH tunnel
+    drops) are replaced transparently. Idle connections above ``minconn`` are
+    closed after ``max_idle`` seconds.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 15.0,
+                 ping_after: float = 30.0, max_idle: float = 300.0, **connect_kwargs):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError("Invalid pool sizing: need 0 <= minconn <= maxconn and maxconn >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.max_idle = max_idle
+        self._connect_kwargs = connect_kwargs
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, last_used) pairs, most recently used on the right
+        self._size = 0        # open connections, idle + checked out
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_errors": 0,
+            "reconnects": 0,
+            "discarded": 0,
+        }
+
+    # -- public API ---------------------------------------------------------
+
+    def open(self) -> None:
+        """Eagerly opens ``minconn`` connections. Failures are left for checkout to retry."""
+        for _ in range(self.minconn):
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                return
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None):
+        """
+        Checks out a healthy connection and returns it to the pool afterwards,
+        waiting up to ``timeout`` seconds (the pool's timeout by default).
+        """
+        conn = self._checkout(self.timeout if timeout is None else timeout)
+        try:
+            yield conn
+        except psycopg2.extensions.QueryCanceledError:
+            # Cancelled or timed out: the connection itself is fine after rollback.
+            self._release(conn)
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self._release(conn, discard=True)
+            raise
+        except BaseException:
+            self._release(conn)
+            raise
+        else:
+            self._release(conn)
+
+    def stats(self) -> dict:
+        """Snapshot of pool usage and checkout-wait metrics."""
+        with self._cond:
+            s = dict(self._stats)
+            s["size"] = self._size
+            s["idle"] = len(self._idle)
+            s["in_use"] = self._size - len(self._idle)
+        s["wait_time_avg"] = s["wait_time_total"] / s["checkouts"] if s["checkouts"] else 0.0
+        return s
+
+    def close(self) -> None:
+        """Closes idle connections; checked-out ones are closed when returned."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    # -- internals ----------------------------------------------------------
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self._connect_kwargs)
+        except psycopg2.Error:
+            with self._cond:
+                self._stats["connect_errors"] += 1
+            raise
+        with self._cond:
+            self._stats["connects"] += 1
+        return conn
+
+    def _checkout(self, timeout: float):
+        start = time.monotonic()
+        deadline = start + timeout
+        waited = False
+        conn, last_used = None, None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("El pool de conexiones está cerrado")
+                self._reap_idle_locked()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Sin conexiones libres tras {timeout:.0f}s ({self.maxconn} en uso)"
+                    )
+                waited = True
+                self._cond.wait(remaining)
+            wait = time.monotonic() - start
+            self._stats["checkouts"] += 1
+            self._stats["wait_time_total"] += wait
+            self._stats["wait_time_max"] = max(self._stats["wait_time_max"], wait)
+            if waited:
+                self._stats["waits"] += 1
+
+        if conn is not None and self._is_healthy(conn, last_used):
+            return conn
+        if conn is not None:
+            # Stale or broken connection: replace it in the same slot.
+            self._close_quietly(conn)
+            with self._cond:
+                self._stats["reconnects"] += 1
+        try:
+            return self._connect()
+        except BaseException:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release(self, conn, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            try:
+                # End the implicit transaction so the next user starts clean.
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._stats["discarded"] += 1
+                self._cond.notify()
+                close = True
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+                close = False
+        if close:
+            self._close_quietly(conn)
+
+    def _reap_idle_locked(self) -> None:
+        # Oldest idle connections sit on the left; keep at least minconn open.
+        now = time.monotonic()
+        while len(self._idle) > 0 and self._size > self.minconn:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.max_idle:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._stats["discarded"] += 1
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# Replay lag in seconds; 0 when the replica has replayed everything it received
+REPLICA_LAG_SQL = """
+SELECT pg_is_in_recovery(),
+       CASE WHEN NOT pg_is_in_recovery()
+              OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+       END
+"""
+
+
+class Replica:
+    """A read replica's pool and its last health check."""
+
+    def __init__(self, name: str, pool: ConnectionPool):
+        self.name = name
+        self.pool = pool
+        self.healthy = True
+        self.lag = 0.0
+        self.error = None
+        self.checked_at = None
+        self.check_lock = threading.Lock()
+
+
+class ReplicaRouter:
+    """
+    Pool-compatible router over read replicas and the primary.
+
+    Each checkout goes to the healthy replica with the fewest connections in
+    use. Replicas are re-checked every ``check_interval`` seconds (by the
+    checkout that finds the check stale) and skipped while unreachable or more
+    than ``max_lag`` seconds behind; a replica whose connection fails is
+    marked unhealthy at once. Without a usable replica, or when the chosen
+    one has no connection free within ``replica_wait`` seconds, checkouts go
+    to the primary if ``fallback`` is set and raise PoolTimeout otherwise
+    (after the replica pool's own timeout).
+    """
+
+    def __init__(self, primary: ConnectionPool, replicas: list[Replica], max_lag: float = 300.0,
+                 check_interval: float = 30.0, fallback: bool = True, primary_name: str = "primary",
+                 replica_wait: float = 0.5):
+        self.primary = primary
+        self.primary_name = primary_name
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.fallback = fallback
+        self.replica_wait = replica_wait
+        self._lock = threading.Lock()
+        self._routed = {"replica": 0, "primary": 0}
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection from the chosen target, falling back to the primary if it is down or full."""
+        replica = self._choose()
+        with ExitStack() as stack:
+            conn = None
+            if replica is not None:
+                try:
+                    # With a fallback, a full replica is not worth waiting for
+                    timeout = self.replica_wait if self.fallback else None
+                    conn = stack.enter_context(replica.pool.connection(timeout))
+                    self._count("replica")
+                except psycopg2.OperationalError as e:
+                    self._mark_down(replica, e)
+                except PoolTimeout:
+                    # Saturated, not broken: it stays healthy for the next checkouts
+                    pass
+            if conn is None:
+                if not self.fallback:
+                    raise PoolTimeout("Ninguna réplica de lectura disponible")
+                conn = stack.enter_context(self.primary.connection())
+                self._count("primary")
+            yield conn
+
+    def stats(self) -> dict:
+        """Pool metrics summed over every target, plus the state of each one."""
+        targets = [(self.primary_name, self.primary, None)] + [(r.name, r.pool, r) for r in self.replicas]
+        total = {}
+        details = []
+        for name, pool, replica in targets:
+            s = pool.stats()
+            for k, v in s.items():
+                total[k] = max(total.get(k, 0), v) if k == "wait_time_max" else total.get(k, 0) + v
+            details.append({
+                "name": name,
+                "role": "replica" if replica is not None else "primary",
+                "healthy": replica.healthy if replica is not None else True,
+                "lag": replica.lag if replica is not None else 0.0,
+                "error": replica.error if replica is not None else None,
+                "in_use": s["in_use"],
+            })
+        total["wait_time_avg"] = total["wait_time_total"] / total["checkouts"] if total["checkouts"] else 0.0
+        with self._lock:
+            total["routed"] = dict(self._routed)
+        total["targets"] = details
+        return total
+
+    def close(self) -> None:
+        self.primary.close()
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def _choose(self) -> Replica | None:
+        now = time.monotonic()
+        for replica in self.replicas:
+            if replica.checked_at is None or now - replica.checked_at >= self.check_interval:
+                self._check(replica)
+        usable = [r for r in self.replicas if r.healthy]
+        if not usable:
+            return None
+        return min(usable, key=lambda r: r.pool.stats()["in_use"])
+
+    def _check(self, replica: Replica) -> None:
+        # One check at a time per replica; concurrent checkouts use the last result
+        if not replica.check_lock.acquire(blocking=False):
+            return
+        try:
+            # Never blocks the checkout that triggered it
+            with replica.pool.connection(0) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    _, lag = cur.fetchone()
+            replica.lag = float(lag)
+            replica.healthy = replica.lag <= self.max_lag
+            replica.error = None if replica.healthy else f"retraso de {replica.lag:,.0f}s"
+        except PoolTimeout:
+            # Every connection busy: it is answering, so keep the last result until the next check
+            pass
+        except psycopg2.Error as e:
+            replica.healthy = False
+            replica.error = _first_line(e)
+        finally:
+            replica.checked_at = time.monotonic()
+            replica.check_lock.release()
+
+    def _mark_down(self, replica: Replica, error: Exception) -> None:
+        replica.healthy = False
+        replica.error = _first_line(error)
+        replica.checked_at = time.monotonic()
+
+    def _count(self, target: str) -> None:
+        with self._lock:
+            self._routed[target] += 1
+
+
+def _first_line(error: Exception) -> str:
+    return (str(error).strip().splitlines() or [type(error).__name__])[0]
+
+
+def connection_kwargs() -> dict:
+    """psycopg2.connect() arguments from the PG_* environment settings."""
+    return {
+        "host": PG_HOST,
+        "port": PG_PORT,
+        "database": PG_DB,
+        "user": PG_USER,
+        "password": PG_PASSWORD,
+        "connect_timeout": 5,
+    }
+
+
+def connect():
+    """Standalone connection for command-line jobs that don't need the pool."""
+    return psycopg2.connect(**connection_kwargs())
+
+
+def session_options() -> str:
+    """Per-session settings of the app's connections, as a libpq ``options`` string."""
+    options = []
+    if PG_STATEMENT_TIMEOUT > 0:
+        # Abandoned queries (closed tab, superseded search) can't run forever
+        options.append(f"-c statement_timeout={int(PG_STATEMENT_TIMEOUT * 1000)}")
+    if PG_WORK_MEM:
+        options.append(f"-c work_mem={PG_WORK_MEM}")
+    return " ".join(options)
+
+
+def parse_replicas(value: str) -> list[tuple[str, int]]:
+    """(host, port) pairs from a "host[:port],..." list; the port defaults to PG_PORT."""
+    replicas = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":") if ":" in item else (item, "", "")
+        replicas.append((host, int(port) if port else PG_PORT))
+    return replicas
+
+
+def create_pool() -> ConnectionPool | ReplicaRouter:
+    """
+    Builds the app's pool from the PG_* environment settings: a pool on the
+    primary, or a ReplicaRouter when PG_REPLICAS lists read replicas.
+    """
+    kwargs = connection_kwargs()
+    options = session_options()
+    if options:
+        kwargs["options"] = options
+    replicas = parse_replicas(PG_REPLICAS)
+    pool = ConnectionPool(
+        # Only a fallback behind replicas: no connections kept open on the primary
+        0 if replicas else PG_POOL_MIN,
+        PG_POOL_MAX,
+        timeout=PG_POOL_TIMEOUT,
+        ping_after=PG_POOL_PING_AFTER,
+        max_idle=PG_POOL_MAX_IDLE,
+        **kwargs,
+    )
+    pool.open()
+    if not replicas:
+        return pool
+    routed = []
+    for host, port in replicas:
+        replica_pool = ConnectionPool(
+            PG_POOL_MIN,
+            PG_POOL_MAX,
+            timeout=PG_POOL_TIMEOUT,
+            ping_after=PG_POOL_PING_AFTER,
+            max_idle=PG_POOL_MAX_IDLE,
+            **{**kwargs, "host": host, "port": port},
+        )
+        replica_pool.open()
+        routed.append(Replica(f"{host}:{port}", replica_pool))
+    return ReplicaRouter(
+        pool, routed,
+        max_lag=PG_REPLICA_MAX_LAG,
+        check_interval=PG_REPLICA_CHECK_INTERVAL,
+        fallback=PG_REPLICA_FALLBACK,
+        primary_name=f"{PG_HOST}:{PG_PORT}",
+        replica_wait=PG_REPLICA_WAIT,
+    )
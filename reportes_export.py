@@ -0,0 +1,240 @@
+"""
+File exports of search results.
+
+The XLSX writer streams rows through xlsxwriter's constant_memory mode: each
+row is flushed to disk as soon as it is written, number formats are set once
+per column, column widths are measured on a sample of rows, and the summary
+row is a SUM formula, so memory stays flat regardless of the number of rows.
+
+The bulk formats skip pandas entirely: CSV (plain or gzip) is produced by
+Postgres with ``COPY ... TO STDOUT`` and Parquet is written from a server-side
+cursor one row group at a time. The writers that take ``progress`` report
+the rows written so far, for the background export jobs (reportes_export_jobs).
+"""
+import gzip
+from itertools import chain
+
+import pandas as pd
+import psycopg2.extensions
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name
+
+from reportes_db import get_env
+from reportes_queries import build_search_query
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+GZIP_MIME = "application/gzip"
+PARQUET_MIME = "application/vnd.apache.parquet"
+
+# Rows inspected to size the columns
+EXPORT_WIDTH_SAMPLE = int(get_env("EXPORT_WIDTH_SAMPLE", "2000"))
+
+# Rows per Parquet row group and per fetch from the server-side cursor
+EXPORT_BATCH_ROWS = int(get_env("EXPORT_BATCH_ROWS", "50000"))
+EXPORT_GZIP_LEVEL = int(get_env("EXPORT_GZIP_LEVEL", "6"))
+
+# Rows between progress reports of write_search_excel() (the slowest writer)
+EXCEL_PROGRESS_ROWS = 5000
+
+SHEET_NAME = "Reporte Detallado"
+CURRENCY_FORMAT = '"S/" #,##0.00'
+
+
+def _column_format(col: str) -> dict | None:
+    if "Fecha" in col:
+        return {"num_format": "dd/mm/yyyy"}
+    if "Precio" in col or "Importe" in col:
+        return {"num_format": CURRENCY_FORMAT}
+    return None
+
+
+def _column_width(sample: pd.Series, title: str) -> float:
+    longest = sample.astype(str).str.len().fillna(0).max() if len(sample) else 0
+    return min(max(int(longest), len(str(title))) + 4, 50)
+
+
+def _open_sheet(target, columns: list[str], sample: pd.DataFrame):
+    """Workbook and worksheet with column formats and widths set and the header row written."""
+    wb = xlsxwriter.Workbook(target, {"constant_memory": True, "strings_to_urls": False})
+    ws = wb.add_worksheet(SHEET_NAME)
+    header_fmt = wb.add_format({
+        "bold": True, "font_size": 12, "font_color": "#FFFFFF", "bg_color": "#1E293B",
+        "align": "center", "valign": "vcenter",
+    })
+    for i, col in enumerate(columns):
+        fmt = _column_format(col)
+        ws.set_column(i, i, _column_width(sample[col], col), wb.add_format(fmt) if fmt else None)
+    ws.write_row(0, 0, columns, header_fmt)
+    return wb, ws
+
+
+def _close_sheet(wb, ws, columns: list[str], last_row: int, importe_total: float) -> None:
+    """Writes the "RESUMEN TOTAL" row at ``last_row`` and closes the workbook."""
+    total_label_fmt = wb.add_format({"bold": True, "font_size": 12, "align": "right"})
+    total_fmt = wb.add_format({
+        "bold": True, "font_size": 12, "bg_color": "#F1F5F9", "align": "right",
+        "num_format": CURRENCY_FORMAT,
+    })
+    if "Importe Total" in columns:
+        importe_col = columns.index("Importe Total")
+        if importe_col > 1:
+            ws.merge_range(last_row, 0, last_row, importe_col - 1, "RESUMEN TOTAL", total_label_fmt)
+        else:
+            ws.write_string(last_row, 0, "RESUMEN TOTAL", total_label_fmt)
+        letter = xl_col_to_name(importe_col)
+        ws.write_formula(
+            last_row, importe_col, f"=SUM({letter}2:{letter}{last_row})", total_fmt,
+            # Cached result for viewers that don't recalculate formulas
+            importe_total,
+        )
+    else:
+        ws.write_string(last_row, 0, "RESUMEN TOTAL (Columna no encontrada)", total_label_fmt)
+    wb.close()
+
+
+# -----------------------------
+# Bulk exports straight from Postgres
+# -----------------------------
+
+# NUMERIC as float so Parquet gets plain double columns instead of Decimal objects
+_NUMERIC_AS_FLOAT = psycopg2.extensions.new_type(
+    psycopg2.extensions.DECIMAL.values, "NUMERIC_AS_FLOAT",
+    lambda value, cur: float(value) if value is not None else None,
+)
+
+_ARROW_TYPES = {
+    **dict.fromkeys(psycopg2.extensions.DATE.values, pa.date32()),
+    **dict.fromkeys(psycopg2.extensions.PYDATETIME.values, pa.timestamp("us")),
+    **dict.fromkeys(psycopg2.extensions.INTEGER.values, pa.int32()),
+    **dict.fromkeys(psycopg2.extensions.LONGINTEGER.values, pa.int64()),
+    **dict.fromkeys(psycopg2.extensions.FLOAT.values, pa.float64()),
+    **dict.fromkeys(psycopg2.extensions.DECIMAL.values, pa.float64()),
+    **dict.fromkeys(psycopg2.extensions.BOOLEAN.values, pa.bool_()),
+}
+
+
+class _LineCounter:
+    """File wrapper reporting each data line COPY writes through it to ``progress``."""
+
+    def __init__(self, target, progress):
+        self.target = target
+        self.progress = progress
+        self._header = True
+
+    def write(self, data) -> int:
+        lines = data.count(b"\n")
+        if self._header and lines:
+            lines -= 1
+            self._header = False
+        if lines:
+            self.progress(lines)
+        return self.target.write(data)
+
+
+def copy_search_csv(conn, search_query: str, years: int, target, compress: bool = False,
+                    progress=None) -> None:
+    """
+    Writes the search results as CSV with header to the binary file object
+    ``target``, gzip-compressed if ``compress``. Rows go from COPY straight
+    to the file, never through pandas. ``progress`` is called with the
+    number of rows written as they are.
+    """
+    sql, params = build_search_query(search_query, years)
+    with conn.cursor() as cur:
+        # COPY takes no bind parameters, so they are inlined by mogrify()
+        copy_sql = f"COPY ({cur.mogrify(sql, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)"
+        if compress:
+            with gzip.GzipFile(fileobj=target, mode="wb", compresslevel=EXPORT_GZIP_LEVEL) as gz:
+                cur.copy_expert(copy_sql, gz if progress is None else _LineCounter(gz, progress))
+        else:
+            cur.copy_expert(copy_sql, target if progress is None else _LineCounter(target, progress))
+
+
+def search_record_batches(conn, search_query: str, years: int):
+    """
+    Yields the search results as Arrow record batches of EXPORT_BATCH_ROWS
+    rows read from a server-side cursor; an empty result yields one empty
+    batch, so the schema is always known.
+    """
+    sql, params = build_search_query(search_query, years)
+    with conn.cursor(name="expera_export") as cur:
+        psycopg2.extensions.register_type(_NUMERIC_AS_FLOAT, cur)
+        cur.itersize = EXPORT_BATCH_ROWS
+        cur.execute(sql, params)
+        rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+        schema = pa.schema([
+            (col.name, _ARROW_TYPES.get(col.type_code, pa.string())) for col in cur.description
+        ])
+        while True:
+            columns = list(zip(*rows)) or [[] for _ in schema]
+            yield pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+
+
+def write_search_parquet(conn, search_query: str, years: int, target, progress=None) -> None:
+    """
+    Writes the search results as Parquet to ``target`` (a path or a binary
+    file object), one row group per batch of search_record_batches().
+    """
+    writer = None
+    try:
+        for batch in search_record_batches(conn, search_query, years):
+            if writer is None:
+                writer = pq.ParquetWriter(target, batch.schema)
+            if batch.num_rows:
+                writer.write_table(pa.Table.from_batches([batch]), row_group_size=EXPORT_BATCH_ROWS)
+            if progress is not None:
+                progress(batch.num_rows)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _arrow_cell_writer(ws, field: pa.Field):
+    """Typed write method for an Arrow column, so xlsxwriter skips per-cell type dispatch."""
+    if "Fecha" in field.name or pa.types.is_temporal(field.type):
+        return ws.write_datetime
+    if pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_boolean(field.type):
+        return ws.write_number
+    return lambda row, col_idx, value: ws.write_string(row, col_idx, str(value))
+
+
+def write_search_excel(conn, search_query: str, years: int, target, progress=None) -> None:
+    """
+    Writes the search results as a formatted workbook (styled header,
+    date/currency formats, column widths measured on the first rows and a
+    "RESUMEN TOTAL" row summing Importe Total) straight from
+    search_record_batches(), so only one batch of rows is in memory at a time.
+    """
+    batches = search_record_batches(conn, search_query, years)
+    first = next(batches)
+    columns = first.schema.names
+    wb, ws = _open_sheet(target, columns, first.slice(0, EXPORT_WIDTH_SAMPLE).to_pandas())
+
+    writers = [(i, _arrow_cell_writer(ws, field)) for i, field in enumerate(first.schema)]
+    importe_col = columns.index("Importe Total") if "Importe Total" in columns else None
+    importe_total = 0.0
+    row_idx = 0
+    for batch in chain([first], batches):
+        for n, row in enumerate(zip(*(column.to_pylist() for column in batch.columns)), start=1):
+            for i, write in writers:
+                value = row[i]
+                if value is not None:
+                    write(row_idx + n, i, value)
+            if progress is not None and n % EXCEL_PROGRESS_ROWS == 0:
+                progress(EXCEL_PROGRESS_ROWS)
+        row_idx += batch.num_rows
+        if importe_col is not None:
+            importe_total += pc.sum(batch.column(importe_col)).as_py() or 0.0
+        if progress is not None and batch.num_rows % EXCEL_PROGRESS_ROWS:
+            progress(batch.num_rows % EXCEL_PROGRESS_ROWS)
+    _close_sheet(wb, ws, columns, row_idx + 1, float(importe_total))
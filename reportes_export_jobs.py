@@ -0,0 +1,323 @@
+"""
+Background export jobs.
+
+Building an export inside the user's rerun kept the session busy for as long
+as the file took and held the whole file in memory before the download could
+start. Exports are now queued to a bounded worker pool (EXPORT_MAX_CONCURRENT
+threads, at most EXPORT_MAX_QUEUED waiting) that writes each file into
+EXPORT_SPOOL_DIR batch by batch, reporting the rows written so far:
+
+- A request identical to one queued, running or finished less than
+  RESULT_CACHE_TTL seconds ago (same format, search, years window and sales
+  source) gets that job instead of a new one, whichever session asked first.
+- Files are written under a temporary name and renamed when complete, so a
+  file in the spool directory is always a finished export.
+- A janitor thread deletes files not requested or downloaded in the last
+  EXPORT_RETENTION seconds, including those left by other or dead processes.
+- Finished files are served from disk: by the app, or by the HTTP API's
+  /download route (with Range support for resumed downloads) when
+  EXPORT_DOWNLOAD_URL points browsers to it.
+"""
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import partial
+from pathlib import Path
+
+from reportes_cache import RESULT_CACHE_TTL, normalize_query
+from reportes_db import ConnectionPool, ReplicaRouter, get_env
+from reportes_export import (
+    CSV_MIME,
+    GZIP_MIME,
+    PARQUET_MIME,
+    XLSX_MIME,
+    copy_search_csv,
+    write_search_excel,
+    write_search_parquet,
+)
+from reportes_profiling import profiling, stage
+from reportes_queries import active_sales_source
+
+# Directory the export files are written to (shared with the API to serve them)
+EXPORT_SPOOL_DIR = get_env("EXPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "expera-exports"))
+# Exports written at once; each one holds a pooled connection while it runs
+EXPORT_MAX_CONCURRENT = int(get_env("EXPORT_MAX_CONCURRENT", "2"))
+# Server-side limit (seconds, 0 = none) of an export's statement, which runs on a
+# pooled connection: it replaces PG_STATEMENT_TIMEOUT, set for interactive queries
+EXPORT_STATEMENT_TIMEOUT = float(get_env("EXPORT_STATEMENT_TIMEOUT", "0"))
+# Exports waiting for a worker before new requests are turned away
+EXPORT_MAX_QUEUED = int(get_env("EXPORT_MAX_QUEUED", "20"))
+# Seconds a file is kept after it was last requested or downloaded
+EXPORT_RETENTION = int(get_env("EXPORT_RETENTION", "3600"))
+# Base URL of the API as seen by browsers, e.g. https://bi.example.com/api (empty = the app serves the files)
+EXPORT_DOWNLOAD_URL = get_env("EXPORT_DOWNLOAD_URL", "").rstrip("/")
+
+# Seconds between janitor passes over the spool directory
+EXPORT_CLEANUP_INTERVAL = 60
+
+# format -> (file extension, MIME type, writer(conn, search_query, years, target, progress=))
+EXPORT_FORMATS = {
+    "xlsx": (".xlsx", XLSX_MIME, write_search_excel),
+    "csv": (".csv", CSV_MIME, copy_search_csv),
+    "csv.gz": (".csv.gz", GZIP_MIME, partial(copy_search_csv, compress=True)),
+    "parquet": (".parquet", PARQUET_MIME, write_search_parquet),
+}
+
+# Finished file names: job id and extension, nothing a request could use to leave the directory
+_FILE_NAME = re.compile(r"[0-9a-f]{32}\.(xlsx|csv|csv\.gz|parquet)")
+# Files still being written (ExportJob.part_path)
+_PART_NAME = re.compile(r"\.[0-9a-f]{32}\.(xlsx|csv|csv\.gz|parquet)\.part")
+
+
+def set_export_timeout(conn) -> None:
+    """Applies EXPORT_STATEMENT_TIMEOUT to the rest of the connection's transaction (undone on release)."""
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL statement_timeout = %s", (int(EXPORT_STATEMENT_TIMEOUT * 1000),))
+
+
+class ExportQueueFull(Exception):
+    """Raised when EXPORT_MAX_QUEUED exports are already waiting."""
+
+
+class ExportJob:
+    """One export file being written (or written) to the spool directory."""
+
+    def __init__(self, key, fmt: str, search_query: str, years: int, spool: Path, total: int | None):
+        self.key = key
+        self.id = uuid.uuid4().hex
+        self.format = fmt
+        self.search_query = search_query
+        self.years = years
+        extension, self.mime, _ = EXPORT_FORMATS[fmt]
+        self.file = f"{self.id}{extension}"
+        self.file_name = f"expera_report_{date.today()}{extension}"
+        self.path = spool / self.file
+        self.part_path = spool / f".{self.file}.part"
+        self.total = total
+        self.rows = 0
+        self.size = 0
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    @property
+    def status(self) -> str:
+        """"queued", "running", "done", "failed" or "expired" (file cleaned up)."""
+        if self.finished_at is None:
+            return "queued" if self.started_at is None else "running"
+        if self.error is not None:
+            return "failed"
+        return "done" if self.path.exists() else "expired"
+
+    @property
+    def progress(self) -> float | None:
+        """Fraction of the rows written, when the total is known."""
+        if self.finished_at is not None and self.error is None:
+            return 1.0
+        if not self.total:
+            return None
+        return min(self.rows / self.total, 1.0)
+
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    def advance(self, rows: int) -> None:
+        self.rows += rows
+
+    def touch(self) -> None:
+        """Postpones the cleanup of the file (its access time is the last use)."""
+        try:
+            os.utime(self.path, (time.time(), self.path.stat().st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def read(self) -> bytes:
+        """The finished file, for the app's download button."""
+        self.touch()
+        return self.path.read_bytes()
+
+
+class ExportQueue:
+    """Process-wide registry of export jobs over a bounded worker pool."""
+
+    def __init__(self, pool: ConnectionPool | ReplicaRouter, spool_dir: str, max_concurrent: int,
+                 max_queued: int, retention: float, reuse: float):
+        self.pool = pool
+        self.spool = Path(spool_dir)
+        self.spool.mkdir(parents=True, exist_ok=True)
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retention = retention
+        self.reuse = reuse
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="expera-export")
+        self._lock = threading.Lock()
+        self._jobs = {}  # key -> latest ExportJob
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            "submitted": 0,
+            "shared": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "cleaned": 0,
+        }
+
+    def start(self) -> None:
+        """Starts the janitor thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="expera-export-janitor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def submit(self, search_query: str, years: int, fmt: str, total: int | None = None) -> ExportJob:
+        """
+        The job exporting ``search_query`` × ``years`` as ``fmt``: an identical
+        one still usable, or a new one queued. ``total`` is the expected number
+        of rows, for the progress. Raises ExportQueueFull when the queue is full.
+        """
+        search_query = normalize_query(search_query)
+        key = (fmt, search_query, years, active_sales_source())
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and self._reusable(job):
+                self._stats["shared"] += 1
+                job.touch()
+                return job
+            queued = sum(1 for j in self._jobs.values() if j.status == "queued")
+            if queued >= self.max_queued:
+                self._stats["rejected"] += 1
+                raise ExportQueueFull("Hay demasiadas exportaciones en cola, inténtalo en unos minutos.")
+            job = ExportJob(key, fmt, search_query, years, self.spool, total)
+            self._jobs[key] = job
+            self._stats["submitted"] += 1
+            job.future = self._executor.submit(self._work, job)
+        return job
+
+    def cleanup(self) -> None:
+        """
+        Deletes export files unused for ``retention`` seconds and forgets
+        their jobs; anything else in the directory is left alone.
+        """
+        now = time.time()
+        with self._lock:
+            writing = {job.part_path.name for job in self._jobs.values() if not job.done()}
+        cleaned = 0
+        for entry in os.scandir(self.spool):
+            if entry.name in writing or not (_FILE_NAME.fullmatch(entry.name) or _PART_NAME.fullmatch(entry.name)):
+                continue
+            try:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat()
+                if now - max(st.st_mtime, st.st_atime) > self.retention:
+                    os.unlink(entry.path)
+                    cleaned += 1
+            except FileNotFoundError:
+                # Removed by another process meanwhile
+                pass
+        with self._lock:
+            for key, job in list(self._jobs.items()):
+                if job.done() and not job.path.exists():
+                    del self._jobs[key]
+            self._stats["cleaned"] += cleaned
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            statuses = [job.status for job in self._jobs.values()]
+        s["running"] = statuses.count("running")
+        s["queued"] = statuses.count("queued")
+        s["max_concurrent"] = self.max_concurrent
+        files = size = 0
+        for entry in os.scandir(self.spool):
+            if _FILE_NAME.fullmatch(entry.name):
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    size += entry.stat().st_size
+                    files += 1
+                except FileNotFoundError:
+                    pass
+        s["files"] = files
+        s["bytes"] = size
+        return s
+
+    def _reusable(self, job: ExportJob) -> bool:
+        if not job.done():
+            return True
+        # Finished files are as fresh as the cached results the user is looking at
+        return job.status == "done" and time.monotonic() - job.finished_at < self.reuse
+
+    def _work(self, job: ExportJob) -> None:
+        job.started_at = time.monotonic()
+        _, _, write = EXPORT_FORMATS[job.format]
+        try:
+            with profiling(f"export:{job.format}", search=job.search_query):
+                with stage(f"export:{job.format}") as s:
+                    with self.pool.connection() as conn, open(job.part_path, "wb") as target:
+                        set_export_timeout(conn)
+                        write(conn, job.search_query, job.years, target, progress=job.advance)
+                    os.replace(job.part_path, job.path)
+                    job.size = s["bytes"] = job.path.stat().st_size
+                    s["rows"] = job.rows
+        except Exception as e:
+            job.error = e
+            try:
+                job.part_path.unlink()
+            except FileNotFoundError:
+                pass
+            with self._lock:
+                self._stats["failed"] += 1
+        else:
+            with self._lock:
+                self._stats["completed"] += 1
+        finally:
+            job.finished_at = time.monotonic()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.cleanup()
+            except Exception:
+                # e.g. spool directory briefly unavailable: try again next pass
+                pass
+            self._stop.wait(EXPORT_CLEANUP_INTERVAL)
+
+
+def find_export(file: str) -> Path | None:
+    """
+    Path of the finished export ``file`` (as in ExportJob.file) in the spool
+    directory, or None if the name is not one or the file is gone. Finding it
+    counts as a use, postponing its cleanup.
+    """
+    if not _FILE_NAME.fullmatch(file):
+        return None
+    path = Path(EXPORT_SPOOL_DIR) / file
+    try:
+        os.utime(path, (time.time(), path.stat().st_mtime))
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def download_url(job: ExportJob) -> str | None:
+    """API URL serving the job's file, when EXPORT_DOWNLOAD_URL is configured."""
+    if not EXPORT_DOWNLOAD_URL:
+        return None
+    return f"{EXPORT_DOWNLOAD_URL}/download/{job.file}"
+
+
+def create_export_queue(pool: ConnectionPool | ReplicaRouter) -> ExportQueue:
+    return ExportQueue(
+        pool, EXPORT_SPOOL_DIR, EXPORT_MAX_CONCURRENT, EXPORT_MAX_QUEUED, EXPORT_RETENTION, RESULT_CACHE_TTL,
+    )
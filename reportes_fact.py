@@ -0,0 +1,143 @@
+"""
+Incremental refresh of the denormalized sales fact table (bi.ventas_fact)
+and, when sql/003_sales_month_rollup.sql has been applied, of its monthly
+rollup (bi.ventas_mes).
+
+The table is created by sql/002_sales_fact.sql. Each refresh re-reads a
+trailing window behind the high-water mark (the newest ``creado`` already
+loaded) so that orders annulled or invoiced after they were first copied are
+picked up too. Changes older than the window need a full rebuild, e.g.
+nightly. The rollup months touched by the window are re-aggregated in the
+same transaction, so both tables always agree. Meant to be run from cron:
+
+    python reportes_fact.py            # incremental, every few minutes
+    python reportes_fact.py --full     # full rebuild
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+from reportes_db import connect, get_env
+from reportes_queries import SEARCH_FROM
+
+# Days re-read behind the high-water mark on every incremental refresh
+FACT_LOOKBACK_DAYS = int(get_env("FACT_LOOKBACK_DAYS", "7"))
+
+# pg_advisory_xact_lock key so overlapping cron runs queue instead of racing
+FACT_LOCK_KEY = 7_240_001
+
+FACT_COLUMNS = (
+    "det_id", "cab_id", "creado", "producto_id", "producto", "cliente_id", "cliente",
+    "almacen_id", "almacen", "cantidad", "precio_unitario", "importe", "numero", "enlace_pdf",
+)
+
+# Same joins and filters as the live search; %(min_date)s is the window start.
+FACT_INSERT_SQL = f"""
+    INSERT INTO bi.ventas_fact ({", ".join(FACT_COLUMNS)})
+    SELECT
+      det.id, cab.id, cab.creado, prod.id, prod.nombre, cli.id, cli.nombre,
+      alm.id, alm.nombre, det.cantidad, det.precio_unitario_venta,
+      (det.cantidad * det.precio_unitario_venta), cab.numero, vc.enlace_pdf
+    {SEARCH_FROM}
+"""
+
+# Re-aggregates every month from %(month_start)s on
+ROLLUP_INSERT_SQL = """
+    INSERT INTO bi.ventas_mes
+    SELECT
+      date_trunc('month', creado)::date, producto_id, producto, cliente_id, cliente,
+      almacen_id, almacen, count(*), sum(cantidad), sum(importe)
+    FROM bi.ventas_fact
+    WHERE creado >= %(month_start)s
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+"""
+
+
+def refresh_sales_fact(conn, full: bool = False, lookback_days: int = FACT_LOOKBACK_DAYS) -> dict:
+    """
+    Brings bi.ventas_fact (and bi.ventas_mes, if it exists) up to date in a
+    single transaction and records the run in bi.ventas_fact_refresh. Readers
+    keep seeing the previous contents until it commits.
+    """
+    started = time.monotonic()
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (FACT_LOCK_KEY,))
+            cur.execute("SELECT max(creado) FROM bi.ventas_fact")
+            high_water = cur.fetchone()[0]
+
+            full = full or high_water is None
+            if full:
+                window_start = None
+                cur.execute("DELETE FROM bi.ventas_fact")
+            else:
+                window_start = high_water - timedelta(days=lookback_days)
+                cur.execute("DELETE FROM bi.ventas_fact WHERE creado >= %s", (window_start,))
+            deleted = cur.rowcount
+
+            cur.execute(FACT_INSERT_SQL, {"min_date": window_start or date.min})
+            inserted = cur.rowcount
+
+            rollup_rows = None
+            cur.execute("SELECT to_regclass('bi.ventas_mes') IS NOT NULL")
+            if cur.fetchone()[0]:
+                if full:
+                    month_start = date.min
+                    cur.execute("DELETE FROM bi.ventas_mes")
+                else:
+                    month_start = window_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                    cur.execute("DELETE FROM bi.ventas_mes WHERE mes >= %s", (month_start,))
+                cur.execute(ROLLUP_INSERT_SQL, {"month_start": month_start})
+                rollup_rows = cur.rowcount
+
+            cur.execute(
+                """
+                INSERT INTO bi.ventas_fact_refresh
+                  (started_at, finished_at, full_refresh, window_start, rows_deleted, rows_inserted)
+                VALUES (now(), clock_timestamp(), %s, %s, %s, %s)
+                """,
+                (full, window_start, deleted, inserted),
+            )
+            if full:
+                cur.execute("ANALYZE bi.ventas_fact")
+                if rollup_rows is not None:
+                    cur.execute("ANALYZE bi.ventas_mes")
+
+    return {
+        "full": full,
+        "window_start": window_start,
+        "rows_deleted": deleted,
+        "rows_inserted": inserted,
+        "rollup_rows": rollup_rows,
+        "seconds": time.monotonic() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresca la tabla de hechos bi.ventas_fact.")
+    parser.add_argument("--full", action="store_true", help="reconstruye la tabla completa")
+    parser.add_argument(
+        "--lookback-days", type=int, default=FACT_LOOKBACK_DAYS,
+        help=f"días a releer detrás de la marca de agua (por defecto {FACT_LOOKBACK_DAYS})",
+    )
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        result = refresh_sales_fact(conn, full=args.full, lookback_days=args.lookback_days)
+    finally:
+        conn.close()
+
+    window = "completo" if result["full"] else f"desde {result['window_start']}"
+    rollup = ""
+    if result["rollup_rows"] is not None:
+        rollup = f", {result['rollup_rows']:,} filas de bi.ventas_mes recalculadas"
+    print(
+        f"bi.ventas_fact refrescada ({window}): "
+        f"{result['rows_deleted']:,} borradas, {result['rows_inserted']:,} insertadas{rollup} "
+        f"en {result['seconds']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
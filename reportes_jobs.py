@@ -0,0 +1,168 @@
+"""
+Background query jobs.
+
+Heavy queries (the full detail result, the Insights aggregates) run on a
+bounded worker pool instead of the Streamlit script thread: the script submits
+a job, renders whatever is already available and polls for the rest, so a
+30-second search no longer keeps the session's script (and a server thread)
+busy. Jobs are keyed like cache entries, so sessions asking for the same
+result share one job, and a job every session has moved away from is
+cancelled on the server.
+
+The worker pool has QUERY_MAX_CONCURRENT threads, which is the global limit on
+heavy statements running at once: a burst of searches waits in the job queue
+instead of piling onto the database.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.extensions
+
+from reportes_db import PG_POOL_MAX, ConnectionPool, ReplicaRouter, get_env
+from reportes_profiling import add_stage, profiling
+
+# Heavy queries running at once across every session; leaves connections for the light ones
+QUERY_MAX_CONCURRENT = int(get_env("QUERY_MAX_CONCURRENT", str(max(1, PG_POOL_MAX // 2))))
+
+
+class QueryJob:
+    """One background query and the sessions (``owners``) waiting for it."""
+
+    def __init__(self, key, owner: str):
+        self.key = key
+        self.owners = {owner}
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.future = None
+        self._lock = threading.Lock()
+        self._conn = None
+        self._cancelled = False
+
+    @property
+    def status(self) -> str:
+        """"queued", "running" or "done"."""
+        if self.future.done():
+            return "done"
+        return "queued" if self.started_at is None else "running"
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self):
+        """The fetched value; raises the query's exception if it failed."""
+        return self.future.result()
+
+    def cancel(self) -> None:
+        """Drops the job if still queued, or cancels its statement on the server."""
+        with self._lock:
+            self._cancelled = True
+            if self._conn is not None:
+                self._conn.cancel()
+        self.future.cancel()
+
+    def run(self, pool: ConnectionPool | ReplicaRouter, fetch, args: tuple):
+        self.started_at = time.monotonic()
+        add_stage("queue", self.started_at - self.submitted_at)
+        start = time.perf_counter()
+        with pool.connection() as conn:
+            add_stage("checkout", time.perf_counter() - start)
+            with self._lock:
+                if self._cancelled:
+                    raise psycopg2.extensions.QueryCanceledError("job cancelled before it started")
+                self._conn = conn
+            try:
+                return fetch(conn, *args)
+            finally:
+                # Never cancel a connection that is back in the pool
+                with self._lock:
+                    self._conn = None
+
+
+class JobRunner:
+    """Process-wide registry of in-flight query jobs over a bounded worker pool."""
+
+    def __init__(self, pool: ConnectionPool | ReplicaRouter, max_concurrent: int):
+        self.pool = pool
+        self.max_concurrent = max_concurrent
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="expera-job")
+        self._lock = threading.Lock()
+        self._jobs = {}  # key -> in-flight QueryJob
+        self._stats = {
+            "submitted": 0,
+            "shared": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+        }
+
+    def submit(self, key, owner: str, name: str, fetch, *args, on_result=None,
+               profile: dict | None = None) -> QueryJob:
+        """
+        Joins ``owner`` to the in-flight job for ``key``, or queues a new one
+        running ``fetch(conn, *args)``. ``on_result`` is called with the value
+        on the worker (e.g. to cache it). With ``profile`` the job is profiled
+        as a run of its own ("job:<name>") with those fields.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None:
+                job.owners.add(owner)
+                self._stats["shared"] += 1
+                return job
+            job = QueryJob(key, owner)
+            self._jobs[key] = job
+            self._stats["submitted"] += 1
+            job.future = self._executor.submit(self._work, job, name, fetch, args, on_result, profile)
+        return job
+
+    def release(self, job: QueryJob, owner: str) -> None:
+        """Removes ``owner`` from the job; a job nobody waits for any more is cancelled."""
+        with self._lock:
+            job.owners.discard(owner)
+            if job.owners or job.done():
+                return
+            if self._jobs.get(job.key) is job:
+                del self._jobs[job.key]
+            self._stats["cancelled"] += 1
+        job.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            statuses = [job.status for job in self._jobs.values()]
+        s["running"] = statuses.count("running")
+        s["queued"] = statuses.count("queued")
+        s["max_concurrent"] = self.max_concurrent
+        return s
+
+    def _work(self, job: QueryJob, name: str, fetch, args: tuple, on_result, profile: dict | None):
+        try:
+            if profile is None:
+                value = job.run(self.pool, fetch, args)
+            else:
+                with profiling(f"job:{name}", **profile):
+                    value = job.run(self.pool, fetch, args)
+            if on_result is not None:
+                on_result(value)
+        except BaseException:
+            with self._lock:
+                if not job.cancelled:
+                    self._stats["failed"] += 1
+            raise
+        else:
+            with self._lock:
+                self._stats["completed"] += 1
+            return value
+        finally:
+            with self._lock:
+                if self._jobs.get(job.key) is job:
+                    del self._jobs[job.key]
+
+
+def create_job_runner(pool: ConnectionPool | ReplicaRouter) -> JobRunner:
+    return JobRunner(pool, QUERY_MAX_CONCURRENT)
@@ -0,0 +1,138 @@
+"""
+Pre-warming of hot searches.
+
+Mornings bring everyone to the same few brands and clients just as their
+cached results expire. A Prewarmer thread inside the app process computes the
+KPI summary, the detail result and the Insights aggregates of a configured
+list of terms and year windows and stores them in the shared result cache,
+repeating every PREWARM_INTERVAL seconds (by default before RESULT_CACHE_TTL
+runs out) so those entries never go cold and pick up new sales.
+
+Queries go through the job runner like any background query: they count
+against QUERY_MAX_CONCURRENT, and a user searching a term that is being
+warmed joins that job instead of running it again. Entries stored by the
+prewarmer report the lookups they serve as the cache's prewarm_hits.
+"""
+import threading
+import time
+from datetime import datetime
+
+from reportes_cache import RESULT_CACHE_TTL, ResultCache, cache_key, normalize_query
+from reportes_db import get_env
+from reportes_jobs import JobRunner
+from reportes_queries import (
+    INSIGHT_FETCHERS,
+    active_insights_source,
+    fetch_insights,
+    fetch_search,
+    fetch_search_summary,
+)
+from reportes_shared_cache import SharedCache
+
+# Terms kept warm, comma-separated (empty = no pre-warming)
+PREWARM_QUERIES = [normalize_query(q) for q in get_env("PREWARM_QUERIES", "").split(",") if q.strip()]
+# Year windows warmed for each term
+PREWARM_YEARS = [int(y) for y in get_env("PREWARM_YEARS", "5").split(",") if y.strip()]
+# Seconds between rounds; by default 80% of the cache TTL, so entries are refreshed before they expire
+PREWARM_INTERVAL = float(get_env("PREWARM_INTERVAL", str(RESULT_CACHE_TTL * 0.8)))
+
+# Job owner used by the prewarmer (sessions use their session id)
+PREWARM_OWNER = "prewarm"
+
+
+def prewarm_targets(search_query: str) -> list[tuple]:
+    """(cache kind, fetch) pairs the app looks up for one search, charts following the Insights source."""
+    targets = [("summary", fetch_search_summary), ("search", fetch_search)]
+    if active_insights_source(search_query) == "rollup":
+        targets.append(("insights", fetch_insights))
+    else:
+        targets.extend(INSIGHT_FETCHERS.items())
+    return targets
+
+
+class Prewarmer:
+    """Background thread that keeps the results of ``queries`` × ``years`` in the cache."""
+
+    def __init__(self, runner: JobRunner, cache: ResultCache, queries: list[str], years: list[int],
+                 interval: float, shared: SharedCache | None = None):
+        self.runner = runner
+        self.cache = cache
+        self.shared = shared
+        self.queries = queries
+        self.years = years
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "rounds": 0,
+            "queries": 0,
+            "errors": 0,
+            "last_round": None,
+            "last_duration": 0.0,
+        }
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="expera-prewarm", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def warm(self) -> None:
+        """
+        Runs one round. Each term and window is warmed as one batch of jobs
+        (in parallel) and the next batch waits for it, so the prewarmer never
+        queues more than one search's worth of jobs ahead of the users.
+        """
+        start = time.perf_counter()
+        queries = errors = 0
+        for search_query in self.queries:
+            for years in self.years:
+                if self._stop.is_set():
+                    return
+                jobs = []
+                for kind, fetch in prewarm_targets(search_query):
+                    if self.shared is not None:
+                        # Another replica may have warmed it already
+                        fetch = self.shared.wrap(kind, fetch)
+                    key = cache_key(kind, search_query, years)
+                    jobs.append(self.runner.submit(
+                        key, PREWARM_OWNER, kind, fetch, search_query, years,
+                        on_result=lambda value, key=key: self.cache.put(key, value, prewarmed=True),
+                    ))
+                for job in jobs:
+                    try:
+                        job.result()
+                    except Exception:
+                        errors += 1
+                queries += len(jobs)
+        with self._lock:
+            self._stats["rounds"] += 1
+            self._stats["queries"] += queries
+            self._stats["errors"] += errors
+            self._stats["last_round"] = datetime.now().isoformat(timespec="seconds")
+            self._stats["last_duration"] = time.perf_counter() - start
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["terms"] = len(self.queries)
+        s["years"] = list(self.years)
+        s["interval"] = self.interval
+        return s
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.warm()
+            except Exception:
+                # e.g. database unreachable: try again next round
+                with self._lock:
+                    self._stats["errors"] += 1
+            self._stop.wait(self.interval)
+
+
+def create_prewarmer(runner: JobRunner, cache: ResultCache, shared: SharedCache | None = None) -> Prewarmer:
+    return Prewarmer(runner, cache, PREWARM_QUERIES, PREWARM_YEARS, PREWARM_INTERVAL, shared)
@@ -0,0 +1,144 @@
+"""
+Stage timings for the reporting app.
+
+A Profile collects the stages of one script run (or one deferred export):
+pool checkout, query execution, row fetch, DataFrame build, charts, exports,
+with rows/bytes and cache flags where they apply. The data layer reports
+through the module-level stage()/add_stage() helpers, which do nothing unless
+a profile is active in the current context, so the CLIs pay nothing for them.
+Finished profiles are kept in memory for the admin panel and, if PROFILE_LOG
+is set, appended to that file as JSON lines.
+"""
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from reportes_db import get_env
+
+# JSON-lines file receiving every finished profile (empty = don't log)
+PROFILE_LOG = get_env("PROFILE_LOG", "")
+# Finished profiles kept in memory for the admin panel
+PROFILE_HISTORY = int(get_env("PROFILE_HISTORY", "50"))
+
+_current = contextvars.ContextVar("expera_profile", default=None)
+_parent = contextvars.ContextVar("expera_profile_parent", default=None)
+
+_history = deque(maxlen=PROFILE_HISTORY)
+_history_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+class Profile:
+    """Stages of one run. Stages may be added from worker threads."""
+
+    def __init__(self, name: str, explain: bool = False, **fields):
+        self.name = name
+        self.explain = explain
+        self.fields = fields
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = []
+
+    def add(self, stage: str, seconds: float, **fields) -> None:
+        record = {"stage": stage, "ms": round(seconds * 1000, 2), **fields}
+        with self._lock:
+            self.stages.append(record)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = list(self.stages)
+        return {
+            "ts": self.started_at,
+            "run": self.name,
+            **self.fields,
+            "total_ms": round((time.perf_counter() - self._start) * 1000, 2),
+            "stages": stages,
+        }
+
+
+def begin_profile(name: str, explain: bool = False, **fields) -> Profile:
+    """Starts profiling the current context (script thread) until end_profile()."""
+    profile = Profile(name, explain=explain, **fields)
+    _current.set(profile)
+    _parent.set(None)
+    return profile
+
+
+def end_profile(profile: Profile) -> dict:
+    """Stops profiling, records the profile and returns it as a dict."""
+    if _current.get() is profile:
+        _current.set(None)
+    record = profile.to_dict()
+    with _history_lock:
+        _history.append(record)
+    if PROFILE_LOG:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with _log_lock, open(PROFILE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    return record
+
+
+@contextmanager
+def profiling(name: str, **fields):
+    """Profiles the enclosed block as a run of its own, e.g. a deferred export."""
+    token = _current.set(Profile(name, **fields))
+    try:
+        yield _current.get()
+    finally:
+        profile = _current.get()
+        _current.reset(token)
+        end_profile(profile)
+
+
+def current_profile() -> Profile | None:
+    return _current.get()
+
+
+def explain_enabled() -> bool:
+    profile = _current.get()
+    return profile is not None and profile.explain
+
+
+@contextmanager
+def stage(name: str, **fields):
+    """
+    Times the enclosed block as a stage of the active profile. Yields a dict
+    the block can fill with extra fields (rows, bytes, cache...). Stages
+    opened inside it are recorded with this one as their parent.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield {}
+        return
+    extra = dict(fields)
+    parent = _parent.get()
+    token = _parent.set(name)
+    start = time.perf_counter()
+    try:
+        yield extra
+    finally:
+        _parent.reset(token)
+        if parent is not None:
+            extra["parent"] = parent
+        profile.add(name, time.perf_counter() - start, **extra)
+
+
+def add_stage(name: str, seconds: float, **fields) -> None:
+    """Records an already measured stage in the active profile."""
+    profile = _current.get()
+    if profile is not None:
+        parent = _parent.get()
+        if parent is not None:
+            fields["parent"] = parent
+        profile.add(name, seconds, **fields)
+
+
+def recent_profiles() -> list[dict]:
+    """Finished profiles of every session, oldest first."""
+    with _history_lock:
+        return list(_history)
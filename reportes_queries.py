@@ -0,0 +1,585 @@
+"""
+SQL for the sales audit: detail search, keyset-paginated pages, KPI totals
+and the aggregates behind the Insights charts.
+
+Every function takes an open psycopg2 connection so callers decide where it
+comes from (normally the shared pool in reportes_db). Queries read either the
+live ERP tables or the denormalized bi.ventas_fact table (see reportes_fact).
+"""
+from datetime import date, timedelta
+
+import pandas as pd
+import pyarrow as pa
+
+from reportes_db import get_env
+from reportes_profiling import current_profile, explain_enabled, stage
+from reportes_search import parse_search
+
+# Search predicate backend: "ilike", "trigram" or "auto" (trigram when its indexes exist)
+SEARCH_BACKEND = get_env("SEARCH_BACKEND", "auto")
+
+# Indexes created by sql/001_search_trgm.sql
+TRGM_INDEXES = ("extcs.productos_nombre_trgm_idx", "tcros.personas_nombre_trgm_idx")
+
+# Trigram indexes cannot narrow patterns shorter than three characters
+TRGM_MIN_LENGTH = 3
+
+# Where sales are read from: "live", "fact" or "auto" (fact while it is fresh)
+SALES_SOURCE = get_env("SALES_SOURCE", "auto")
+FACT_MAX_AGE_MINUTES = int(get_env("FACT_MAX_AGE_MINUTES", "120"))
+
+# Insights from the bi.ventas_mes rollup while reading the fact table: "auto" or "off"
+INSIGHTS_ROLLUP = get_env("INSIGHTS_ROLLUP", "auto")
+
+# Detail columns, formatted with the column expressions of a sales source
+SEARCH_COLUMNS = """
+      {creado}::date AS "Fecha",
+      {producto}     AS "Producto",
+      {cliente}      AS "Cliente",
+      {cantidad}     AS "Cant.",
+      {precio}       AS "Precio Unit.",
+      {importe}      AS "Importe Total",
+      {numero}       AS "Nº Documento",
+      {almacen}      AS "Almacén",
+      {enlace_pdf}   AS "Enlace PDF"
+"""
+
+SEARCH_FROM = """
+    FROM cmrlz.notas_pedido_cab cab
+    JOIN cmrlz.notas_pedido_det det ON det.nota_pedido_id = cab.id
+    JOIN extcs.productos prod       ON prod.id = det.producto_id
+    LEFT JOIN tcros.direcciones dir ON dir.id = cab.direccion_cliente_id
+    LEFT JOIN tcros.personas cli    ON cli.id = dir.persona_id
+    LEFT JOIN extcs.almacenes alm   ON alm.id = cab.almacen_id
+    LEFT JOIN cmrlz.ventas_cab vc   ON vc.id = cab.venta_id
+    WHERE
+      cab.anulada IS FALSE
+      AND cab.venta_id IS NOT NULL
+      AND prod.servicio = FALSE
+      AND cab.creado >= %(min_date)s
+"""
+
+# Both predicates match exactly the same rows. The trigram one resolves the
+# product/client name matches through their GIN indexes once per query instead
+# of evaluating ILIKE on every joined row.
+SEARCH_PREDICATES = {
+    "ilike": " AND (prod.nombre ILIKE %(q)s OR cli.nombre ILIKE %(q)s OR cab.numero::text ILIKE %(q)s)",
+    "trigram": """
+      AND (prod.id IN (SELECT p.id FROM extcs.productos p WHERE p.nombre ILIKE %(q)s)
+           OR cli.id IN (SELECT c.id FROM tcros.personas c WHERE c.nombre ILIKE %(q)s)
+           OR cab.numero::text ILIKE %(q)s)
+""",
+}
+
+FACT_FROM = """
+    FROM bi.ventas_fact f
+    WHERE f.creado >= %(min_date)s
+"""
+
+# The fact table holds the names itself, so one predicate serves both backends
+# (sql/002_sales_fact.sql indexes producto/cliente with pg_trgm).
+FACT_PREDICATE = " AND (f.producto ILIKE %(q)s OR f.cliente ILIKE %(q)s OR f.numero::text ILIKE %(q)s)"
+
+# Field filters of the search syntax (reportes_search) per backend, formatted
+# with the parameter placeholder. Warehouses are a short table, so their ids
+# are resolved once instead of matching the name on every row.
+LIVE_FIELD_PREDICATES = {
+    "producto": {
+        "ilike": "prod.nombre ILIKE {p}",
+        "trigram": "prod.id IN (SELECT p.id FROM extcs.productos p WHERE p.nombre ILIKE {p})",
+    },
+    "cliente": {
+        "ilike": "cli.nombre ILIKE {p}",
+        "trigram": "cli.id IN (SELECT c.id FROM tcros.personas c WHERE c.nombre ILIKE {p})",
+    },
+    "almacen": {
+        "ilike": "cab.almacen_id IN (SELECT a.id FROM extcs.almacenes a WHERE a.nombre ILIKE {p})",
+        "trigram": "cab.almacen_id IN (SELECT a.id FROM extcs.almacenes a WHERE a.nombre ILIKE {p})",
+    },
+}
+
+FACT_FIELD_PREDICATES = {
+    field: {"ilike": f"f.{field} ILIKE {{p}}", "trigram": f"f.{field} ILIKE {{p}}"}
+    for field in ("producto", "cliente", "almacen")
+}
+
+SALES_SOURCES = {
+    "live": {
+        "from": SEARCH_FROM,
+        "predicates": SEARCH_PREDICATES,
+        "fields": LIVE_FIELD_PREDICATES,
+        "creado": "cab.creado",
+        "cab_id": "cab.id",
+        "det_id": "det.id",
+        "producto": "prod.nombre",
+        "cliente": "cli.nombre",
+        "almacen": "alm.nombre",
+        "cantidad": "det.cantidad",
+        "precio": "det.precio_unitario_venta",
+        "importe": "(det.cantidad * det.precio_unitario_venta)",
+        "numero": "cab.numero",
+        "enlace_pdf": "vc.enlace_pdf",
+    },
+    "fact": {
+        "from": FACT_FROM,
+        "predicates": {"ilike": FACT_PREDICATE, "trigram": FACT_PREDICATE},
+        "fields": FACT_FIELD_PREDICATES,
+        "creado": "f.creado",
+        "cab_id": "f.cab_id",
+        "det_id": "f.det_id",
+        "producto": "f.producto",
+        "cliente": "f.cliente",
+        "almacen": "f.almacen",
+        "cantidad": "f.cantidad",
+        "precio": "f.precio_unitario",
+        "importe": "f.importe",
+        "numero": "f.numero",
+        "enlace_pdf": "f.enlace_pdf",
+    },
+}
+
+# Insights rows for a search built from three disjoint parts: whole months
+# from the rollup, the partial first month of the window from the fact table,
+# and fact rows matched only by their document number (the rollup has no
+# numero). Every fact row in the window lands in exactly one part.
+ROLLUP_PARTS = """
+    WITH parts AS (
+      SELECT m.mes, m.producto, m.cliente, m.importe
+      FROM bi.ventas_mes m
+      WHERE m.mes >= %(cube_from)s{cube_predicate}
+      UNION ALL
+      SELECT date_trunc('month', f.creado)::date, f.producto, f.cliente, f.importe
+      FROM bi.ventas_fact f
+      WHERE f.creado >= %(min_date)s AND f.creado < %(cube_from)s{fact_predicate}{numero_part}
+    )
+"""
+
+ROLLUP_NUMERO_PART = """
+      UNION ALL
+      SELECT date_trunc('month', f.creado)::date, f.producto, f.cliente, f.importe
+      FROM bi.ventas_fact f
+      WHERE f.creado >= %(cube_from)s
+        AND f.numero::text ILIKE %(q)s
+        AND NOT coalesce(f.producto ILIKE %(q)s OR f.cliente ILIKE %(q)s, false)"""
+
+# Backend and source in use, set by the detect_* functions once the database is reachable
+_active_backend = "ilike"
+_active_source = "live"
+_rollup_ready = False
+
+# Hidden keyset columns appended to paged queries; stripped before returning.
+_KEYSET_COLUMNS = ["_k_creado", "_k_cab", "_k_det"]
+
+# Detail result dtypes: names repeated on every row as categories, mostly
+# unique text as Arrow strings, Fecha as a 4-byte Arrow date and amounts as
+# plain float64, instead of one Python object per cell.
+COMPACT_DTYPES = {
+    "Fecha": pd.ArrowDtype(pa.date32()),
+    "Producto": "category",
+    "Cliente": "category",
+    "Almacén": "category",
+    "Nº Documento": "string[pyarrow]",
+    "Enlace PDF": "string[pyarrow]",
+    "Cant.": "float64",
+    "Precio Unit.": "float64",
+    "Importe Total": "float64",
+}
+
+
+def execute(cur, sql: str, params: dict) -> None:
+    """
+    cur.execute() timed as a profiler stage, preceded by an
+    EXPLAIN (ANALYZE, BUFFERS) capture when the active profile asks for it.
+    """
+    if explain_enabled():
+        with stage("explain") as s:
+            cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+            s["plan"] = "\n".join(row[0] for row in cur.fetchall())
+    with stage("execute"):
+        cur.execute(sql, params)
+
+
+def read_frame(conn, sql: str, params: dict) -> pd.DataFrame:
+    """pd.read_sql_query() equivalent that reports execute/fetch/DataFrame stages."""
+    with conn.cursor() as cur:
+        execute(cur, sql, params)
+        with stage("fetch") as s:
+            rows = cur.fetchall()
+            s["rows"] = len(rows)
+        columns = [col.name for col in cur.description]
+    with stage("dataframe") as s:
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        if current_profile() is not None:
+            s["bytes"] = int(df.memory_usage(deep=True).sum())
+    return df
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the detail columns present in ``df`` to COMPACT_DTYPES."""
+    with stage("compact") as s:
+        df = df.astype({col: dtype for col, dtype in COMPACT_DTYPES.items() if col in df.columns})
+        if current_profile() is not None:
+            s["bytes"] = int(df.memory_usage(deep=True).sum())
+    return df
+
+
+def detect_search_backend(conn) -> str:
+    """
+    Resolves SEARCH_BACKEND against the database and activates it.
+
+    "auto" picks "trigram" only when pg_trgm is installed and every index in
+    TRGM_INDEXES exists and is valid; otherwise the plain ILIKE path is used.
+    """
+    global _active_backend
+    backend = SEARCH_BACKEND if SEARCH_BACKEND in SEARCH_PREDICATES else "auto"
+    if backend == "auto":
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            has_extension = cur.fetchone() is not None
+            cur.execute(
+                """
+                SELECT count(*)
+                FROM pg_index i
+                JOIN pg_class c     ON c.oid = i.indexrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE i.indisvalid AND n.nspname || '.' || c.relname = ANY(%s)
+                """,
+                (list(TRGM_INDEXES),),
+            )
+            valid_indexes = cur.fetchone()[0]
+        backend = "trigram" if has_extension and valid_indexes == len(TRGM_INDEXES) else "ilike"
+    _active_backend = backend
+    return backend
+
+
+def active_search_backend() -> str:
+    return _active_backend
+
+
+def detect_sales_source(conn) -> str:
+    """
+    Resolves SALES_SOURCE against the database and activates it.
+
+    "auto" reads bi.ventas_fact only when it exists and its last refresh
+    finished less than FACT_MAX_AGE_MINUTES ago, so a stalled refresh job falls
+    back to the live tables instead of serving stale numbers.
+    """
+    global _active_source
+    source = SALES_SOURCE if SALES_SOURCE in SALES_SOURCES else "auto"
+    if source == "auto":
+        source = "live"
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('bi.ventas_fact_refresh') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute(
+                    """
+                    SELECT max(finished_at) > now() - make_interval(mins => %s)
+                    FROM bi.ventas_fact_refresh
+                    """,
+                    (FACT_MAX_AGE_MINUTES,),
+                )
+                if cur.fetchone()[0]:
+                    source = "fact"
+    _active_source = source
+    return source
+
+
+def active_sales_source() -> str:
+    return _active_source
+
+
+def detect_insights_rollup(conn) -> bool:
+    """Checks whether the bi.ventas_mes rollup (sql/003_sales_month_rollup.sql) can be used."""
+    global _rollup_ready
+    ready = False
+    if INSIGHTS_ROLLUP == "auto":
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('bi.ventas_mes') IS NOT NULL")
+            ready = cur.fetchone()[0]
+    _rollup_ready = ready
+    return ready
+
+
+def fetch_data_version(conn):
+    """Newest sale timestamp of the active source; changes whenever a sale is added."""
+    table = "bi.ventas_fact" if _active_source == "fact" else "cmrlz.notas_pedido_cab"
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT max(creado) FROM {table}")
+        return cur.fetchone()[0]
+
+
+def active_insights_source(search_query: str = "") -> str:
+    """
+    "rollup" or "detail". The rollup is maintained together with the fact
+    table, so it is only used while searches read the fact table too, and
+    only answers an empty search or a single free term: field filters and
+    document numbers go to the detail aggregates.
+    """
+    if not (_rollup_ready and _active_source == "fact"):
+        return "detail"
+    search = parse_search(search_query)
+    return "rollup" if search.is_empty or search.is_plain else "detail"
+
+
+def build_search_filter(search_query: str, years: int, source: str | None = None) -> tuple[str, dict, dict]:
+    """
+    Returns the FROM/WHERE clause, its parameters and the column expressions
+    of the sales source (the active one unless ``source`` is given).
+
+    ``search_query`` follows the search syntax of reportes_search: every free
+    term and field filter adds its own predicate, all of them required.
+    """
+    cols = SALES_SOURCES[source or _active_source]
+    sql = cols["from"]
+    params = {
+        "min_date": date.today() - timedelta(days=365 * years)
+    }
+
+    search = parse_search(search_query)
+    # desde/hasta narrow the years window, they never widen it
+    if search.since is not None and search.since > params["min_date"]:
+        params["min_date"] = search.since
+    if search.until is not None:
+        sql += f" AND {cols['creado']} < %(max_date)s"
+        params["max_date"] = search.until
+
+    for i, term in enumerate(search.terms):
+        # The first term keeps the %(q)s parameter of a single-term search
+        name = "q" if i == 0 else f"q{i}"
+        backend = _active_backend if len(term) >= TRGM_MIN_LENGTH else "ilike"
+        sql += cols["predicates"][backend].replace("%(q)s", f"%({name})s")
+        params[name] = f"%{term}%"
+
+    for i, (field, value) in enumerate(search.fields):
+        name = f"{field}{i}"
+        backend = _active_backend if len(value) >= TRGM_MIN_LENGTH else "ilike"
+        sql += " AND " + cols["fields"][field][backend].format(p=f"%({name})s")
+        params[name] = f"%{value}%"
+
+    # Exact numbers and prefixes compare the bare column, so its btree index applies
+    for i, (value, prefix) in enumerate(search.docs):
+        name = f"doc{i}"
+        if prefix:
+            sql += f" AND {cols['numero']} LIKE %({name})s"
+            params[name] = like_escape(value) + "%"
+        else:
+            sql += f" AND {cols['numero']} = %({name})s"
+            params[name] = value
+
+    return sql, params, cols
+
+
+def like_escape(value: str) -> str:
+    """``value`` with the LIKE wildcards and escape character taken literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_search_query(search_query: str, years: int) -> tuple[str, dict]:
+    """Detail query behind fetch_search() and the bulk exports, and its parameters."""
+    where_sql, params, c = build_search_filter(search_query, years)
+    sql = f"SELECT {SEARCH_COLUMNS.format(**c)} {where_sql} ORDER BY {c['creado']} DESC"
+    return sql, params
+
+
+def fetch_search(conn, search_query: str, years: int) -> pd.DataFrame:
+    """All matching detail rows, newest first."""
+    sql, params = build_search_query(search_query, years)
+    return compact_frame(read_frame(conn, sql, params))
+
+
+def fetch_search_page(conn, search_query: str, years: int, page_size: int,
+                      after: tuple | None = None) -> tuple[pd.DataFrame, tuple | None]:
+    """
+    One page of detail rows using keyset pagination on
+    (creado DESC, cab id DESC, det id DESC).
+
+    ``after`` is the cursor returned for the previous page (None for the first
+    page). Returns the page and the cursor for the next one, or None when this
+    was the last page.
+    """
+    where_sql, params, c = build_search_filter(search_query, years)
+    if after is not None:
+        where_sql += f" AND ({c['creado']}, {c['cab_id']}, {c['det_id']}) < (%(k_creado)s, %(k_cab)s, %(k_det)s)"
+        params["k_creado"], params["k_cab"], params["k_det"] = after
+    params["limit"] = page_size + 1
+
+    sql = f"""
+    SELECT {SEARCH_COLUMNS.format(**c)},
+      {c['creado']} AS "_k_creado",
+      {c['cab_id']} AS "_k_cab",
+      {c['det_id']} AS "_k_det"
+    {where_sql}
+    ORDER BY {c['creado']} DESC, {c['cab_id']} DESC, {c['det_id']} DESC
+    LIMIT %(limit)s
+    """
+    df = read_frame(conn, sql, params)
+
+    next_cursor = None
+    if len(df) > page_size:
+        df = df.iloc[:page_size]
+        last = df.iloc[-1]
+        next_cursor = (pd.Timestamp(last["_k_creado"]).to_pydatetime(), int(last["_k_cab"]), int(last["_k_det"]))
+    return compact_frame(df.drop(columns=_KEYSET_COLUMNS)), next_cursor
+
+
+def fetch_search_summary(conn, search_query: str, years: int) -> dict:
+    """KPI totals for a search, computed by Postgres instead of pandas."""
+    where_sql, params, c = build_search_filter(search_query, years)
+    sql = f"""
+    SELECT
+      COUNT(*)                             AS rows,
+      COALESCE(SUM({c['importe']}), 0)     AS total_imp,
+      COALESCE(SUM({c['cantidad']}), 0)    AS total_qty,
+      COUNT(DISTINCT {c['numero']})        AS unique_orders
+    {where_sql}
+    """
+    with conn.cursor() as cur:
+        execute(cur, sql, params)
+        rows, total_imp, total_qty, unique_orders = cur.fetchone()
+    return {
+        "rows": int(rows),
+        "total_imp": float(total_imp),
+        "total_qty": float(total_qty),
+        "unique_orders": int(unique_orders),
+    }
+
+
+def summarize_search(df: pd.DataFrame) -> dict:
+    """Same totals as fetch_search_summary() for an already fetched detail result."""
+    return {
+        "rows": len(df),
+        "total_imp": float(pd.to_numeric(df["Importe Total"]).sum()),
+        "total_qty": float(pd.to_numeric(df["Cant."]).sum()),
+        "unique_orders": int(df["Nº Documento"].nunique()),
+    }
+
+
+def fetch_top_products(conn, search_query: str, years: int, limit: int = 10) -> pd.DataFrame:
+    """Products with the highest revenue for a search."""
+    where_sql, params, c = build_search_filter(search_query, years)
+    params["limit"] = limit
+    sql = f"""
+    SELECT
+      {c['producto']}        AS "Producto",
+      SUM({c['importe']})    AS "Importe Total"
+    {where_sql}
+    GROUP BY {c['producto']}
+    ORDER BY 2 DESC NULLS LAST
+    LIMIT %(limit)s
+    """
+    return read_frame(conn, sql, params)
+
+
+def fetch_top_clients(conn, search_query: str, years: int, limit: int = 15) -> pd.DataFrame:
+    """Clients with the highest revenue for a search (rows without client are skipped)."""
+    where_sql, params, c = build_search_filter(search_query, years)
+    params["limit"] = limit
+    sql = f"""
+    SELECT
+      {c['cliente']}         AS "Cliente",
+      SUM({c['importe']})    AS "Importe Total"
+    {where_sql}
+      AND {c['cliente']} IS NOT NULL
+    GROUP BY {c['cliente']}
+    ORDER BY 2 DESC NULLS LAST
+    LIMIT %(limit)s
+    """
+    return read_frame(conn, sql, params)
+
+
+def fetch_monthly_revenue(conn, search_query: str, years: int) -> pd.DataFrame:
+    """Revenue per calendar month, with empty months filled with zero."""
+    where_sql, params, c = build_search_filter(search_query, years)
+    sql = f"""
+    SELECT
+      date_trunc('month', {c['creado']})::date AS "Fecha",
+      SUM({c['importe']})                      AS "Importe Total"
+    {where_sql}
+    GROUP BY 1
+    ORDER BY 1
+    """
+    return _monthly_series(read_frame(conn, sql, params))
+
+
+def _monthly_series(df: pd.DataFrame) -> pd.DataFrame:
+    """Monthly revenue with months without sales filled with 0, as resample().sum() did."""
+    if df.empty:
+        return df.reset_index(drop=True)
+    df = df.assign(
+        Fecha=pd.to_datetime(df["Fecha"]),
+        **{"Importe Total": df["Importe Total"].astype(float)},
+    )
+    return df.set_index("Fecha").asfreq("MS", fill_value=0.0).reset_index()
+
+
+# Insights charts and their queries; independent, so they can run on separate connections
+INSIGHT_FETCHERS = {
+    "top_products": fetch_top_products,
+    "monthly": fetch_monthly_revenue,
+    "top_clients": fetch_top_clients,
+}
+
+
+def fetch_insights(conn, search_query: str, years: int) -> dict:
+    """All chart aggregates for the Insights tab in one round of queries."""
+    if active_insights_source(search_query) == "rollup":
+        return fetch_insights_rollup(conn, search_query, years)
+    return {name: fetch(conn, search_query, years) for name, fetch in INSIGHT_FETCHERS.items()}
+
+
+def build_rollup_parts(search_query: str, years: int) -> tuple[str, dict]:
+    """ROLLUP_PARTS for a search (empty or one free term, see active_insights_source) and its parameters."""
+    min_date = date.today() - timedelta(days=365 * years)
+    # First whole month inside the window
+    cube_from = min_date if min_date.day == 1 else (min_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+    params = {"min_date": min_date, "cube_from": cube_from}
+    cube_predicate = fact_predicate = numero_part = ""
+    search = parse_search(search_query)
+    if search.terms:
+        params["q"] = f"%{search.terms[0]}%"
+        cube_predicate = " AND (m.producto ILIKE %(q)s OR m.cliente ILIKE %(q)s)"
+        fact_predicate = FACT_PREDICATE
+        numero_part = ROLLUP_NUMERO_PART
+    sql = ROLLUP_PARTS.format(
+        cube_predicate=cube_predicate, fact_predicate=fact_predicate, numero_part=numero_part
+    )
+    return sql, params
+
+
+def fetch_insights_rollup(conn, search_query: str, years: int,
+                          products: int = 10, clients: int = 15) -> dict:
+    """
+    Same aggregates as fetch_insights() from the monthly rollup: one query
+    grouping by product, client and month at once.
+    """
+    parts_sql, params = build_rollup_parts(search_query, years)
+    sql = f"""
+    {parts_sql}
+    SELECT
+      GROUPING(producto, cliente, mes) AS grp,
+      producto, cliente, mes,
+      SUM(importe) AS importe
+    FROM parts
+    GROUP BY GROUPING SETS ((producto), (cliente), (mes))
+    """
+    df = read_frame(conn, sql, params)
+    df["importe"] = pd.to_numeric(df["importe"]).astype(float)
+    # GROUPING() bits: producto=4, cliente=2, mes=1 (set when the column is aggregated away)
+    by_product = df[df["grp"] == 3]
+    by_client = df[(df["grp"] == 5) & df["cliente"].notna()]
+    by_month = df[df["grp"] == 6].sort_values("mes")
+    return {
+        "top_products": (
+            by_product.nlargest(products, "importe")
+            .rename(columns={"producto": "Producto", "importe": "Importe Total"})[["Producto", "Importe Total"]]
+            .reset_index(drop=True)
+        ),
+        "monthly": _monthly_series(
+            by_month.rename(columns={"mes": "Fecha", "importe": "Importe Total"})[["Fecha", "Importe Total"]]
+        ),
+        "top_clients": (
+            by_client.nlargest(clients, "importe")
+            .rename(columns={"cliente": "Cliente", "importe": "Importe Total"})[["Cliente", "Importe Total"]]
+            .reset_index(drop=True)
+        ),
+    }
@@ -0,0 +1,132 @@
+"""
+Search box syntax.
+
+Besides free text, the search box accepts field filters that are compiled to
+targeted predicates instead of one substring matched against every column:
+
+    cliente:acme producto:"toner 85a" almacen:lima desde:2024-01 doc:F001-*
+
+- Free words must all match (each one against product, client or document
+  number, like the single term always did); quotes keep a phrase together.
+- cliente:/producto:/almacen: match only that name (substring, any case).
+- doc: is an exact document number, or a prefix when it ends in "*"; both are
+  answered by the btree indexes of sql/004_search_fields.sql.
+- desde:/hasta: take YYYY, YYYY-MM or YYYY-MM-DD and narrow the years window
+  (hasta includes the whole year, month or day given).
+
+Filters with an unknown field are searched as plain words; filters whose
+value cannot be used (empty, bad date) are ignored and reported back.
+"""
+import shlex
+import unicodedata
+from datetime import date
+
+# Field names (accents and case ignored) and the filter they set
+SEARCH_FIELDS = {
+    "cliente": "cliente",
+    "cli": "cliente",
+    "producto": "producto",
+    "prod": "producto",
+    "almacen": "almacen",
+    "alm": "almacen",
+    "doc": "doc",
+    "documento": "doc",
+    "desde": "desde",
+    "hasta": "hasta",
+}
+
+
+class ParsedSearch:
+    """Free terms and field filters of one search box value."""
+
+    def __init__(self):
+        self.terms = []     # free words/phrases, all required
+        self.fields = []    # (field, value) name filters, all required
+        self.docs = []      # (value, is_prefix) document number filters
+        self.since = None   # first day included
+        self.until = None   # first day excluded
+        self.ignored = []   # filters that could not be used
+
+    @property
+    def is_plain(self) -> bool:
+        """A single free term and nothing else: the search as it worked before the syntax."""
+        return len(self.terms) == 1 and not (self.fields or self.docs or self.since or self.until)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.terms or self.fields or self.docs or self.since or self.until)
+
+
+def tokenize(search_query: str) -> list[str]:
+    """Whitespace-separated tokens, quotes grouping a phrase (unbalanced quotes are kept as text)."""
+    lexer = shlex.shlex(search_query, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ""
+    lexer.commenters = ""
+    try:
+        return list(lexer)
+    except ValueError:
+        return search_query.split()
+
+
+def fold_text(text: str) -> str:
+    """Lower-case ``text`` without accents ("Almacén" -> "almacen")."""
+    return "".join(
+        ch for ch in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(ch)
+    )
+
+
+def parse_period(value: str) -> tuple[date, date]:
+    """First day of a YYYY, YYYY-MM or YYYY-MM-DD period and first day after it."""
+    parts = [int(p) for p in value.split("-")]
+    if len(parts) == 1:
+        return date(parts[0], 1, 1), date(parts[0] + 1, 1, 1)
+    if len(parts) == 2:
+        year, month = parts
+        start = date(year, month, 1)
+        return start, date(year + month // 12, month % 12 + 1, 1)
+    if len(parts) == 3:
+        start = date(*parts)
+        return start, date.fromordinal(start.toordinal() + 1)
+    raise ValueError(value)
+
+
+def parse_search(search_query: str) -> ParsedSearch:
+    """Splits the search box value into free terms and field filters."""
+    parsed = ParsedSearch()
+    for token in tokenize(search_query.strip()):
+        name, sep, value = token.partition(":")
+        field = SEARCH_FIELDS.get(fold_text(name)) if sep else None
+        if field is None:
+            parsed.terms.append(token)
+            continue
+        value = value.strip()
+        if not value:
+            parsed.ignored.append(token)
+        elif field == "doc":
+            # Document numbers are stored upper-case; the value may arrive normalized
+            prefix = value.endswith("*")
+            value = value.rstrip("*").upper()
+            if value:
+                parsed.docs.append((value, prefix))
+            else:
+                parsed.ignored.append(token)
+        elif field in ("desde", "hasta"):
+            try:
+                start, end = parse_period(value)
+            except ValueError:
+                parsed.ignored.append(token)
+                continue
+            if field == "desde":
+                parsed.since = max(parsed.since or start, start)
+            else:
+                parsed.until = min(parsed.until or end, end)
+        else:
+            parsed.fields.append((field, value))
+    return parsed
+
+
+def is_plain_search(search_query: str) -> bool:
+    """Whether ``search_query`` is a single bare term (no quotes, no filters)."""
+    parsed = parse_search(search_query)
+    return parsed.is_plain and parsed.terms[0] == search_query.strip()
@@ -0,0 +1,370 @@
+"""
+Result cache shared between app processes.
+
+The in-process ResultCache (reportes_cache) dies with its Streamlit process
+and is not seen by the other replicas behind the load balancer, so each of
+them repeats the same searches and every deploy starts cold. This second tier
+keeps serialized results (DataFrames as Arrow IPC) in a directory all the
+replicas mount (SHARED_CACHE_DIR) or in Redis (SHARED_CACHE_REDIS):
+
+- Entries live SHARED_CACHE_TTL seconds. The disk store also keeps its total
+  size under SHARED_CACHE_MAX_MB, dropping the least recently read entries;
+  Redis does that itself with its maxmemory policy (allkeys-lru).
+- Keys include the newest sale timestamp (checked every
+  SHARED_CACHE_VERSION_INTERVAL seconds), so a new sale invalidates every
+  entry at once instead of serving results that miss it.
+- A process that misses takes a lock on the key while it queries, and the
+  others wait for its result instead of running the same query (single flight).
+  Waiters already hold a pooled connection (and maybe a job worker), so they
+  only wait SHARED_CACHE_WAIT seconds before running the query themselves.
+
+Store failures never fail a search: the query simply runs as without cache.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+from reportes_cache import RESULT_CACHE_TTL, cache_key
+from reportes_db import get_env
+from reportes_queries import active_sales_source, fetch_data_version
+
+# Directory shared by the app processes (empty = no disk store)
+SHARED_CACHE_DIR = get_env("SHARED_CACHE_DIR", "")
+# Redis URL, e.g. redis://cache:6379/0 (takes precedence over SHARED_CACHE_DIR)
+SHARED_CACHE_REDIS = get_env("SHARED_CACHE_REDIS", "")
+SHARED_CACHE_TTL = int(get_env("SHARED_CACHE_TTL", str(RESULT_CACHE_TTL * 6)))
+SHARED_CACHE_MAX_MB = int(get_env("SHARED_CACHE_MAX_MB", "2048"))
+# Seconds before a key's lock expires, e.g. left by a process that died while querying
+SHARED_CACHE_LOCK_TIMEOUT = int(get_env("SHARED_CACHE_LOCK_TIMEOUT", "300"))
+# Seconds a process waits for another one's result before querying itself
+SHARED_CACHE_WAIT = float(get_env("SHARED_CACHE_WAIT", "5"))
+# Seconds between checks of the newest sale
+SHARED_CACHE_VERSION_INTERVAL = float(get_env("SHARED_CACHE_VERSION_INTERVAL", "30"))
+
+# Result kinds worth sharing; keyset pages are small and cheap to recompute
+SHARED_KINDS = ("search", "summary", "insights", "top_products", "monthly", "top_clients", "comparison")
+
+# How often a process waiting on another one's lock looks for the result
+LOCK_POLL_INTERVAL = 0.2
+
+
+# -----------------------------
+# Serialization
+# -----------------------------
+def _frame_bytes(df: pd.DataFrame) -> bytes:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_value(value) -> bytes:
+    """
+    A DataFrame, or a dict of DataFrames and JSON scalars, as one JSON header
+    line followed by the frames as Arrow IPC streams.
+    """
+    items = {"": value} if isinstance(value, pd.DataFrame) else value
+    header = {"frame": isinstance(value, pd.DataFrame), "scalars": {}, "frames": {}}
+    blobs = []
+    for name, item in items.items():
+        if isinstance(item, pd.DataFrame):
+            blob = _frame_bytes(item)
+            header["frames"][name] = len(blob)
+            blobs.append(blob)
+        else:
+            header["scalars"][name] = item
+    return json.dumps(header).encode() + b"\n" + b"".join(blobs)
+
+
+def decode_value(data: bytes):
+    head, _, body = data.partition(b"\n")
+    header = json.loads(head)
+    value = dict(header["scalars"])
+    offset = 0
+    for name, length in header["frames"].items():
+        value[name] = pa.ipc.open_stream(io.BytesIO(body[offset:offset + length])).read_all().to_pandas()
+        offset += length
+    return value[""] if header["frame"] else value
+
+
+# -----------------------------
+# Stores
+# -----------------------------
+class DiskStore:
+    """One file per entry; modification time = when stored, access time = last read."""
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # estimate, rescanned when it goes over the budget
+        self.evictions = 0
+
+    def get(self, name: str) -> bytes | None:
+        path = self.directory / f"{name}.arrow"
+        try:
+            stored_at = path.stat().st_mtime
+            if time.time() - stored_at > self.ttl:
+                return None
+            data = path.read_bytes()
+            os.utime(path, (time.time(), stored_at))
+        except FileNotFoundError:
+            return None
+        return data
+
+    def set(self, name: str, data: bytes) -> None:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+        path = self.directory / f"{name}.arrow"
+        tmp = self.directory / f".{name}.{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict_locked()
+
+    def lock(self, name: str, timeout: float) -> bool:
+        path = self.directory / f"{name}.lock"
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime <= timeout:
+                    return False
+                # Left behind by a process that died while querying
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            return self.lock(name, timeout)
+        os.close(fd)
+        return True
+
+    def unlock(self, name: str) -> None:
+        try:
+            (self.directory / f"{name}.lock").unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = self._scan_size()
+            return {"bytes": self._bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+    def _entries(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".arrow")]
+
+    def _scan_size(self) -> int:
+        total = 0
+        for entry in self._entries():
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                # Evicted by another process meanwhile
+                pass
+        return total
+
+    def _evict_locked(self) -> None:
+        # Expired entries first, then least recently read, down to 90% of the budget
+        now = time.time()
+        entries = []
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((now - st.st_mtime <= self.ttl, st.st_atime, st.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, _, size, _ in entries)
+        for fresh, _, size, path in entries:
+            if fresh and total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+        self._bytes = total
+
+
+class RedisStore:
+    """Entries as keys with an expiry; size eviction is Redis' maxmemory policy."""
+
+    def __init__(self, url: str, ttl: float):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHARED_CACHE_REDIS requiere el paquete redis (pip install redis).") from None
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self._tokens = {}
+
+    def get(self, name: str) -> bytes | None:
+        return self.client.get(f"expera:cache:{name}")
+
+    def set(self, name: str, data: bytes) -> None:
+        self.client.set(f"expera:cache:{name}", data, ex=int(self.ttl))
+
+    def lock(self, name: str, timeout: float) -> bool:
+        token = uuid.uuid4().hex
+        if self.client.set(f"expera:lock:{name}", token, nx=True, ex=int(timeout)):
+            self._tokens[name] = token
+            return True
+        return False
+
+    def unlock(self, name: str) -> None:
+        token = self._tokens.pop(name, None)
+        key = f"expera:lock:{name}"
+        if token is not None and self.client.get(key) == token.encode():
+            self.client.delete(key)
+
+    def stats(self) -> dict:
+        memory = self.client.info("memory")
+        return {"bytes": memory.get("used_memory", 0), "max_bytes": memory.get("maxmemory", 0), "evictions": 0}
+
+
+# -----------------------------
+# Shared cache
+# -----------------------------
+class SharedCache:
+    """Wraps fetch functions so their results go through a shared store."""
+
+    def __init__(self, store: DiskStore | RedisStore, lock_timeout: float, wait: float, version_interval: float):
+        self.store = store
+        self.lock_timeout = lock_timeout
+        self.wait = wait
+        self.version_interval = version_interval
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked = 0.0
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "waits": 0,
+            "wait_timeouts": 0,
+            "errors": 0,
+            "invalidations": 0,
+        }
+
+    def wrap(self, kind: str, fetch):
+        """``fetch(conn, search_query, *args)`` answered from the store when it can be."""
+        if kind not in SHARED_KINDS:
+            return fetch
+
+        def shared_fetch(conn, search_query: str, *args):
+            return self.fetch(conn, kind, fetch, search_query, *args)
+        return shared_fetch
+
+    def fetch(self, conn, kind: str, fetch, search_query: str, *args):
+        name = self._name(conn, kind, search_query, *args)
+        value = self._get(name)
+        if value is not None:
+            return value
+        deadline = time.monotonic() + self.wait
+        waited = False
+        while not self._try_lock(name):
+            # Another process is computing it: wait for its result
+            if not waited:
+                self._count("waits")
+                waited = True
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = self._get(name, count_miss=False)
+            if value is not None:
+                return value
+            if time.monotonic() > deadline:
+                self._count("wait_timeouts")
+                return fetch(conn, search_query, *args)
+        try:
+            # It may have been stored between our miss and taking the lock
+            value = self._get(name, count_miss=False)
+            if value is not None:
+                return value
+            value = fetch(conn, search_query, *args)
+            try:
+                self.store.set(name, encode_value(value))
+            except Exception:
+                self._count("errors")
+            return value
+        finally:
+            try:
+                self.store.unlock(name)
+            except Exception:
+                self._count("errors")
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["version"] = self._version
+        try:
+            s.update(self.store.stats())
+        except Exception:
+            s.update({"bytes": 0, "max_bytes": 0, "evictions": 0})
+        s["backend"] = "redis" if isinstance(self.store, RedisStore) else "disk"
+        return s
+
+    def _name(self, conn, kind: str, search_query: str, *args) -> str:
+        key = (*cache_key(kind, search_query, *args), active_sales_source(), self._data_version(conn))
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def _data_version(self, conn) -> str:
+        """Newest sale timestamp, re-read at most every version_interval seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_interval:
+                return self._version
+        version = str(fetch_data_version(conn))
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._stats["invalidations"] += 1
+            self._version, self._version_checked = version, now
+        return version
+
+    def _get(self, name: str, count_miss: bool = True):
+        try:
+            data = self.store.get(name)
+            value = decode_value(data) if data is not None else None
+        except Exception:
+            self._count("errors")
+            value = None
+        if value is not None:
+            self._count("hits")
+        elif count_miss:
+            self._count("misses")
+        return value
+
+    def _try_lock(self, name: str) -> bool:
+        try:
+            return self.store.lock(name, self.lock_timeout)
+        except Exception:
+            # Store unreachable: compute without coordination
+            self._count("errors")
+            return True
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self._stats[stat] += 1
+
+
+def create_shared_cache() -> SharedCache | None:
+    """The configured shared cache, or None when neither store is set."""
+    if SHARED_CACHE_REDIS:
+        store = RedisStore(SHARED_CACHE_REDIS, SHARED_CACHE_TTL)
+    elif SHARED_CACHE_DIR:
+        store = DiskStore(SHARED_CACHE_DIR, SHARED_CACHE_TTL, SHARED_CACHE_MAX_MB * 1024**2)
+    else:
+        return None
+    return SharedCache(store, SHARED_CACHE_LOCK_TIMEOUT, SHARED_CACHE_WAIT, SHARED_CACHE_VERSION_INTERVAL)
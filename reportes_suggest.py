@@ -0,0 +1,157 @@
+"""
+Autocomplete for the search box.
+
+An in-memory index of product names, client names and recent document
+numbers answers each fragment the user types with exact entities, turned into
+field-scoped searches (producto:"…", cliente:"…", doc:…) so the search that
+follows is a targeted one instead of a substring scan over every column.
+
+Every word of a name is a sorted key (accents and case folded), so a fragment
+matches the start of any word ("epson" -> "TINTA EPSON T664") through a
+binary search over the keys; the lookup never touches the database. A thread
+rebuilds the index every SUGGEST_REFRESH seconds and swaps it in at once.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from reportes_db import ConnectionPool, ReplicaRouter, get_env
+from reportes_search import fold_text
+
+# Seconds between index rebuilds
+SUGGEST_REFRESH = float(get_env("SUGGEST_REFRESH", "900"))
+# Document numbers of the last N days are suggested
+SUGGEST_DOC_DAYS = int(get_env("SUGGEST_DOC_DAYS", "90"))
+# Suggestions shown per fragment
+SUGGEST_LIMIT = int(get_env("SUGGEST_LIMIT", "8"))
+
+# Fragments shorter than this get no suggestions (too many matches to be useful)
+SUGGEST_MIN_LENGTH = 2
+# Matching keys ranked per lookup; bounds the time of very common prefixes
+SUGGEST_SCAN = 400
+
+# kind -> query returning the names/numbers to index
+SUGGEST_SOURCES = {
+    "producto": "SELECT DISTINCT nombre FROM extcs.productos WHERE servicio = FALSE AND nombre IS NOT NULL",
+    "cliente": "SELECT DISTINCT nombre FROM tcros.personas WHERE nombre IS NOT NULL",
+    "doc": """
+        SELECT DISTINCT numero FROM cmrlz.notas_pedido_cab
+        WHERE creado >= now() - make_interval(days => %(days)s)
+          AND anulada IS FALSE AND venta_id IS NOT NULL AND numero IS NOT NULL
+    """,
+}
+
+
+def suggestion_query(kind: str, value: str) -> str:
+    """Search box value that targets exactly this entity."""
+    if kind == "doc":
+        return f"doc:{value}"
+    return f'{kind}:"{value.replace(chr(34), "")}"'
+
+
+class SuggestIndex:
+    """Sorted word keys over the entities of SUGGEST_SOURCES, rebuilt in the background."""
+
+    def __init__(self, pool: ConnectionPool | ReplicaRouter, refresh: float, doc_days: int):
+        self.pool = pool
+        self.refresh_interval = refresh
+        self.doc_days = doc_days
+        # (keys, refs, firsts, entities): keys sorted, refs[i] = index in entities
+        # of keys[i]'s entity, firsts[i] = 1 when keys[i] starts at its first word
+        self._data = ([], array("I"), b"", [])
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "entities": 0,
+            "keys": 0,
+            "builds": 0,
+            "errors": 0,
+            "last_build": None,
+            "last_duration": 0.0,
+            "lookups": 0,
+            "lookup_time_max": 0.0,
+        }
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="expera-suggest", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def refresh(self) -> None:
+        """Reloads the entities from the database and swaps the new index in."""
+        start = time.perf_counter()
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            rows = []
+            for kind, sql in SUGGEST_SOURCES.items():
+                cur.execute(sql, {"days": self.doc_days})
+                rows.extend((kind, value.strip()) for (value,) in cur.fetchall() if value.strip())
+        self.load(rows)
+        with self._lock:
+            self._stats["builds"] += 1
+            self._stats["last_build"] = datetime.now().isoformat(timespec="seconds")
+            self._stats["last_duration"] = time.perf_counter() - start
+
+    def load(self, entities: list[tuple[str, str]]) -> None:
+        """Builds the index from (kind, value) pairs."""
+        pairs = []
+        for ref, (kind, value) in enumerate(entities):
+            words = fold_text(value).split()
+            # One key per word start: the rest of the name from that word on
+            for i in range(len(words)):
+                pairs.append((" ".join(words[i:]), ref, i == 0))
+        pairs.sort()
+        keys = [key for key, _, _ in pairs]
+        refs = array("I", (ref for _, ref, _ in pairs))
+        firsts = bytes(first for _, _, first in pairs)
+        self._data = (keys, refs, firsts, list(entities))
+        with self._lock:
+            self._stats["entities"] = len(entities)
+            self._stats["keys"] = len(keys)
+
+    def suggest(self, fragment: str, limit: int = SUGGEST_LIMIT) -> list[tuple[str, str]]:
+        """
+        Up to ``limit`` (kind, value) entities with a word starting with
+        ``fragment``: matches on the first word first, then shorter values.
+        """
+        start = time.perf_counter()
+        prefix = " ".join(fold_text(fragment).split())
+        if len(prefix) < SUGGEST_MIN_LENGTH:
+            return []
+        keys, refs, firsts, entities = self._data
+        first_words = {}  # ref -> matched on its first word
+        i = bisect_left(keys, prefix)
+        end = min(len(keys), i + SUGGEST_SCAN)
+        while i < end and keys[i].startswith(prefix):
+            first_words[refs[i]] = first_words.get(refs[i], False) or bool(firsts[i])
+            i += 1
+        ranked = sorted(first_words, key=lambda ref: (not first_words[ref], len(entities[ref][1]), entities[ref][1]))
+        result = [entities[ref] for ref in ranked[:limit]]
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._stats["lookups"] += 1
+            self._stats["lookup_time_max"] = max(self._stats["lookup_time_max"], elapsed)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # e.g. database unreachable: keep the previous index until the next round
+                with self._lock:
+                    self._stats["errors"] += 1
+            self._stop.wait(self.refresh_interval)
+
+
+def create_suggest_index(pool: ConnectionPool | ReplicaRouter) -> SuggestIndex:
+    return SuggestIndex(pool, SUGGEST_REFRESH, SUGGEST_DOC_DAYS)
@@ -0,0 +1,15 @@
+-- Índices trigram para el buscador (SEARCH_BACKEND=trigram / auto).
+--
+-- Permiten que los filtros ILIKE '%texto%' sobre nombres de productos y
+-- clientes usen un índice GIN en lugar de recorrer las tablas completas.
+-- Ejecutar con psql (CREATE INDEX CONCURRENTLY no admite transacciones):
+--
+--   psql -h $PG_HOST -p $PG_PORT -U $PG_USER -d $PG_DB -f sql/001_search_trgm.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS productos_nombre_trgm_idx
+    ON extcs.productos USING gin (nombre gin_trgm_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS personas_nombre_trgm_idx
+    ON tcros.personas USING gin (nombre gin_trgm_ops);
@@ -0,0 +1,69 @@
+-- Tabla de hechos de ventas desnormalizada (SALES_SOURCE=fact / auto).
+--
+-- Contiene las líneas de notas de pedido ya filtradas (no anuladas, con venta
+-- y sin servicios) con los nombres de producto, cliente y almacén resueltos,
+-- para que las búsquedas no repitan el join de 7 tablas sobre el ERP.
+-- Se llena y se mantiene con `python reportes_fact.py` (ver README).
+--
+--   psql -h $PG_HOST -p $PG_PORT -U $PG_USER -d $PG_DB -f sql/002_sales_fact.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE SCHEMA IF NOT EXISTS bi;
+
+-- Los tipos se copian de las tablas de origen.
+CREATE TABLE IF NOT EXISTS bi.ventas_fact AS
+SELECT
+  det.id                                     AS det_id,
+  cab.id                                     AS cab_id,
+  cab.creado                                 AS creado,
+  prod.id                                    AS producto_id,
+  prod.nombre                                AS producto,
+  cli.id                                     AS cliente_id,
+  cli.nombre                                 AS cliente,
+  alm.id                                     AS almacen_id,
+  alm.nombre                                 AS almacen,
+  det.cantidad                               AS cantidad,
+  det.precio_unitario_venta                  AS precio_unitario,
+  (det.cantidad * det.precio_unitario_venta) AS importe,
+  cab.numero                                 AS numero,
+  vc.enlace_pdf                              AS enlace_pdf
+FROM cmrlz.notas_pedido_cab cab
+JOIN cmrlz.notas_pedido_det det ON det.nota_pedido_id = cab.id
+JOIN extcs.productos prod       ON prod.id = det.producto_id
+LEFT JOIN tcros.direcciones dir ON dir.id = cab.direccion_cliente_id
+LEFT JOIN tcros.personas cli    ON cli.id = dir.persona_id
+LEFT JOIN extcs.almacenes alm   ON alm.id = cab.almacen_id
+LEFT JOIN cmrlz.ventas_cab vc   ON vc.id = cab.venta_id
+WITH NO DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ventas_fact_det_id_idx
+    ON bi.ventas_fact (det_id);
+
+-- Ventana de años y paginación por clave (creado DESC, cab_id DESC, det_id DESC)
+CREATE INDEX IF NOT EXISTS ventas_fact_keyset_idx
+    ON bi.ventas_fact (creado DESC, cab_id DESC, det_id DESC);
+
+CREATE INDEX IF NOT EXISTS ventas_fact_producto_trgm_idx
+    ON bi.ventas_fact USING gin (producto gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ventas_fact_cliente_trgm_idx
+    ON bi.ventas_fact USING gin (cliente gin_trgm_ops);
+
+-- Nº de documento exacto o por prefijo (doc: en el buscador) con cualquier
+-- collation. Reemplaza al btree simple de versiones anteriores.
+DROP INDEX IF EXISTS bi.ventas_fact_numero_idx;
+
+CREATE INDEX IF NOT EXISTS ventas_fact_numero_pattern_idx
+    ON bi.ventas_fact (numero varchar_pattern_ops);
+
+-- Historial de refrescos; la app solo lee la tabla de hechos si el último
+-- refresco terminó hace menos de FACT_MAX_AGE_MINUTES.
+CREATE TABLE IF NOT EXISTS bi.ventas_fact_refresh (
+    id            bigserial PRIMARY KEY,
+    started_at    timestamptz NOT NULL,
+    finished_at   timestamptz NOT NULL,
+    full_refresh  boolean     NOT NULL,
+    window_start  timestamptz,
+    rows_deleted  bigint      NOT NULL,
+    rows_inserted bigint      NOT NULL
+);
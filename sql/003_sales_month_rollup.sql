@@ -0,0 +1,46 @@
+-- Cubo mensual de ventas para la pestaña Insights (INSIGHTS_ROLLUP=auto).
+--
+-- Una fila por mes × producto × cliente × almacén con las líneas, unidades e
+-- importe de bi.ventas_fact. reportes_fact.py lo mantiene en la misma
+-- transacción que la tabla de hechos: cada refresco incremental recalcula
+-- solo los meses tocados por su ventana. Requiere sql/002_sales_fact.sql.
+--
+--   psql -h $PG_HOST -p $PG_PORT -U $PG_USER -d $PG_DB -f sql/003_sales_month_rollup.sql
+
+CREATE TABLE IF NOT EXISTS bi.ventas_mes (
+    mes          date    NOT NULL,
+    producto_id  bigint,
+    producto     varchar(250),
+    cliente_id   bigint,
+    cliente      varchar(250),
+    almacen_id   bigint,
+    almacen      varchar(120),
+    lineas       bigint  NOT NULL,
+    cantidad     numeric,
+    importe      numeric
+);
+
+CREATE INDEX IF NOT EXISTS ventas_mes_mes_idx
+    ON bi.ventas_mes (mes);
+
+CREATE INDEX IF NOT EXISTS ventas_mes_producto_trgm_idx
+    ON bi.ventas_mes USING gin (producto gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS ventas_mes_cliente_trgm_idx
+    ON bi.ventas_mes USING gin (cliente gin_trgm_ops);
+
+-- Las búsquedas por Nº de documento no se pueden responder desde el cubo;
+-- esas líneas se leen de la tabla de hechos con este índice.
+CREATE INDEX IF NOT EXISTS ventas_fact_numero_trgm_idx
+    ON bi.ventas_fact USING gin (numero gin_trgm_ops);
+
+-- Carga inicial si la tabla de hechos ya tiene datos
+INSERT INTO bi.ventas_mes
+SELECT
+  date_trunc('month', creado)::date, producto_id, producto, cliente_id, cliente,
+  almacen_id, almacen, count(*), sum(cantidad), sum(importe)
+FROM bi.ventas_fact
+WHERE NOT EXISTS (SELECT 1 FROM bi.ventas_mes)
+GROUP BY 1, 2, 3, 4, 5, 6, 7;
+
+ANALYZE bi.ventas_mes;
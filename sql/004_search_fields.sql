@@ -0,0 +1,11 @@
+-- Índices para los filtros doc: de la sintaxis de búsqueda (reportes_search.py).
+--
+-- doc:F001-00012345 compara el número completo y doc:F001-* usa LIKE con
+-- prefijo. Con varchar_pattern_ops ambos se resuelven con el índice btree
+-- sea cual sea la collation de la base. El índice equivalente de
+-- bi.ventas_fact está en sql/002_sales_fact.sql (se puede volver a ejecutar).
+--
+--   psql -h $PG_HOST -p $PG_PORT -U $PG_USER -d $PG_DB -f sql/004_search_fields.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notas_pedido_cab_numero_pattern_idx
+    ON cmrlz.notas_pedido_cab (numero varchar_pattern_ops);